@@ -0,0 +1,59 @@
+import asyncio
+import hashlib
+import os
+
+from http_session import ResponseTooLarge, iter_response
+
+# --- Прием вложений без временных файлов ---
+# Байты вложения идут с CDN Discord прямо в кеш аудио (аудиофайлы) или на stdin FFmpeg (видео);
+# sha256 для ключа кеша считается на лету, лимит размера проверяется по мере скачивания.
+MAX_ATTACHMENT_MB = int(os.getenv("MAX_ATTACHMENT_MB", "100"))
+MAX_ATTACHMENT_BYTES = MAX_ATTACHMENT_MB * 1024 * 1024
+VIDEO_EXTENSIONS = {".mp4", ".mkv", ".avi", ".mov"}
+# В mp4/mov индекс (moov) часто лежит в конце файла, и из трубы такой файл не прочитать:
+# FFmpeg сам читает их по ссылке, запрашивая нужные диапазоны
+SEEKABLE_ONLY_EXTENSIONS = {".mp4", ".mov"}
+
+
+async def _hashing(chunks, digest):
+    async for chunk in chunks:
+        digest.update(chunk)
+        yield chunk
+
+
+async def _write(chunks, path):
+    with open(path, "wb") as f:
+        async for chunk in chunks:
+            f.write(chunk)
+
+
+async def ingest_attachment(attachment, cache, pool):
+    """Скачивает вложение в кеш (для видео - только звуковую дорожку) и возвращает путь со ссылкой кеша."""
+    ext = os.path.splitext(attachment.filename)[1].lower()
+    if attachment.size > MAX_ATTACHMENT_BYTES:
+        raise ResponseTooLarge(f"Файл больше {MAX_ATTACHMENT_MB} МБ.")
+
+    if ext in SEEKABLE_ONLY_EXTENSIONS:
+        audio_path = await pool.extract_audio(attachment.url, cache.staging_path())
+        try:
+            # Ключ по содержимому извлеченной дорожки: повторная загрузка того же видео не займет места дважды
+            key = await asyncio.to_thread(cache.key_for_file, audio_path)
+            return cache.acquire(key) or cache.put(key, audio_path)
+        finally:
+            if os.path.exists(audio_path):
+                os.remove(audio_path)
+
+    digest = hashlib.sha256()
+    chunks = _hashing(iter_response(attachment.url, MAX_ATTACHMENT_BYTES), digest)
+    staging = cache.staging_path(".mka" if ext in VIDEO_EXTENSIONS else ext)
+    try:
+        if ext in VIDEO_EXTENSIONS:
+            await pool.extract_audio_stream(chunks, staging)
+        else:
+            await _write(chunks, staging)
+        # Тот же ключ, что у AudioCache.key_for_file, поэтому старые записи кеша остаются действительными
+        key = f"sha256-{digest.hexdigest()}"
+        return cache.acquire(key) or cache.put(key, staging)
+    finally:
+        if os.path.exists(staging):
+            os.remove(staging)
@@ -0,0 +1,177 @@
+import hashlib
+import os
+import re
+import threading
+import uuid
+from collections import OrderedDict
+
+from metrics import register_cache
+
+# --- Кеш аудиофайлов на диске ---
+# Файлы адресуются по содержимому: "экстрактор-id видео" для yt-dlp и sha256
+# для вложений. Размер кеша ограничен, вытесняются давно не использованные файлы,
+# но только те, которые сейчас не стоят ни в одной очереди и не играют (счетчик ссылок).
+AUDIO_CACHE_DIR = os.getenv("AUDIO_CACHE_DIR", "audio_cache")
+AUDIO_CACHE_MAX_MB = int(os.getenv("AUDIO_CACHE_MAX_MB", "2048"))
+
+
+def _safe_key(key):
+    return re.sub(r"[^A-Za-z0-9_.-]", "_", key)
+
+
+class AudioCache:
+    """Ограниченный по размеру LRU-кеш файлов со счетчиком ссылок."""
+
+    def __init__(self, directory=AUDIO_CACHE_DIR, max_bytes=AUDIO_CACHE_MAX_MB * 1024 * 1024):
+        self.directory = os.path.abspath(directory)
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()  # key -> (путь, размер), от давно использованных к недавним
+        self._refs = {}  # key -> количество владельцев
+        self._stale = {}  # key -> [(путь, размер)] замененных файлов, которые еще кто-то держит
+        self._total = 0
+        self._hits = 0
+        self._misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(self.directory, exist_ok=True)
+        self._scan()
+
+    def _scan(self):
+        """Восстанавливает индекс по файлам на диске, порядок LRU - по времени изменения."""
+        files = []
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if os.path.isfile(path) and not name.startswith("."):
+                files.append((os.path.getmtime(path), name, path))
+        for _, name, path in sorted(files):
+            size = os.path.getsize(path)
+            key = os.path.splitext(name)[0]
+            old = self._entries.pop(key, None)
+            if old:
+                # Замененный файл с другим расширением, который не успели удалить до перезапуска
+                self._total -= old[1]
+                self._remove(old[0])
+            self._entries[key] = (path, size)
+            self._total += size
+
+    @staticmethod
+    def key_for_video(extractor, video_id):
+        """Ключ трека yt-dlp или None, если данных для ключа нет."""
+        if not extractor or not video_id:
+            return None
+        return _safe_key(f"{extractor}-{video_id}".lower())
+
+    @staticmethod
+    def key_for_file(path):
+        """Ключ по содержимому файла (для вложений)."""
+        digest = hashlib.sha256()
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1024 * 1024), b""):
+                digest.update(block)
+        return f"sha256-{digest.hexdigest()}"
+
+    def staging_path(self, ext=""):
+        """Путь для временного файла в каталоге кеша: put потом переносит его без копирования.
+
+        Имя начинается с точки, поэтому недописанные файлы не попадают в индекс при перезапуске.
+        """
+        return os.path.join(self.directory, f".tmp-{uuid.uuid4().hex}{ext}")
+
+    def key_of(self, path):
+        """Ключ файла, если он лежит в кеше, иначе None."""
+        if not path or os.path.dirname(os.path.abspath(path)) != self.directory:
+            return None
+        return os.path.splitext(os.path.basename(path))[0]
+
+    def acquire(self, key):
+        """Возвращает путь к файлу и увеличивает счетчик ссылок, или None при промахе."""
+        if key is None:
+            return None
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or not os.path.exists(entry[0]):
+                self._misses += 1
+                return None
+            self._hits += 1
+            self._entries.move_to_end(key)
+            self._refs[key] = self._refs.get(key, 0) + 1
+        try:
+            # Время изменения хранит порядок LRU между перезапусками
+            os.utime(entry[0])
+        except OSError:
+            pass
+        return entry[0]
+
+    def put(self, key, src_path):
+        """Переносит файл в кеш и возвращает новый путь (со счетчиком ссылок +1)."""
+        ext = os.path.splitext(src_path)[1]
+        path = os.path.join(self.directory, f"{key}{ext}")
+        size = os.path.getsize(src_path)
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old and old[0] == path:
+                self._total -= old[1]
+            elif old and self._refs.get(key):
+                # Старый файл (с другим расширением) еще играет или стоит в очереди -
+                # удалим его, когда отпустят последнюю ссылку на ключ
+                self._stale.setdefault(key, []).append(old)
+            elif old:
+                self._total -= old[1]
+                self._remove(old[0])
+            os.replace(src_path, path)
+            self._entries[key] = (path, size)
+            self._total += size
+            self._refs[key] = self._refs.get(key, 0) + 1
+            self._evict()
+        return path
+
+    def release(self, path):
+        """Освобождает ссылку на файл кеша. Для файлов вне кеша возвращает False."""
+        key = self.key_of(path)
+        if key is None:
+            return False
+        with self._lock:
+            count = self._refs.get(key, 0) - 1
+            if count > 0:
+                self._refs[key] = count
+            else:
+                self._refs.pop(key, None)
+                for stale_path, size in self._stale.pop(key, ()):
+                    self._total -= size
+                    self._remove(stale_path)
+            self._evict()
+        return True
+
+    def _evict(self):
+        if self._total <= self.max_bytes:
+            return
+        for key in list(self._entries):
+            if self._total <= self.max_bytes:
+                break
+            if self._refs.get(key):
+                continue  # файл играет или стоит в очереди
+            path, size = self._entries.pop(key)
+            self._total -= size
+            self._remove(path)
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            print(f"Ошибка при удалении файла кеша '{path}': {e}")
+
+    def stats(self):
+        with self._lock:
+            return {
+                "files": len(self._entries),
+                "bytes": self._total,
+                "in_use": len(self._refs),
+                "hits": self._hits,
+                "misses": self._misses,
+            }
+
+
+audio_cache = AudioCache()
+register_cache("audio", audio_cache.stats)
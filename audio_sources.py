@@ -0,0 +1,118 @@
+import asyncio
+import json
+import os
+import subprocess
+import threading
+
+import discord
+
+from metrics import external_call_seconds
+
+# --- Источники звука для голосовых каналов ---
+# FFmpegPCMAudio декодирует звук в PCM, после чего discord.py заново кодирует его в Opus
+# в нашем процессе. FFmpegOpusAudio отдает готовые Opus-пакеты: если исходник уже в Opus
+# (webm/ogg от yt-dlp, файлы кеша), FFmpeg только копирует поток без перекодирования.
+OPUS_PASSTHROUGH = os.getenv("OPUS_PASSTHROUGH", "1") == "1"
+FFPROBE = "ffmpeg/ffprobe"
+OPUS_BITRATE = 128  # кбит/с при перекодировании не-Opus исходников
+
+
+def probe_codec(source, executable=None):
+    """Возвращает (кодек, битрейт в кбит/с) первой аудиодорожки. Подходит как method для from_probe."""
+    result = subprocess.run(
+        [FFPROBE, "-v", "quiet", "-print_format", "json", "-show_streams", "-select_streams", "a:0", source],
+        capture_output=True, text=True, timeout=20
+    )
+    streams = json.loads(result.stdout or "{}").get("streams") or [{}]
+    codec = streams[0].get("codec_name")
+    bitrate = streams[0].get("bit_rate")
+    return codec, max(16, min(int(bitrate) // 1000, 512)) if bitrate else None
+
+
+async def file_source(path, executable):
+    """Источник для локального файла: копирование, если файл уже в Opus, иначе кодирование в FFmpeg."""
+    if not OPUS_PASSTHROUGH:
+        return discord.FFmpegPCMAudio(path, executable=executable)
+    try:
+        return await discord.FFmpegOpusAudio.from_probe(path, method=probe_codec, executable=executable)
+    except Exception as e:
+        print(f"Ошибка при определении кодека '{path}': {e}. Перекодирую в Opus.")
+        return discord.FFmpegOpusAudio(path, executable=executable, bitrate=OPUS_BITRATE)
+
+
+def stream_audio_source(url, executable, acodec=None, before_options=None):
+    """Источник для прямой ссылки на поток; кодек берется из данных yt-dlp без лишнего ffprobe."""
+    if not OPUS_PASSTHROUGH:
+        return discord.FFmpegPCMAudio(url, executable=executable, before_options=before_options, options="-vn")
+    # discord.py включает копирование потока (-c:a copy), когда codec == "opus"
+    return discord.FFmpegOpusAudio(url, executable=executable, codec=acodec, bitrate=OPUS_BITRATE,
+                                   before_options=before_options, options="-vn")
+
+
+def encoded_source(path, executable):
+    """Источник для файла, который точно не в Opus (например, mp3 от edge_tts): кодирование в FFmpeg."""
+    if not OPUS_PASSTHROUGH:
+        return discord.FFmpegPCMAudio(path, executable=executable)
+    return discord.FFmpegOpusAudio(path, executable=executable, bitrate=OPUS_BITRATE)
+
+
+class Interjection(discord.AudioSource):
+    """Фраза, вставленная в уже играющий источник: пока она звучит, источник стоит на месте.
+
+    Подставляется через voice_client.source, поэтому плеер не останавливается и after
+    играющего источника (например, переход к следующей песне) не вызывается.
+    done() вызывается из потока плеера, когда фраза доиграла или плеер остановили.
+    """
+
+    def __init__(self, phrase, underlying, done):
+        self.phrase = phrase
+        self.underlying = underlying
+        self.done = done
+        self._speaking = True
+        self._lock = threading.Lock()
+
+    def read(self):
+        if self._speaking:
+            data = self.phrase.read()
+            if data:
+                return data
+            self.finish_phrase()
+        return self.underlying.read()
+
+    def is_opus(self):
+        # Плеер спрашивает после каждого read(), так что ответ относится к только что отданному пакету
+        return self.phrase.is_opus() if self._speaking else self.underlying.is_opus()
+
+    def finish_phrase(self):
+        with self._lock:
+            if not self._speaking:
+                return
+            self._speaking = False
+        self.phrase.cleanup()
+        self.done()
+
+    def cleanup(self):
+        self.finish_phrase()
+        self.underlying.cleanup()
+
+    def __del__(self):
+        # Вложенные источники чистят себя сами, а done() при сборке мусора звать поздно:
+        # цикл событий к этому моменту может быть уже закрыт
+        pass
+
+
+async def encode_opus_once(path, executable):
+    """Один раз перекодирует файл в .opus рядом с ним и возвращает путь к результату."""
+    opus_path = f"{os.path.splitext(path)[0]}.opus"
+    if os.path.exists(opus_path) and os.path.getmtime(opus_path) >= os.path.getmtime(path):
+        return opus_path
+    with external_call_seconds.time(service="ffmpeg", op="encode_opus"):
+        process = await asyncio.create_subprocess_exec(
+            executable, "-y", "-loglevel", "error", "-i", path, "-vn", "-c:a", "libopus", "-b:a", f"{OPUS_BITRATE}k",
+            "-ar", "48000", "-ac", "2", opus_path,
+            stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.PIPE
+        )
+        _, stderr = await process.communicate()
+    if process.returncode != 0:
+        raise Exception(f"Ошибка при кодировании '{path}' в Opus: {stderr.decode(errors='ignore')}")
+    return opus_path
@@ -0,0 +1,167 @@
+"""Синтетическое сравнение профилей намерений чайника (gateway_profile).
+
+Для каждого профиля в отдельном процессе создается бот, в его кеш загружается набор
+синтетических серверов (GUILD_CREATE без подключения к Discord), после чего через
+обработчики шлюза прогоняется поток событий. События, на которые профиль не подписан,
+Discord бы не прислал, поэтому они не доставляются.
+
+Выводит RSS после загрузки серверов, число доставленных событий в секунду и время их обработки.
+Запуск: python benchmarks/bench_gateway.py [--guilds 200] [--members 500] [--seconds 5]
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import resource
+import subprocess
+import sys
+import time
+
+import discord
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from gateway_profile import make_bot  # noqa: E402
+
+PROFILES = ("full", "lean")
+ONLINE_SHARE = 0.3
+# Частоты событий на одного участника в секунду (порядок величин для активных серверов)
+EVENT_RATES = {
+    "PRESENCE_UPDATE": ("presences", 0.02),
+    "GUILD_MEMBER_UPDATE": ("members", 0.0005),
+    "TYPING_START": ("guild_typing", 0.003),
+    "MESSAGE_CREATE": ("guild_messages", 0.002),
+    "VOICE_STATE_UPDATE": ("voice_states", 0.0005),
+}
+
+
+def rss_mb():
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def user(user_id):
+    return {"id": str(user_id), "username": f"user{user_id}", "discriminator": "0", "avatar": None,
+            "global_name": None}
+
+
+def guild_payload(guild_id, members):
+    first = guild_id * 100000
+    member_ids = range(first, first + members)
+    return {
+        "id": str(guild_id),
+        "name": f"guild{guild_id}",
+        "owner_id": str(first),
+        "member_count": members,
+        "large": members > 250,
+        "roles": [{"id": str(guild_id), "name": "@everyone", "permissions": "0", "position": 0, "color": 0,
+                   "hoist": False, "managed": False, "mentionable": False, "flags": 0}],
+        "channels": [{"id": str(guild_id * 10), "type": 0, "name": "general", "position": 0,
+                      "permission_overwrites": [], "guild_id": str(guild_id)}],
+        "members": [{"user": user(member_id), "roles": [], "joined_at": "2024-01-01T00:00:00+00:00",
+                     "deaf": False, "mute": False, "flags": 0} for member_id in member_ids],
+        "presences": [{"user": {"id": str(member_id)}, "status": "online", "activities": [],
+                       "client_status": {"desktop": "online"}}
+                      for member_id in member_ids if random.random() < ONLINE_SHARE],
+        "voice_states": [],
+        "emojis": [],
+        "stickers": [],
+        "threads": [],
+    }
+
+
+def event_payload(event, guild_id, member_id):
+    guild = str(guild_id)
+    if event == "PRESENCE_UPDATE":
+        return {"user": {"id": str(member_id)}, "guild_id": guild, "status": random.choice(["online", "idle"]),
+                "activities": [], "client_status": {"desktop": "online"}}
+    if event == "GUILD_MEMBER_UPDATE":
+        return {"guild_id": guild, "user": user(member_id), "roles": [], "nick": f"nick{random.random()}",
+                "joined_at": "2024-01-01T00:00:00+00:00", "flags": 0}
+    if event == "TYPING_START":
+        return {"channel_id": str(guild_id * 10), "guild_id": guild, "user_id": str(member_id),
+                "timestamp": int(time.time())}
+    if event == "MESSAGE_CREATE":
+        return {"id": str(random.randrange(1 << 60)), "channel_id": str(guild_id * 10), "guild_id": guild,
+                "author": user(member_id), "content": "привет", "timestamp": "2024-01-01T00:00:00+00:00",
+                "edited_timestamp": None, "tts": False, "mention_everyone": False, "mentions": [],
+                "mention_roles": [], "attachments": [], "embeds": [], "pinned": False, "type": 0}
+    return {"guild_id": guild, "channel_id": None, "user_id": str(member_id), "session_id": "x",
+            "deaf": False, "mute": False, "self_deaf": False, "self_mute": False, "self_video": False,
+            "suppress": False, "request_to_speak_timestamp": None}
+
+
+async def run_profile(profile, guilds, members, seconds):
+    random.seed(42)
+    before = rss_mb()
+    bot = make_bot("!", profile=profile, shards="")
+    await bot._async_setup_hook()  # привязывает бота к текущему event loop, как при login
+    state = bot._connection
+    state.user = discord.ClientUser(state=state, data={**user(1), "bot": True})
+    intents = state._intents
+    for guild_id in range(1, guilds + 1):
+        state._add_guild_from_data(guild_payload(guild_id, members))
+    loaded = rss_mb()
+
+    delivered_rates = {event: rate * guilds * members for event, (flag, rate) in EVENT_RATES.items()
+                       if getattr(intents, flag)}
+    per_second = sum(delivered_rates.values())
+    events = list(delivered_rates)
+    weights = [delivered_rates[event] for event in events]
+    total = int(per_second * seconds)
+    batch = []
+    for event in random.choices(events, weights, k=total) if events else []:
+        guild_id = random.randint(1, guilds)
+        batch.append((event, event_payload(event, guild_id, guild_id * 100000 + random.randrange(members))))
+
+    started = time.perf_counter()
+    for index, (event, data) in enumerate(batch):
+        getattr(state, f"parse_{event.lower()}")(data)
+        if index % 500 == 0:
+            await asyncio.sleep(0)  # даем выполниться задачам, которые создал dispatch
+    elapsed = time.perf_counter() - started
+    return {
+        "profile": profile,
+        "cached_members": sum(len(guild.members) for guild in bot.guilds),
+        "rss_mb": loaded - before,
+        "events_per_sec": per_second,
+        "cpu_ms_per_sec": elapsed * 1000 / seconds,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--guilds", type=int, default=200)
+    parser.add_argument("--members", type=int, default=500)
+    parser.add_argument("--seconds", type=float, default=5)
+    parser.add_argument("--profile", choices=PROFILES)
+    args = parser.parse_args()
+
+    if args.profile:
+        result = asyncio.run(run_profile(args.profile, args.guilds, args.members, args.seconds))
+        print(json.dumps(result))
+        return
+
+    print(f"{args.guilds} серверов по {args.members} участников, {args.seconds:g} с синтетического трафика")
+    print(f"{'профиль':>8} {'участников в кеше':>18} {'RSS, МБ':>9} {'событий/с':>10} {'CPU, мс/с':>10}")
+    for profile in PROFILES:
+        # Отдельный процесс, чтобы RSS одного профиля не влиял на другой
+        output = subprocess.run(
+            [sys.executable, __file__, "--profile", profile, "--guilds", str(args.guilds),
+             "--members", str(args.members), "--seconds", str(args.seconds)],
+            capture_output=True, text=True, check=True
+        ).stdout
+        r = json.loads(output.strip().splitlines()[-1])
+        print(f"{r['profile']:>8} {r['cached_members']:>18} {r['rss_mb']:>9.1f} "
+              f"{r['events_per_sec']:>10.0f} {r['cpu_ms_per_sec']:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+"""Стоимость проверки одного сообщения в зависимости от количества правил.
+
+Сравнивает скомпилированный TriggerMatcher с отдельными проверками `in` по каждой фразе,
+как было в on_message. Запуск: python benchmarks/bench_triggers.py
+"""
+import os
+import random
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from triggers import TriggerMatcher  # noqa: E402
+
+ALPHABET = "абвгдеёжзийклмнопрстуфхцчшщъыьэюя"
+RULE_COUNTS = (3, 10, 100, 1000, 5000)
+PHRASES_PER_RULE = 3
+MESSAGES = 200
+
+
+def word(rng, low=3, high=9):
+    return "".join(rng.choice(ALPHABET) for _ in range(rng.randint(low, high)))
+
+
+def make_rules(rng, count):
+    return [{"name": f"rule{i}", "phrases": [word(rng) for _ in range(PHRASES_PER_RULE)]} for i in range(count)]
+
+
+def make_messages(rng, rules):
+    messages = []
+    for _ in range(MESSAGES):
+        words = [word(rng) for _ in range(rng.randint(5, 40))]
+        if rules and rng.random() < 0.2:
+            words.insert(rng.randrange(len(words)), rng.choice(rng.choice(rules)["phrases"]))
+        messages.append(" ".join(words))
+    return messages
+
+
+def naive_match(rules, text):
+    return [rule for rule in rules if any(phrase in text.lower() for phrase in rule["phrases"])]
+
+
+def main():
+    rng = random.Random(42)
+    print(f"{'правил':>8} {'in, мкс/сообщ.':>16} {'regex, мкс/сообщ.':>18} {'компиляция, мс':>16}")
+    for count in RULE_COUNTS:
+        rules = make_rules(rng, count)
+        messages = make_messages(rng, rules)
+        compile_time = timeit.timeit(lambda: TriggerMatcher(rules), number=1)
+        matcher = TriggerMatcher(rules)
+        for text in messages:
+            assert [r["name"] for r in matcher.match(text)] == [r["name"] for r in naive_match(rules, text)]
+        repeat = max(1, 2000 // count)
+        naive = timeit.timeit(lambda: [naive_match(rules, text) for text in messages], number=repeat)
+        compiled = timeit.timeit(lambda: [matcher.match(text) for text in messages], number=repeat)
+        per_message = 1e6 / (repeat * len(messages))
+        print(f"{count:>8} {naive * per_message:>16.2f} {compiled * per_message:>18.2f} {compile_time * 1000:>16.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,856 @@
+"""Нагрузочный тест обоих ботов без Discord, Gemini, YouTube и edge_tts.
+
+Чайник и миничайник импортируются как есть, а внешние сервисы заменяются заглушками внутри процесса:
+- Discord: события шлюза (GUILD_CREATE, MESSAGE_CREATE, INTERACTION_CREATE) подаются прямо в парсеры
+  discord.py, REST-запросы и ответы на взаимодействия перехватываются, голосовой клиент "играет"
+  источник в отдельном потоке в реальном времени;
+- google.generativeai, yt_dlp, edge_tts и g4f подменяются модулями с настраиваемыми задержками;
+- ссылки на аудиопотоки и картинки отдает локальный HTTP-сервер.
+
+В каждом из N серверов в среднем M сообщений в секунду (пуассоновский поток), смесь команд задается --mix.
+В конце выводятся пропускная способность, p50/p99 времени до первого ответа и до завершения команды,
+этапы из metrics (оценка по гистограммам) и RSS. Если FFmpeg не найден, вместо его источников звука
+используется тишина.
+Запуск: python benchmarks/load_test.py [--guilds 20] [--rate 0.5] [--seconds 60] [--mix ai=2,play=1]
+"""
+import argparse
+import asyncio
+import hashlib
+import itertools
+import json
+import logging
+import os
+import random
+import resource
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import types
+import wave
+from collections import Counter, defaultdict
+from types import SimpleNamespace
+
+import discord
+from aiohttp import web
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+CHAYNIK_ID = 1000
+MINI_ID = 1001
+TIMESTAMP = "2024-01-01T00:00:00+00:00"
+# PNG 1x1 - ответ заглушки генерации изображений
+SAMPLE_IMAGE = bytes.fromhex(
+    "89504e470d0a1a0a0000000d4948445200000001000000010806000000"
+    "1f15c4890000000d49444154789c6360000002000154a24f5d0000000049454e44ae426082"
+)
+SILENCE_FRAME = b"\0" * 3840  # 20 мс PCM 48 кГц стерео
+FRAME_SECONDS = 0.02
+
+# тип: (бот, способ отправки); "chat" - обычное сообщение без ожидаемого ответа
+KINDS = {
+    "chat": ("chaynik", "message"),
+    "ai": ("chaynik", "message"),
+    "play": ("chaynik", "message"),
+    "speak": ("chaynik", "message"),
+    "image": ("chaynik", "message"),
+    "mention": ("minichaynik", "message"),
+    "slash_ai": ("minichaynik", "interaction"),
+    "slash_play": ("chaynik", "interaction"),
+}
+DEFAULT_MIX = "chat=6,ai=2,mention=1,slash_ai=1,play=1,slash_play=0.5,speak=0.5,image=0.2"
+# Этапы из metrics, которые выводятся в отчете: (гистограмма, метки)
+STAGES = (
+    ("stage_seconds", {"command": "play", "stage": "prepare"}),
+    ("stage_seconds", {"command": "play", "stage": "request_to_audio"}),
+    ("stage_seconds", {"command": "play", "stage": "gap"}),
+    ("stage_seconds", {"command": "speak", "stage": "first_sentence"}),
+    ("stage_seconds", {"command": "speak", "stage": "first_audio"}),
+    ("queue_wait_seconds", {"queue": "gemini"}),
+    ("queue_wait_seconds", {"queue": "downloads"}),
+    ("queue_wait_seconds", {"queue": "outbox_priority_0"}),
+    ("external_call_seconds", {"service": "gemini", "op": "stream_first_chunk"}),
+    ("external_call_seconds", {"service": "discord", "op": "send"}),
+    ("event_loop_lag_seconds", {}),
+)
+
+config = None  # argparse.Namespace с задержками заглушек, задается в main
+sample_audio = None  # WAV, который "скачивает" yt-dlp и "синтезирует" edge_tts
+media_base = None  # адрес локального HTTP-сервера заглушек
+workdir = None
+
+
+def rss_mb():
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+_sequence = itertools.count()
+
+
+def snowflake():
+    """ID со временем создания "сейчас": по нему discord.py проверяет, не истекло ли взаимодействие."""
+    return discord.utils.time_snowflake(discord.utils.utcnow()) + next(_sequence) % (1 << 22)
+
+
+def write_sample_audio(path, seconds):
+    """Тишина в WAV (8 кГц, моно) длиной с трек - размером как короткий mp3 от edge_tts."""
+    with wave.open(path, "wb") as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(8000)
+        f.writeframes(b"\0\0" * int(8000 * seconds))
+
+
+def jitter(mean):
+    """Задержка вокруг среднего значения, чтобы запросы не приходили строем."""
+    return mean * random.uniform(0.5, 1.5) if mean > 0 else 0.0
+
+
+def digest(text, length=11):
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()[:length]
+
+
+# --- Заглушка Gemini ---
+def reply_for(prompt):
+    """Ответ из нескольких предложений длиной около config.reply_chars; одинаковый для одинаковых запросов."""
+    rng = random.Random(digest(str(prompt)))
+    sentences = []
+    while sum(len(sentence) + 1 for sentence in sentences) < config.reply_chars:
+        words = " ".join(rng.choice(("чайник", "кипит", "сервер", "гамно", "очередь", "ответ", "модель", "звук"))
+                         for _ in range(rng.randint(4, 12)))
+        sentences.append(words.capitalize() + rng.choice((".", "!", "?")))
+    return " ".join(sentences)
+
+
+class FakePart:
+    def __init__(self, text):
+        self.text = text
+
+
+class FakeResponse:
+    def __init__(self, text):
+        self.parts = [FakePart(text)]
+        self.text = text
+        self.prompt_feedback = None
+
+
+class FakeStream:
+    """Потоковый ответ: части приходят с интервалом config.gemini_chunk_interval."""
+
+    def __init__(self, text):
+        size = max(1, config.gemini_chunk_chars)
+        self._chunks = [text[start:start + size] for start in range(0, len(text), size)]
+
+    async def __aiter__(self):
+        for index, chunk in enumerate(self._chunks):
+            if index:
+                await asyncio.sleep(jitter(config.gemini_chunk_interval))
+            yield FakeResponse(chunk)
+
+
+class FakeChat:
+    def __init__(self, history=None):
+        self.history = list(history or [])
+
+    async def send_message_async(self, content, stream=False, **kwargs):
+        if stream:
+            await asyncio.sleep(jitter(config.gemini_first_chunk))
+            return FakeStream(reply_for(content))
+        await asyncio.sleep(jitter(config.gemini_latency))
+        return FakeResponse(reply_for(content))
+
+
+class FakeGenerativeModel:
+    def __init__(self, model_name=None, system_instruction=None, **kwargs):
+        self.model_name = model_name
+        self.system_instruction = system_instruction
+
+    def start_chat(self, history=None):
+        return FakeChat(history)
+
+    async def generate_content_async(self, contents, **kwargs):
+        await asyncio.sleep(jitter(config.gemini_latency))
+        return FakeResponse(reply_for(contents if isinstance(contents, str) else contents[0]))
+
+
+# --- Заглушка yt-dlp ---
+def video_info(key):
+    video_id = digest(key)
+    return {
+        "id": video_id,
+        "title": f"Трек {key}",
+        "webpage_url": f"https://www.youtube.com/watch?v={video_id}",
+        "url": f"{media_base}/track/{video_id}.wav",
+        "acodec": None,  # исходник не в Opus - FFmpeg будет перекодировать
+        "http_headers": {"User-Agent": "load-test"},
+        "extractor_key": "Youtube",
+        "duration": config.track_seconds,
+    }
+
+
+class FakeYoutubeDL:
+    def __init__(self, params=None):
+        self.params = params or {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def extract_info(self, url, download=False):
+        time.sleep(jitter(config.ytdlp_latency))
+        if url.startswith("ytsearch"):
+            count, query = url[len("ytsearch"):].split(":", 1)
+            return {"entries": [video_info(query if i == 0 else f"{query} #{i}") for i in range(int(count or 1))]}
+        return video_info(url.rsplit("=", 1)[-1])
+
+    def process_ie_result(self, info, download=True):
+        for hook in self.params.get("progress_hooks", ()):
+            hook({"status": "downloading"})
+        time.sleep(jitter(config.download_latency))
+        # Как FFmpegExtractAudio: рядом с исходным именем появляется .opus
+        shutil.copyfile(sample_audio, f"{self.prepare_filename(info).rsplit('.', 1)[0]}.opus")
+        return info
+
+    def prepare_filename(self, info):
+        return os.path.join(workdir, f"temp_{info['id']}.webm")
+
+
+# --- Заглушки edge_tts и g4f ---
+class FakeCommunicate:
+    def __init__(self, text, voice=None, rate="+0%", pitch="+0Hz", **kwargs):
+        self.text = text
+
+    async def save(self, path):
+        await asyncio.sleep(jitter(config.tts_latency))
+        shutil.copyfile(sample_audio, path)
+
+
+class FakeImages:
+    def generate(self, model=None, prompt=None, **kwargs):
+        time.sleep(jitter(config.image_latency))
+        return SimpleNamespace(data=[SimpleNamespace(url=f"{media_base}/image/{digest(prompt or '')}.png")])
+
+
+class FakeG4FClient:
+    def __init__(self, *args, **kwargs):
+        self.images = FakeImages()
+
+
+def install_fake_services():
+    """Подменяет модули внешних сервисов до импорта ботов."""
+    genai = types.ModuleType("google.generativeai")
+    genai.configure = lambda **kwargs: None
+    genai.GenerativeModel = FakeGenerativeModel
+    try:
+        import google
+    except ImportError:
+        google = types.ModuleType("google")
+        google.__path__ = []
+        sys.modules["google"] = google
+    google.generativeai = genai
+    sys.modules["google.generativeai"] = genai
+
+    yt_dlp = types.ModuleType("yt_dlp")
+    yt_dlp.YoutubeDL = FakeYoutubeDL
+    sys.modules["yt_dlp"] = yt_dlp
+
+    edge_tts = types.ModuleType("edge_tts")
+    edge_tts.Communicate = FakeCommunicate
+    sys.modules["edge_tts"] = edge_tts
+
+    g4f = types.ModuleType("g4f")
+    g4f.__path__ = []
+    g4f_client = types.ModuleType("g4f.client")
+    g4f_client.Client = FakeG4FClient
+    g4f.client = g4f_client
+    sys.modules["g4f"] = g4f
+    sys.modules["g4f.client"] = g4f_client
+
+
+async def start_media_server():
+    """HTTP-сервер с аудио для ссылок на поток и картинками для генерации изображений."""
+    async def track(request):
+        return web.FileResponse(sample_audio)
+
+    async def image(request):
+        return web.Response(body=SAMPLE_IMAGE, content_type="image/png")
+
+    app = web.Application()
+    app.router.add_get("/track/{name}", track)
+    app.router.add_get("/image/{name}", image)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    return runner, f"http://127.0.0.1:{port}"
+
+
+# --- Учет запросов ---
+def percentile(values, q):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+class Recorder:
+    """Время от события до первого ответа бота и до завершения команды."""
+
+    def __init__(self):
+        self.events = {}  # id события -> (тип, время отправки)
+        self.sent = Counter()
+        self.first_response = defaultdict(list)
+        self.done = defaultdict(list)
+        self.errors = Counter()
+        self._answered = set()
+        self._finished = set()
+        self.discord_requests = Counter()
+
+    def start(self, event_id, kind):
+        self.events[event_id] = (kind, time.perf_counter())
+        self.sent[kind] += 1
+
+    def responded(self, event_id):
+        if event_id in self._answered or event_id not in self.events:
+            return
+        self._answered.add(event_id)
+        kind, started = self.events[event_id]
+        self.first_response[kind].append(time.perf_counter() - started)
+
+    def finished(self, event_id, ok=True):
+        if event_id in self._finished or event_id not in self.events:
+            return
+        self._finished.add(event_id)
+        kind, started = self.events[event_id]
+        self.done[kind].append(time.perf_counter() - started)
+        if not ok:
+            self.errors[kind] += 1
+
+    def completed(self):
+        """Сколько запросов обработано: команды завершены, упоминания получили ответ."""
+        return len(self._finished) + sum(1 for event_id in self._answered if self.events[event_id][0] == "mention")
+
+    def outstanding(self):
+        expected = sum(count for kind, count in self.sent.items() if kind != "chat")
+        return expected - self.completed()
+
+
+# --- Заглушка Discord ---
+def user_payload(user_id, bot=False):
+    return {"id": str(user_id), "username": f"user{user_id}", "discriminator": "0", "avatar": None,
+            "global_name": None, "bot": bot}
+
+
+def member_payload(user_id, bot=False):
+    return {"user": user_payload(user_id, bot), "roles": [], "joined_at": TIMESTAMP, "deaf": False, "mute": False,
+            "flags": 0}
+
+
+def text_channel_id(guild_id):
+    return guild_id * 10 + 1
+
+
+def voice_channel_id(guild_id):
+    return guild_id * 10 + 2
+
+
+def guild_users(guild_id):
+    return [guild_id * 1000 + index for index in range(config.users)]
+
+
+def guild_payload(guild_id):
+    users = guild_users(guild_id)
+    channels = [
+        {"id": str(text_channel_id(guild_id)), "type": 0, "name": "general", "position": 0,
+         "permission_overwrites": [], "guild_id": str(guild_id)},
+        {"id": str(voice_channel_id(guild_id)), "type": 2, "name": "voice", "position": 1,
+         "permission_overwrites": [], "bitrate": 64000, "user_limit": 0, "rtc_region": None,
+         "guild_id": str(guild_id)},
+    ]
+    return {
+        "id": str(guild_id),
+        "name": f"guild{guild_id}",
+        "owner_id": str(users[0]),
+        "member_count": len(users) + 2,
+        "large": False,
+        "roles": [{"id": str(guild_id), "name": "@everyone", "permissions": "0", "position": 0, "color": 0,
+                   "hoist": False, "managed": False, "mentionable": False, "flags": 0}],
+        "channels": channels,
+        "members": [member_payload(user_id) for user_id in users]
+                   + [member_payload(CHAYNIK_ID, True), member_payload(MINI_ID, True)],
+        # Все пользователи сидят в голосовом канале - !play и !speak не отказывают
+        "voice_states": [{"user_id": str(user_id), "channel_id": str(voice_channel_id(guild_id)), "session_id": "x",
+                          "deaf": False, "mute": False, "self_deaf": False, "self_mute": False,
+                          "self_video": False, "suppress": False, "request_to_speak_timestamp": None,
+                          "member": member_payload(user_id)} for user_id in users],
+        "presences": [],
+        "emojis": [],
+        "stickers": [],
+        "threads": [],
+    }
+
+
+def message_payload(message_id, channel_id, guild_id, author_id, content, bot=False, mentions=(), reference=None):
+    data = {"id": str(message_id), "channel_id": str(channel_id), "author": user_payload(author_id, bot),
+            "content": content, "timestamp": TIMESTAMP, "edited_timestamp": None, "tts": False,
+            "mention_everyone": False, "mentions": [user_payload(user_id, True) for user_id in mentions],
+            "mention_roles": [], "attachments": [], "embeds": [], "pinned": False, "type": 0, "flags": 0,
+            "components": []}
+    if guild_id:
+        data["guild_id"] = str(guild_id)
+        data["member"] = {key: value for key, value in member_payload(author_id, bot).items() if key != "user"}
+    if reference:
+        data["message_reference"] = {"message_id": str(reference), "channel_id": str(channel_id)}
+    return data
+
+
+def request_payload(kwargs, form, payload=None, multipart=None):
+    """JSON тела запроса discord.py (обычного или multipart с файлами)."""
+    if payload is None:
+        payload = kwargs.get("json")
+    for part in form or multipart or ():
+        if part.get("name") == "payload_json":
+            payload = json.loads(part["value"])
+    return payload or {}
+
+
+class FakeDiscord:
+    """Перехватывает REST-запросы обоих ботов и ответы на взаимодействия."""
+
+    def __init__(self, recorder):
+        self.recorder = recorder
+        self.interactions = {}  # токен -> (id взаимодействия, канал, id бота)
+
+    def attach(self, bot, bot_id):
+        async def request(route, *, files=None, form=None, **kwargs):
+            return await self.request(bot_id, route, form, kwargs)
+
+        bot.http.request = request
+
+    async def request(self, bot_id, route, form, kwargs):
+        await asyncio.sleep(jitter(config.discord_latency))
+        self.recorder.discord_requests[route.method] += 1
+        payload = request_payload(kwargs, form)
+        if route.method == "POST" and route.path.endswith("/messages"):
+            reference = (payload.get("message_reference") or {}).get("message_id")
+            if reference:
+                self.recorder.responded(int(reference))
+            return message_payload(snowflake(), route.channel_id, None, bot_id, payload.get("content") or "", True)
+        if route.method == "PATCH" and "/messages/" in route.path:
+            return message_payload(snowflake(), route.channel_id, None, bot_id, payload.get("content") or "", True)
+        if route.method == "GET" and "/members/" in route.path:
+            return member_payload(int(route.url.rsplit("/", 1)[-1]))
+        return None
+
+    async def webhook_request(self, route, *, payload=None, multipart=None, **kwargs):
+        await asyncio.sleep(jitter(config.discord_latency))
+        self.recorder.discord_requests["webhook"] += 1
+        if route.path.endswith("/callback"):
+            return {"interaction": {"id": str(route.webhook_id), "type": 2, "response_message_loading": True}}
+        interaction_id, channel_id, bot_id = self.interactions[route.webhook_token]
+        self.recorder.responded(interaction_id)
+        body = request_payload({}, None, payload, multipart)
+        return message_payload(snowflake(), channel_id, None, bot_id, body.get("content") or "", True)
+
+
+class FakeVoiceClient(discord.VoiceProtocol):
+    """Голосовое подключение без Discord: источник читается кадрами по 20 мс в отдельном потоке."""
+
+    def __init__(self, client, channel):
+        super().__init__(client, channel)
+        self.guild = channel.guild
+        self.source = None
+        self._connected = True
+        self._player = None  # (поток, событие остановки)
+
+    def is_connected(self):
+        return self._connected
+
+    def is_playing(self):
+        return self._player is not None and self._player[0].is_alive() and not self._player[1].is_set()
+
+    def is_paused(self):
+        return False
+
+    async def move_to(self, channel, **kwargs):
+        self.channel = channel
+
+    async def disconnect(self, *, force=False):
+        self.stop()
+        self._connected = False
+        self.cleanup()
+
+    def stop(self):
+        if self._player is not None:
+            self._player[1].set()
+
+    def play(self, source, *, after=None, **kwargs):
+        if self.is_playing():
+            raise discord.ClientException("Already playing audio.")
+        stop = threading.Event()
+        thread = threading.Thread(target=self._play, args=(source, after, stop), daemon=True)
+        self.source = source
+        self._player = (thread, stop)
+        thread.start()
+
+    def _play(self, source, after, stop):
+        error = None
+        try:
+            next_frame = time.perf_counter()
+            for _ in range(int(config.track_seconds / FRAME_SECONDS)):
+                if stop.is_set() or not source.read():
+                    break
+                next_frame += FRAME_SECONDS
+                stop.wait(max(0.0, next_frame - time.perf_counter()))
+        except Exception as e:
+            error = e
+        finally:
+            source.cleanup()
+        if after is not None:
+            # Как AudioPlayer в discord.py: after вызывается из потока воспроизведения
+            try:
+                after(error)
+            except Exception as e:
+                print(f"Ошибка в after: {e}")
+
+
+async def fake_connect(channel, *, timeout=60.0, reconnect=True, cls=None, self_deaf=False, self_mute=False):
+    await asyncio.sleep(jitter(config.voice_connect_latency))
+    state = channel._state
+    if state._get_voice_client(channel.guild.id):
+        raise discord.ClientException("Already connected to a voice channel.")
+    voice = FakeVoiceClient(state._get_client(), channel)
+    state._add_voice_client(channel.guild.id, voice)
+    return voice
+
+
+class SilentSource(discord.AudioSource):
+    """Источник тишины вместо FFmpeg."""
+
+    def read(self):
+        return SILENCE_FRAME
+
+
+def use_silent_sources(chaynik):
+    async def file_source(path, executable):
+        return SilentSource()
+
+    chaynik.file_source = file_source
+    chaynik.stream_audio_source = lambda *args, **kwargs: SilentSource()
+    chaynik.encoded_source = lambda *args, **kwargs: SilentSource()
+
+
+# --- Боты и нагрузка ---
+async def prepare_bot(bot, bot_id, fake_discord, guilds):
+    await bot._async_setup_hook()  # привязывает бота к текущему event loop, как при login
+    state = bot._connection
+    state.user = discord.ClientUser(state=state, data=user_payload(bot_id, True))
+    state.application_id = bot_id
+    fake_discord.attach(bot, bot_id)
+    for guild_id in guilds:
+        state._add_guild_from_data(guild_payload(guild_id))
+
+
+def track_completion(bot, recorder, tree_only=False):
+    """Отмечает завершение префиксных и слэш-команд бота."""
+    if not tree_only:
+        async def on_command_completion(ctx):
+            recorder.finished(ctx.message.id)
+
+        async def on_command_error(ctx, error):
+            if not isinstance(error, discord.ext.commands.CommandNotFound):
+                print(f"Ошибка команды {ctx.command}: {error}")
+            recorder.finished(ctx.message.id, ok=False)
+
+        bot.add_listener(on_command_completion)
+        bot.add_listener(on_command_error)
+
+    async def on_app_command_completion(interaction, command):
+        recorder.finished(interaction.id)
+
+    original_on_error = bot.tree.on_error
+
+    async def on_tree_error(interaction, error):
+        recorder.finished(interaction.id, ok=False)
+        await original_on_error(interaction, error)
+
+    bot.add_listener(on_app_command_completion)
+    bot.tree.on_error = on_tree_error
+
+
+class LoadGenerator:
+    def __init__(self, bots, fake_discord, recorder, mix):
+        self.bots = bots  # имя -> бот
+        self.fake_discord = fake_discord
+        self.recorder = recorder
+        self.kinds = list(mix)
+        self.weights = [mix[kind] for kind in self.kinds]
+
+    def text_for(self, kind, rng):
+        prompt = f"вопрос номер {rng.randrange(config.prompts)}"
+        track = f"песня {rng.randrange(config.tracks)}"
+        return {
+            "chat": f"просто сообщение {rng.random()}",
+            "ai": f"!ai {prompt}",
+            "play": f"!play {track}",
+            "speak": f"!speak {prompt}",
+            "image": f"!image картинка {rng.randrange(config.prompts)}",
+            "mention": f"<@{MINI_ID}> {prompt}",
+            "slash_ai": prompt,
+            "slash_play": track,
+        }[kind]
+
+    def inject(self, guild_id, kind, rng):
+        event_id = snowflake()
+        user_id = rng.choice(guild_users(guild_id))
+        channel_id = text_channel_id(guild_id)
+        text = self.text_for(kind, rng)
+        target, transport = KINDS[kind]
+        self.recorder.start(event_id, kind)
+        if transport == "message":
+            mentions = (MINI_ID,) if kind == "mention" else ()
+            # Сообщения сервера видят оба бота
+            for bot in self.bots.values():
+                bot._connection.parse_message_create(
+                    message_payload(event_id, channel_id, guild_id, user_id, text, mentions=mentions)
+                )
+            return
+        bot_id = CHAYNIK_ID if target == "chaynik" else MINI_ID
+        name = "ai" if kind == "slash_ai" else "play"
+        token = f"token-{event_id}"
+        self.fake_discord.interactions[token] = (event_id, channel_id, bot_id)
+        member = {**member_payload(user_id), "permissions": "0"}
+        self.bots[target]._connection.parse_interaction_create({
+            "id": str(event_id), "application_id": str(bot_id), "type": 2, "token": token, "version": 1,
+            "guild_id": str(guild_id), "channel_id": str(channel_id),
+            "channel": {"id": str(channel_id), "type": 0, "name": "general", "position": 0,
+                        "permission_overwrites": [], "guild_id": str(guild_id)},
+            "member": member, "locale": "ru", "guild_locale": "ru", "app_permissions": "0", "entitlements": [],
+            "authorizing_integration_owners": {}, "context": 0, "attachment_size_limit": 25 * 1024 * 1024,
+            "data": {"id": str(bot_id), "name": name, "type": 1,
+                     "options": [{"name": "запрос", "type": 3, "value": text}]},
+        })
+
+    async def guild_traffic(self, guild_id, deadline):
+        rng = random.Random(guild_id)
+        while True:
+            await asyncio.sleep(rng.expovariate(config.rate))
+            if time.perf_counter() >= deadline:
+                return
+            self.inject(guild_id, rng.choices(self.kinds, self.weights)[0], rng)
+
+
+def parse_mix(text):
+    mix = {}
+    for item in text.split(","):
+        kind, _, weight = item.partition("=")
+        kind = kind.strip()
+        if kind not in KINDS:
+            raise SystemExit(f"Неизвестный тип '{kind}', доступны: {', '.join(KINDS)}")
+        if float(weight or 1) > 0:
+            mix[kind] = float(weight or 1)
+    return mix
+
+
+def fmt(value):
+    return f"{value * 1000:.0f}" if value is not None else "-"
+
+
+async def run(args):
+    global media_base
+    media_runner, media_base = await start_media_server()
+
+    import chaynik
+    import minichaynik
+    import audio_sources
+    import metrics
+    from chat_store import chat_store
+    from http_session import close_session
+
+    logging.getLogger().setLevel(logging.WARNING)  # chaynik включает INFO для каждой загрузки
+    ffmpeg = args.ffmpeg or (shutil.which("ffmpeg") if not args.no_ffmpeg else None)
+    if ffmpeg:
+        chaynik.ffmpeg = ffmpeg
+        audio_sources.FFPROBE = shutil.which("ffprobe") or os.path.join(os.path.dirname(ffmpeg), "ffprobe")
+    else:
+        use_silent_sources(chaynik)
+
+    recorder = Recorder()
+    fake_discord = FakeDiscord(recorder)
+    discord.abc.Connectable.connect = fake_connect
+
+    async def webhook_request(adapter, route, session=None, **kwargs):
+        return await fake_discord.webhook_request(route, **kwargs)
+
+    discord.webhook.async_.AsyncWebhookAdapter.request = webhook_request
+
+    guilds = [10_000 + index for index in range(args.guilds)]
+    bots = {"chaynik": chaynik.bot, "minichaynik": minichaynik.bot}
+    await prepare_bot(chaynik.bot, CHAYNIK_ID, fake_discord, guilds)
+    await prepare_bot(minichaynik.bot, MINI_ID, fake_discord, guilds)
+    track_completion(chaynik.bot, recorder)
+    track_completion(minichaynik.bot, recorder, tree_only=True)
+    await metrics.start()
+
+    rss = {"start": rss_mb()}
+    rss["peak"] = rss["start"]
+
+    async def sample_rss():
+        while True:
+            rss["peak"] = max(rss["peak"], rss_mb())
+            await asyncio.sleep(1)
+
+    sampler = asyncio.create_task(sample_rss())
+    generator = LoadGenerator(bots, fake_discord, recorder, parse_mix(args.mix))
+    started = time.perf_counter()
+    deadline = started + args.seconds
+    await asyncio.gather(*(generator.guild_traffic(guild_id, deadline) for guild_id in guilds))
+
+    # Ждем, пока завершатся начатые команды (но не дольше --drain)
+    drain_deadline = time.perf_counter() + args.drain
+    while recorder.outstanding() and time.perf_counter() < drain_deadline:
+        await asyncio.sleep(0.2)
+    elapsed = time.perf_counter() - started
+    rss["end"] = rss_mb()
+    sampler.cancel()
+
+    report = {
+        "guilds": args.guilds,
+        "rate_per_guild": args.rate,
+        "seconds": args.seconds,
+        "elapsed": elapsed,
+        "events": sum(recorder.sent.values()),
+        "completed": recorder.completed(),
+        "events_per_sec": sum(recorder.sent.values()) / args.seconds,
+        "completed_per_sec": recorder.completed() / elapsed,
+        "discord_requests_per_sec": sum(recorder.discord_requests.values()) / elapsed,
+        "rss_mb": rss,
+        "kinds": {},
+        "stages": {},
+    }
+    for kind in (kind for kind in KINDS if kind in recorder.sent):
+        first, done = recorder.first_response[kind], recorder.done[kind]
+        report["kinds"][kind] = {
+            "sent": recorder.sent[kind],
+            "answered": len(first),
+            "first_p50": percentile(first, 0.5), "first_p99": percentile(first, 0.99),
+            "done_p50": percentile(done, 0.5), "done_p99": percentile(done, 0.99),
+            "errors": recorder.errors[kind],
+        }
+    for histogram_name, labels in STAGES:
+        histogram = getattr(metrics, histogram_name)
+        p50, count = histogram.quantile(0.5, **labels)
+        if count:
+            p99, _ = histogram.quantile(0.99, **labels)
+            name = "/".join(str(value) for value in labels.values()) or histogram_name
+            report["stages"][name] = {"p50": p50, "p99": p99, "count": count}
+
+    for voice in list(chaynik.bot.voice_clients):
+        voice.stop()
+    await media_runner.cleanup()
+    await close_session()
+    chat_store.close()
+    return report
+
+
+def print_report(report, mix):
+    print(f"{report['guilds']} серверов × {report['rate_per_guild']:g} сообщ./с, {report['seconds']:g} с; "
+          f"смесь: {', '.join(f'{kind}={weight:g}' for kind, weight in mix.items())}")
+    print(f"Событий: {report['events']} ({report['events_per_sec']:.1f}/с), завершено: {report['completed']} "
+          f"({report['completed_per_sec']:.1f}/с), запросов к Discord: {report['discord_requests_per_sec']:.1f}/с")
+    print(f"{'тип':>10} {'отправлено':>10} {'ответов':>8} {'ответ p50':>10} {'ответ p99':>10} "
+          f"{'готово p50':>11} {'готово p99':>11} {'ошибок':>7}   (мс)")
+    for kind, row in report["kinds"].items():
+        print(f"{kind:>10} {row['sent']:>10} {row['answered']:>8} {fmt(row['first_p50']):>10} "
+              f"{fmt(row['first_p99']):>10} {fmt(row['done_p50']):>11} {fmt(row['done_p99']):>11} "
+              f"{row['errors']:>7}")
+    if report["stages"]:
+        print("Этапы по гистограммам metrics (мс):")
+        for name, row in report["stages"].items():
+            print(f"{name:>40} p50 {fmt(row['p50']):>7} p99 {fmt(row['p99']):>7} n={row['count']}")
+    rss = report["rss_mb"]
+    print(f"RSS, МБ: после запуска {rss['start']:.1f}, пик {rss['peak']:.1f}, в конце {rss['end']:.1f}")
+
+
+def main():
+    global config, workdir, sample_audio
+    parser = argparse.ArgumentParser(description="Нагрузочный тест ботов с заглушками внешних сервисов")
+    parser.add_argument("--guilds", type=int, default=20)
+    parser.add_argument("--rate", type=float, default=0.5, help="сообщений в секунду на сервер")
+    parser.add_argument("--seconds", type=float, default=60)
+    parser.add_argument("--drain", type=float, default=30, help="сколько ждать завершения начатых команд")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="веса типов запросов: " + ", ".join(KINDS))
+    parser.add_argument("--users", type=int, default=20, help="пользователей в каждом сервере")
+    parser.add_argument("--prompts", type=int, default=200, help="разных запросов к ИИ (повторы попадают в кеш)")
+    parser.add_argument("--tracks", type=int, default=50, help="разных песен")
+    parser.add_argument("--gemini-latency", type=float, default=1.5)
+    parser.add_argument("--gemini-first-chunk", type=float, default=0.6)
+    parser.add_argument("--gemini-chunk-interval", type=float, default=0.15)
+    parser.add_argument("--gemini-chunk-chars", type=int, default=60)
+    parser.add_argument("--reply-chars", type=int, default=600)
+    parser.add_argument("--ytdlp-latency", type=float, default=1.0)
+    parser.add_argument("--download-latency", type=float, default=2.0)
+    parser.add_argument("--tts-latency", type=float, default=0.7)
+    parser.add_argument("--image-latency", type=float, default=5.0)
+    parser.add_argument("--discord-latency", type=float, default=0.08)
+    parser.add_argument("--voice-connect-latency", type=float, default=0.5)
+    parser.add_argument("--track-seconds", type=float, default=5, help="сколько играет каждый трек и фраза")
+    parser.add_argument("--ffmpeg", help="путь к FFmpeg (по умолчанию из PATH)")
+    parser.add_argument("--no-ffmpeg", action="store_true", help="играть тишину вместо источников FFmpeg")
+    parser.add_argument("--json", help="сохранить результаты в файл")
+    parser.add_argument("--max-p99", type=float,
+                        help="завершиться с кодом 1, если p99 до первого ответа какого-либо типа больше (с)")
+    args = parser.parse_args()
+    config = args
+    mix = parse_mix(args.mix)
+
+    if args.ffmpeg:
+        args.ffmpeg = os.path.abspath(args.ffmpeg)
+    workdir = tempfile.mkdtemp(prefix="chaynik-load-")
+    # Хранилища ботов - во временной папке, адрес метрик не открываем
+    os.environ.update({
+        "DISCORD_TOKEN": "load-test", "DISCORD_TOKEN_MINI": "load-test", "GEMINI_API_KEY": "load-test",
+        "METRICS_PORT": "0", "CHAT_DB_FILE": os.path.join(workdir, "chat_memory.db"),
+        "AUDIO_CACHE_DIR": os.path.join(workdir, "audio_cache"), "TTS_CACHE_DIR": os.path.join(workdir, "tts_cache"),
+        "TRIGGERS_FILE": os.path.join(ROOT, "triggers.json"),
+    })
+    sample_audio = os.path.join(workdir, "sample.wav")
+    write_sample_audio(sample_audio, args.track_seconds)
+    # Боты ищут chaynik.wav и старые JSON-файлы памяти в текущей папке. Работаем во временной:
+    # иначе импорт при запуске перенес бы настоящий memory.json во временную базу и переименовал его
+    shutil.copy(os.path.join(ROOT, "chaynik.wav"), workdir)
+    install_fake_services()
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    try:
+        report = asyncio.run(run(args))
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    print_report(report, mix)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    if args.max_p99 is not None:
+        slow = [kind for kind, row in report["kinds"].items()
+                if row["first_p99"] is not None and row["first_p99"] > args.max_p99]
+        if slow:
+            print(f"p99 до первого ответа больше {args.max_p99:g} с: {', '.join(slow)}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,240 @@
+import json
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+# --- Хранилище истории чатов ---
+# Вместо полной перезаписи JSON после каждого ответа новые реплики дописываются
+# в SQLite (режим WAL), а старые строки удаляются фоновым потоком.
+CHAT_DB_FILE = os.getenv("CHAT_DB_FILE", "chat_memory.db")
+TRIM_INTERVAL = 30  # секунд между фоновыми очистками старых реплик
+
+# Области (scope) истории
+SCOPE_CHAYNIK = "chaynik"  # память чайника по пользователям
+SCOPE_MINI_DM = "mini_dm"  # ЛС миничайника по пользователям
+SCOPE_MINI_GUILD = "mini_guild"  # общая история миничайника по серверам
+
+# Старые JSON-файлы, которые импортируются один раз
+LEGACY_MEMORY_FILE = "memory.json"
+LEGACY_USER_DATA_FILE = "user_ai_history.json"
+LEGACY_GUILD_DATA_FILE = "guild_ai_settings.json"
+
+
+class ChatStore:
+    """Append-only хранилище реплик на SQLite с фоновой обрезкой старой истории."""
+
+    def __init__(self, path=CHAT_DB_FILE, trim_interval=TRIM_INTERVAL):
+        self.path = path
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._lock = threading.RLock()  # RLock: append и set_setting вызываются внутри transaction()
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS history ("
+                "id INTEGER PRIMARY KEY AUTOINCREMENT, "
+                "scope TEXT NOT NULL, "
+                "key INTEGER NOT NULL, "
+                "role TEXT NOT NULL, "
+                "parts TEXT NOT NULL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS history_scope_key ON history (scope, key, id)")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS settings ("
+                "scope TEXT NOT NULL, "
+                "key INTEGER NOT NULL, "
+                "name TEXT NOT NULL, "
+                "value TEXT, "
+                "PRIMARY KEY (scope, key, name))"
+            )
+
+        # scope -> максимальное количество хранимых реплик на ключ
+        self._limits = {}
+        # (scope, key), в которые что-то дописали после последней обрезки
+        self._dirty = set()
+        self._trim_interval = trim_interval
+        self._stop = threading.Event()
+        self._trim_thread = threading.Thread(target=self._trim_loop, name="chat-store-trim", daemon=True)
+        self._trim_thread.start()
+
+    @contextmanager
+    def transaction(self):
+        """Все записи внутри блока - одна транзакция: при исключении ни одна из них не сохраняется."""
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                yield
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+
+    # --- История ---
+
+    def set_limit(self, scope, maxlen):
+        """Задает, сколько последних реплик хранить для каждого ключа области."""
+        self._limits[scope] = maxlen
+
+    def append(self, scope, key, *turns):
+        """Дописывает новые реплики. Стоимость зависит только от их количества.
+
+        Каждой реплике проставляется "id" - номер ее строки (по нему окно контекста помнит,
+        до какой реплики история уже свернута в краткое содержание).
+        """
+        if not turns:
+            return
+        with self._lock:
+            for turn in turns:
+                cursor = self._conn.execute(
+                    "INSERT INTO history (scope, key, role, parts) VALUES (?, ?, ?, ?)",
+                    (scope, key, turn["role"], json.dumps(turn["parts"], ensure_ascii=False)),
+                )
+                turn["id"] = cursor.lastrowid
+            self._dirty.add((scope, key))
+
+    def load(self, scope, key, limit=None):
+        """Возвращает последние `limit` реплик ключа в хронологическом порядке (с "id" строк)."""
+        limit = limit if limit is not None else self._limits.get(scope, -1)
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id, role, parts FROM ("
+                "SELECT id, role, parts FROM history WHERE scope = ? AND key = ? ORDER BY id DESC LIMIT ?"
+                ") ORDER BY id",
+                (scope, key, limit),
+            ).fetchall()
+        return [{"id": row_id, "role": role, "parts": json.loads(parts)} for row_id, role, parts in rows]
+
+    def load_scope(self, scope, limit=None):
+        """Возвращает {key: [реплики]} для всей области, не больше `limit` последних на ключ."""
+        limit = limit if limit is not None else self._limits.get(scope, -1)
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id, key, role, parts FROM ("
+                "SELECT id, key, role, parts, "
+                "ROW_NUMBER() OVER (PARTITION BY key ORDER BY id DESC) AS rn "
+                "FROM history WHERE scope = ?"
+                ") WHERE ? < 0 OR rn <= ? ORDER BY key, id",
+                (scope, limit, limit),
+            ).fetchall()
+        result = {}
+        for row_id, key, role, parts in rows:
+            result.setdefault(key, []).append({"id": row_id, "role": role, "parts": json.loads(parts)})
+        return result
+
+    def clear(self, scope, key):
+        """Удаляет всю историю ключа."""
+        with self._lock:
+            self._conn.execute("DELETE FROM history WHERE scope = ? AND key = ?", (scope, key))
+            self._dirty.discard((scope, key))
+
+    # --- Настройки ---
+
+    def set_setting(self, scope, key, name, value):
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO settings (scope, key, name, value) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT (scope, key, name) DO UPDATE SET value = excluded.value",
+                (scope, key, name, value),
+            )
+
+    def load_settings(self, scope):
+        """Возвращает {key: {name: value}} для всей области."""
+        with self._lock:
+            rows = self._conn.execute("SELECT key, name, value FROM settings WHERE scope = ?", (scope,)).fetchall()
+        result = {}
+        for key, name, value in rows:
+            result.setdefault(key, {})[name] = value
+        return result
+
+    # --- Фоновая обрезка ---
+
+    def trim(self):
+        """Удаляет реплики сверх лимита у ключей, в которые дописывали с прошлой обрезки."""
+        with self._lock:
+            dirty, self._dirty = self._dirty, set()
+        for scope, key in dirty:
+            maxlen = self._limits.get(scope)
+            if maxlen is None:
+                continue
+            with self._lock:
+                self._conn.execute(
+                    "DELETE FROM history WHERE scope = ? AND key = ? AND id <= ("
+                    "SELECT id FROM history WHERE scope = ? AND key = ? ORDER BY id DESC LIMIT 1 OFFSET ?)",
+                    (scope, key, scope, key, maxlen),
+                )
+
+    def _trim_loop(self):
+        while not self._stop.wait(self._trim_interval):
+            try:
+                self.trim()
+            except sqlite3.Error as e:
+                print(f"Ошибка при обрезке истории чатов: {e}")
+
+    def close(self):
+        self._stop.set()
+        self.trim()
+        with self._lock:
+            self._conn.close()
+
+
+# --- Одноразовый импорт старых JSON-файлов ---
+
+def _import_memory(store, data):
+    for user_id, history in data.items():
+        store.append(SCOPE_CHAYNIK, int(user_id), *history)
+
+
+def _import_user_data(store, data):
+    for user_id, u_data in data.items():
+        history = u_data.get("history", []) if isinstance(u_data, dict) else u_data
+        store.append(SCOPE_MINI_DM, int(user_id), *(history if isinstance(history, list) else []))
+
+
+def _import_guild_data(store, data):
+    for guild_id, g_data in data.items():
+        guild_id = int(guild_id)
+        if isinstance(g_data, dict):
+            if g_data.get("system_instruction"):
+                store.set_setting(SCOPE_MINI_GUILD, guild_id, "system_instruction", g_data["system_instruction"])
+            store.append(SCOPE_MINI_GUILD, guild_id, *g_data.get("history", []))
+        elif isinstance(g_data, str):
+            store.set_setting(SCOPE_MINI_GUILD, guild_id, "system_instruction", g_data)
+
+
+_LEGACY_IMPORTERS = {
+    LEGACY_MEMORY_FILE: _import_memory,
+    LEGACY_USER_DATA_FILE: _import_user_data,
+    LEGACY_GUILD_DATA_FILE: _import_guild_data,
+}
+
+
+def import_legacy_json(store, *paths):
+    """Переносит старые JSON-файлы (по умолчанию все три) в хранилище.
+
+    Файл импортируется в одной транзакции и переименовывается перед ее фиксацией: после ошибки
+    в базе не остается его части, а следующий запуск повторит импорт целиком.
+    """
+    for path in paths or _LEGACY_IMPORTERS:
+        if not os.path.exists(path):
+            continue
+        imported = f"{path}.imported"
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            with store.transaction():
+                _LEGACY_IMPORTERS[path](store, data)
+                os.replace(path, imported)
+            print(f"Файл '{path}' импортирован в {store.path} и переименован в '{imported}'.")
+        except (json.JSONDecodeError, TypeError, ValueError, KeyError, AttributeError, OSError, sqlite3.Error) as e:
+            if not os.path.exists(path) and os.path.exists(imported):
+                os.replace(imported, path)  # транзакция не зафиксирована - файл нужно импортировать снова
+            print(f"Ошибка при импорте '{path}': {e}")
+
+
+# Одно хранилище на процесс
+chat_store = ChatStore()
+
+if __name__ == "__main__":
+    import_legacy_json(chat_store)
+    chat_store.close()
@@ -1,41 +1,51 @@
 import asyncio
 import discord
 from discord.ext import commands
+from discord import app_commands
 import os
-import subprocess
 from dotenv import load_dotenv
 import google.generativeai as genai
-from collections import deque
-import json
-import aiohttp
 from io import BytesIO
 from g4f.client import Client
 import yt_dlp
-import requests
-import tempfile
-from PIL import Image
 from google.generativeai import GenerativeModel
-import edge_tts
 import re
+import shlex
 import logging
 import time
 import threading  # ИМПОРТИРУЕМ threading
+from gemini_client import gemini_pool, response_text
+from streaming_reply import StreamingReply, STREAM_REPLIES
+from chat_store import chat_store, import_legacy_json, LEGACY_MEMORY_FILE, SCOPE_CHAYNIK
+from context_window import ContextBuilder
+from memory_manager import MemoryManager
+from download_scheduler import download_scheduler, DownloadCancelled
+from audio_cache import audio_cache
+from ttl_cache import TTLCache
+from youtube_search import SearchService
+from tts_cache import synthesize, tts_audio_cache
+from speech_pipeline import SPEAK_PIPELINE, TTS_PARALLELISM, SentenceSplitter, SpeechQueue, bounded
+from media_workers import MediaWorkerPool
+from attachment_ingest import ingest_attachment
+from http_session import ResponseTooLarge
+from image_service import ImageService, ImageQueueFull
+from triggers import TriggerEngine
+from outbound import outbox
+import metrics
+from metrics import events_total, external_call_seconds, stage_seconds, queue_depth, register_cache
+from long_reply import PAGE_LIMIT, send_long
+from gateway_profile import GatewayStats, make_bot
+from vision_input import fetch_image, prepare_image
+from response_cache import response_cache
+from audio_sources import (OPUS_PASSTHROUGH, Interjection, file_source, stream_audio_source, encoded_source,
+                           encode_opus_once)
 
 # --- НОВЫЙ КОД ---
 # Словарь для хранения событий отмены скачивания для каждого сервера
 download_cancellation_events = {}
 
-
-# Пользовательское исключение для прерывания скачивания
-class DownloadCancelled(Exception):
-    pass
-
-
 # --- КОНЕЦ НОВОГО КОДА ---
 
-# ИСПРАВЛЕНИЕ: Добавляем замок для контроля одновременных загрузок
-download_lock = asyncio.Lock()
-
 logging.basicConfig(level=logging.INFO)
 
 load_dotenv()
@@ -45,53 +55,101 @@ GOOGLE_API_KEY = os.getenv("GEMINI_API_KEY")
 genai.configure(api_key=GOOGLE_API_KEY)
 MODEL = "gemini-2.5-flash-lite"
 
-intents = discord.Intents.all()
-bot = commands.Bot(command_prefix="!", intents=intents)
+# Намерения, кеш участников и шардирование настраиваются через CHAYNIK_INTENTS / CHAYNIK_SHARDS
+bot = make_bot("!")
+gateway_stats = GatewayStats()
 chaynik_file = "chaynik.wav"
 ffmpeg = "ffmpeg/ffmpeg"
 ALLOWED_EXTENSIONS = {".mp3", ".wav", ".ogg", ".flac", ".mp4", ".mkv", ".avi", ".mov"}
 
 MEMORY_SIZE = 1000
-MEMORY_FILE = "memory.json"
-memory = {}
+# Истории держатся в памяти только для недавно активных пользователей, остальные - в chat_store
+memory = MemoryManager(chat_store, SCOPE_CHAYNIK, MEMORY_SIZE)
+# Старый memory.json переносится в базу один раз при запуске, а не в каждом on_ready
+import_legacy_json(chat_store, LEGACY_MEMORY_FILE)
+# В модель уходит не вся память, а свежие реплики в пределах бюджета токенов
+memory_context = ContextBuilder(SCOPE_CHAYNIK, MODEL)
 
 queues = {}
 current_song_data = {}
 
 voice_chat_history = {}
 client = Client()
+image_service = ImageService(client)
+queue_depth.set_function(lambda: image_service.stats()["queued"], queue="images")
+trigger_engine = TriggerEngine()
 voice = "ru-RU-DmitryNeural"
 
 
+def discard_audio(file_path):
+    """Освобождает ссылку на файл из кеша или удаляет временный файл."""
+    if not file_path or audio_cache.release(file_path):
+        return
+    if os.path.exists(file_path):
+        os.remove(file_path)
+
+
 def full_cleanup(guild_id):
     print(f"Запускаю полную очистку для сервера {guild_id}...")
     if guild_id in current_song_data and current_song_data.get(guild_id):
         current_file = current_song_data[guild_id].get('file')
-        if current_file and os.path.exists(current_file):
+        if current_file:
             try:
-                os.remove(current_file)
-                print(f"Файл текущей песни '{current_file}' удален при очистке.")
+                discard_audio(current_file)
+                print(f"Файл текущей песни '{current_file}' освобожден при очистке.")
             except Exception as e:
                 print(f"Ошибка при удалении файла текущей песни '{current_file}': {e}")
 
     if guild_id in queues and queues.get(guild_id):
         for song in queues[guild_id]:
             queued_file = song.get('file')
-            if queued_file and os.path.exists(queued_file):
+            if queued_file:
                 try:
-                    os.remove(queued_file)
-                    print(f"Файл из очереди '{queued_file}' удален при очистке.")
+                    discard_audio(queued_file)
+                    print(f"Файл из очереди '{queued_file}' освобожден при очистке.")
                 except Exception as e:
                     print(f"Ошибка при удалении файла из очереди '{queued_file}': {e}")
 
+    speech_queue = speech_queues.pop(guild_id, None)
+    if speech_queue:
+        speech_queue.cancel()
+
     queues.pop(guild_id, None)
     current_song_data.pop(guild_id, None)
     print(f"Полная очистка для сервера {guild_id} завершена.")
 
 
+def cancel_downloads(guild_id):
+    """Отменяет идущие и еще не начатые скачивания сервера."""
+    # Сигнализируем о необходимости отмены скачивания
+    cancellation_event = download_cancellation_events.pop(guild_id, None)
+    if cancellation_event:
+        cancellation_event.set()
+        print(f"Установлен флаг отмены скачивания для сервера {guild_id}.")
+    download_scheduler.cancel_guild(guild_id)
+
+
+def reset_player_state():
+    """Очищает очереди, текущие песни, озвучку и скачивания всех серверов.
+
+    Нужна перед перезапуском упавшего бота: голосовые подключения уже закрыты,
+    и без очистки current_song_data навсегда заняли бы слот плеера.
+    """
+    guild_ids = set(queues) | set(current_song_data) | set(speech_queues) | set(download_cancellation_events)
+    for guild_id in guild_ids:
+        cancel_downloads(guild_id)
+        full_cleanup(guild_id)
+
+
 @bot.event
 async def on_ready():
-    load_memory()
+    await metrics.start()
+    if OPUS_PASSTHROUGH:
+        try:
+            # Кодируем чайник в Opus один раз, дальше файл просто копируется в голосовой канал
+            await encode_opus_once(chaynik_file, ffmpeg)
+        except Exception as e:
+            print(e)
     print(f"✅ Бот {bot.user} запущен и готов к работе!")
     try:
         synced = await bot.tree.sync()
@@ -100,17 +158,25 @@ async def on_ready():
         print(e)
 
 
+@bot.event
+async def on_socket_event_type(event_type):
+    gateway_stats.record(event_type)
+
+
+@bot.command(name="gateway", help="Сколько событий в секунду приходит от Discord.")
+async def gateway(ctx):
+    total, by_type = gateway_stats.rate()
+    top = sorted(by_type.items(), key=lambda item: item[1], reverse=True)[:10]
+    lines = [f"{event_type}: {rate:.2f}/с" for event_type, rate in top]
+    await ctx.reply(f"События шлюза: {total:.2f}/с за последнюю минуту\n" + "\n".join(lines))
+
+
 @bot.event
 async def on_voice_state_update(member, before, after):
     if member.id == bot.user.id:
         if before.channel is not None and after.channel is None:
             guild_id = before.channel.guild.id
-            # --- НОВЫЙ КОД ---
-            # Сигнализируем о необходимости отмены скачивания
-            if guild_id in download_cancellation_events:
-                download_cancellation_events[guild_id].set()
-                print(f"Установлен флаг отмены скачивания для сервера {guild_id}.")
-            # --- КОНЕЦ НОВОГО КОДА ---
+            cancel_downloads(guild_id)
             full_cleanup(guild_id)
             return
 
@@ -123,16 +189,18 @@ async def on_voice_state_update(member, before, after):
             if member.id not in voice_chat_history[after.channel.guild.id][after.channel.id]:
                 voice_chat_history[after.channel.guild.id][after.channel.id][member.id] = []
             if after.channel.guild.system_channel:
-                await after.channel.guild.system_channel.send(
-                    f'"{member.nick or member.name}" ({member}) подключился к голосовому каналу {after.channel.name}!')
+                # Входы и выходы за NOTICE_INTERVAL уходят одним сообщением
+                outbox.notice(after.channel.guild.system_channel,
+                              f'"{member.nick or member.name}" ({member}) подключился к голосовому каналу {after.channel.name}!')
         elif before.channel:
             if before.channel.guild.id in voice_chat_history and before.channel.id in voice_chat_history[
                 before.channel.guild.id] and member.id in voice_chat_history[before.channel.guild.id][
                 before.channel.id]:
                 voice_chat_history[before.channel.guild.id][before.channel.id].pop(member.id, None)
             if before.channel.guild.system_channel:
-                await before.channel.guild.system_channel.send(
-                    f'"{member.nick or member.name}" ({member}) отключился от голосового канала {before.channel.name}!')
+                # Входы и выходы за NOTICE_INTERVAL уходят одним сообщением
+                outbox.notice(before.channel.guild.system_channel,
+                              f'"{member.nick or member.name}" ({member}) отключился от голосового канала {before.channel.name}!')
 
 
 @bot.tree.command(name="help", description="Показывает список доступных команд")
@@ -148,6 +216,7 @@ async def help_command(interaction: discord.Interaction):
     embed.add_field(name="!say <запрос>", value="Сказать что-то с ИИ в голосовом чате", inline=False)
     embed.add_field(name="!image <запрос>", value="Сгенерировать изображение", inline=False)
     embed.add_field(name="!play <файл/ссылка/запрос>", value="Включить звук (добавляет в очередь)", inline=False)
+    embed.add_field(name="/play <ссылка/запрос>", value="То же, с подсказками из недавних поисков", inline=False)
     embed.add_field(name="!queue", value="Показать текущую очередь песен", inline=False)
     embed.add_field(name="!chaynik", value="Включить чайник", inline=False)
     embed.add_field(name="!vikini", value="Пропустить текущую песню", inline=False)
@@ -156,6 +225,17 @@ async def help_command(interaction: discord.Interaction):
     await interaction.response.send_message(embed=embed, ephemeral=True)
 
 
+async def chaynik_source():
+    """Звук чайника: заранее закодированный один раз в Opus файл, который FFmpeg только копирует."""
+    if OPUS_PASSTHROUGH:
+        try:
+            opus_file = await encode_opus_once(chaynik_file, ffmpeg)
+            return discord.FFmpegOpusAudio(opus_file, executable=ffmpeg, codec="opus")
+        except Exception as e:
+            print(f"Не удалось подготовить Opus-версию чайника: {e}")
+    return discord.FFmpegPCMAudio(chaynik_file, executable=ffmpeg)
+
+
 @bot.command(name="chaynik", help="Включить чайник")
 async def chaynik(ctx):
     if ctx.author.voice:
@@ -170,7 +250,7 @@ async def chaynik(ctx):
 
     if not ctx.voice_client.is_playing():
         try:
-            audio_source = discord.FFmpegPCMAudio(chaynik_file, executable=ffmpeg)
+            audio_source = await chaynik_source()
             ctx.voice_client.play(audio_source)
             await ctx.reply("Пидор, чайник включен")
         except Exception as e:
@@ -179,16 +259,7 @@ async def chaynik(ctx):
         await ctx.reply("Пидор, что-то уже играет")
 
 
-def extract_audio_from_video(file_path):
-    audio_path = f"temp_audio_{os.path.splitext(os.path.basename(file_path))[0]}.mp3"
-    result = subprocess.run(
-        [ffmpeg, "-i", file_path, "-vn", "-acodec", "libmp3lame", "-ar", "44100", "-ac", "2", "-ab", "192k",
-         audio_path],
-        capture_output=True, text=True
-    )
-    if result.returncode != 0:
-        raise Exception(f"Пидор, ошибка при извлечении аудио! {result.stderr}")
-    return audio_path
+media_pool = MediaWorkerPool(ffmpeg)
 
 
 async def process_file(ctx, attachment):
@@ -197,77 +268,47 @@ async def process_file(ctx, attachment):
         await ctx.reply(f"Пидор, поддерживаются только {', '.join(ALLOWED_EXTENSIONS)} файлы!")
         return None
 
-    temp_file_path = f"temp_{attachment.filename}"
     try:
-        await attachment.save(temp_file_path)
-        if file_ext in {".mp4", ".mkv", ".avi", ".mov"}:
-            audio_path = extract_audio_from_video(temp_file_path)
-            os.remove(temp_file_path)
-            return audio_path
-        else:
-            return temp_file_path
+        # Вложение читается потоком прямо в кеш (видео - через FFmpeg), одинаковые файлы берутся из кеша
+        return await ingest_attachment(attachment, audio_cache, media_pool)
+    except ResponseTooLarge as e:
+        await ctx.reply(f"Пидор, {e}")
+        return None
     except Exception as e:
         await ctx.reply(f"Пидор, ошибка при обработке файла: {e}")
-        if os.path.exists(temp_file_path):
-            os.remove(temp_file_path)
         return None
 
 
-def load_memory():
-    global memory
-    if os.path.exists(MEMORY_FILE):
-        try:
-            with open(MEMORY_FILE, "r", encoding="utf-8") as f:
-                data = json.load(f)
-                memory = {int(k): deque(v, maxlen=MEMORY_SIZE) for k, v in data.items()}
-        except (json.JSONDecodeError, TypeError) as e:
-            print(f"Ошибка при загрузке памяти: {e}. Создаем пустую память.")
-            memory = {}
-    else:
-        memory = {}
-
-
-def save_memory():
-    try:
-        with open(MEMORY_FILE, "w", encoding="utf-8") as f:
-            json.dump({k: list(v) for k, v in memory.items()}, f, ensure_ascii=False, indent=4)
-    except Exception as e:
-        print(f"Ошибка при сохранении памяти: {e}")
+def remember(user_id, turn):
+    """Дописывает реплику в хранилище и в историю пользователя, если она загружена."""
+    memory.append(user_id, turn)
 
 
 @bot.event
 async def on_message(message):
     if message.author == bot.user:
         return
+    events_total.inc(bot="chaynik", event="message")
     user_id = message.author.id
-    if user_id not in memory:
-        memory[user_id] = deque(maxlen=MEMORY_SIZE)
     # Сохраняем в память только если это не команда !ai, чтобы избежать дублирования
     if not message.content.startswith("!ai"):
-        memory[user_id].append({"role": "user", "parts": [message.content]})
+        remember(user_id, {"role": "user", "parts": [message.content]})
 
     if bot.user in message.mentions:
         await message.channel.typing()
         try:
             model = genai.GenerativeModel(MODEL)
-            chat = model.start_chat(history=list(memory[user_id]))
-            response = chat.send_message(message.content)
-            bot_reply = response.text
-            memory[user_id].append({"role": "model", "parts": [bot_reply]})
-            save_memory()
-            await send_message_in_chunks(message, bot_reply)
+            guild_id = message.guild.id if message.guild else None
+            full_history = memory.history(user_id)
+            chat = model.start_chat(history=memory_context.build(user_id, full_history))
+            # Кроме текущей реплики истории нет - ответ не зависит от пользователя и его можно кешировать.
+            # Считаем по полной истории: урезанное окно бывает коротким и у длинного разговора
+            bot_reply = await chat_reply(message, chat, message.content, guild_id, stateless=len(full_history) <= 1)
+            remember(user_id, {"role": "model", "parts": [bot_reply]})
         except Exception as e:
             await message.reply(f"⚠ Ошибка при общении с Gemini: {e}")
-    if "писюн" in message.content.lower():
-        await message.reply("Выключи его нахуй!!!!!")
-        await message.add_reaction("😈")
-    member_shap = message.guild.get_member(1030829712467034112)
-    if member_shap and (
-            "шап" in message.content.lower() or "пипунап" in message.content.lower() or "белый пипидастр" in message.content.lower()):
-        await message.reply(f"Мистер шап - писюнап!!! {member_shap.mention}")
-    if any(phrase in message.content.lower() for phrase in
-           ["кто в гс", "го в гс", "го играть", "кто играть", "кто пойдет в гс"]):
-        await message.channel.send(f"@everyone {message.content}")
+    # Реакции на ключевые фразы из triggers.json: один проход по сообщению
+    await trigger_engine.handle(message)
     await bot.process_commands(message)
 
 
@@ -282,8 +323,7 @@ def find_url(text):
 @bot.command()
 async def ai(ctx, *, user_input: str = None):
     user_id = ctx.author.id
-    temp_image_path = None
-    image_to_process = None
+    image_data = None
     prompt_text = user_input or "Опиши это изображение."
 
     try:
@@ -295,54 +335,48 @@ async def ai(ctx, *, user_input: str = None):
             if not attachment.filename.lower().endswith(('.png', '.jpg', '.jpeg', '.gif')):
                 await ctx.reply("Если прикрепляешь файл, это должно быть изображение (png, jpg, jpeg, gif).")
                 return
-
-            with tempfile.NamedTemporaryFile(delete=False, suffix=os.path.splitext(attachment.filename)[1]) as tmp_file:
-                await attachment.save(tmp_file.name)
-                temp_image_path = tmp_file.name
-            image_to_process = Image.open(temp_image_path)
+            image_data = await fetch_image(attachment.url)
 
         # 2. Если нет вложений, ищем URL в тексте
         elif user_input:
             url = find_url(user_input)
             if url:
                 prompt_text = user_input.replace(url, "").strip() or "Опиши это изображение."
-                response = requests.get(url, stream=True)
-                response.raise_for_status()
-                with tempfile.NamedTemporaryFile(delete=False, suffix=".jpg") as tmp_file:
-                    tmp_file.write(response.content)
-                    temp_image_path = tmp_file.name
-                image_to_process = Image.open(temp_image_path)
+                image_data = await fetch_image(url)
 
         # --- Выполнение логики ---
 
         # Если было найдено изображение (из файла или URL)
-        if image_to_process:
-            model = genai.GenerativeModel(MODEL)
-            # Запрос состоит из текста пользователя и изображения
-            response = model.generate_content([prompt_text, image_to_process], stream=False)
-
-            # --- ИСПРАВЛЕНИЕ: Закрываем файл перед удалением ---
-            image_to_process.close()
-            # ----------------------------------------------------
-
-            bot_reply = response.text
+        if image_data:
+            # Уменьшаем картинку до рабочего разрешения модели в отдельном потоке
+            image_part, image_digest = await prepare_image(image_data)
+
+            async def describe():
+                model = genai.GenerativeModel(MODEL)
+                # Запрос состоит из текста пользователя и изображения
+                response = await gemini_pool.generate_content(model, [prompt_text, image_part],
+                                                              guild_id=ctx.guild.id if ctx.guild else None)
+                return response.text
+
+            # Описание зависит только от картинки и запроса - повторы берем из кеша
+            cache_key = response_cache.key(MODEL, None, prompt_text, [image_digest])
+            bot_reply = await response_cache.get_or_call(cache_key, describe)
             # Разговоры с изображениями пока не сохраняем в общую память,
             # чтобы не усложнять структуру.
-            await send_message_in_chunks(ctx, bot_reply)
+            await send_long(ctx, bot_reply)
 
         # Если это чисто текстовый запрос
         elif user_input:
-            if user_id not in memory:
-                memory[user_id] = deque(maxlen=MEMORY_SIZE)
-            memory[user_id].append({"role": "user", "parts": [user_input]})
+            remember(user_id, {"role": "user", "parts": [user_input]})
 
             model = genai.GenerativeModel(MODEL)
-            chat = model.start_chat(history=list(memory[user_id]))
-            response = chat.send_message(user_input)
-            bot_reply = response.text
-            memory[user_id].append({"role": "model", "parts": [bot_reply]})
-            save_memory()
-            await send_message_in_chunks(ctx, bot_reply)
+            guild_id = ctx.guild.id if ctx.guild else None
+            full_history = memory.history(user_id)
+            chat = model.start_chat(history=memory_context.build(user_id, full_history))
+            # Кроме текущей реплики истории нет - ответ не зависит от пользователя и его можно кешировать.
+            # Считаем по полной истории: урезанное окно бывает коротким и у длинного разговора
+            bot_reply = await chat_reply(ctx, chat, user_input, guild_id, stateless=len(full_history) <= 1)
+            remember(user_id, {"role": "model", "parts": [bot_reply]})
 
         # Если вообще ничего не было введено
         else:
@@ -350,73 +384,151 @@ async def ai(ctx, *, user_input: str = None):
 
     except Exception as e:
         await ctx.reply(f"⚠ Произошла ошибка: {e}")
-    finally:
-        # Очистка временного файла изображения, если он был создан
-        if temp_image_path and os.path.exists(temp_image_path):
-            # Дополнительно убеждаемся, что объект image_to_process закрыт, если он существует
-            if image_to_process:
-                try:
-                    image_to_process.close()
-                except Exception:
-                    pass  # Игнорируем ошибки, если он уже закрыт
-            os.remove(temp_image_path)
 
 
-async def send_message_in_chunks(ctx, text):
-    for i in range(0, len(text), 1800):
-        await ctx.reply(text[i:i + 1800])
+async def chat_reply(ctx, chat, content, guild_id, stateless=False):
+    """Отправляет запрос в чат Gemini и отвечает на сообщение ctx, возвращает текст ответа.
+
+    При STREAM_REPLIES ответ показывается по мере генерации, иначе - целиком после получения.
+    Ответ длиннее страницы в итоге все равно уходит через send_long (страницы или файл).
+    Ответы на запросы без истории (stateless) берутся из кеша и не стримятся.
+    """
+    async def ask():
+        response = await gemini_pool.send_message(chat, content, guild_id=guild_id)
+        return response.text
+
+    if stateless:
+        bot_reply = await response_cache.get_or_call(response_cache.key(MODEL, None, content), ask)
+        await send_long(ctx, bot_reply)
+        return bot_reply
+
+    if not STREAM_REPLIES:
+        bot_reply = await ask()
+        await send_long(ctx, bot_reply)
+        return bot_reply
+
+    async with StreamingReply(lambda content: outbox.reply(ctx, content), max_length=PAGE_LIMIT) as reply:
+        async for chunk in gemini_pool.stream_message(chat, content, guild_id=guild_id):
+            await reply.feed(response_text(chunk))
+    if not reply.text.strip():
+        raise ValueError("Gemini не дал текстового ответа")
+    if reply.overflowed:
+        # Показанное начало заменяем одним сообщением со страницами, как без стриминга
+        await reply.retract()
+        await send_long(ctx, reply.text)
+    return reply.text
 
 
 @bot.command(name="ai_clear", help="Очистить память бота")
 async def ai_clear(ctx):
     user_id = ctx.author.id
-    if user_id in memory:
-        del memory[user_id]
-        save_memory()
+    memory.clear(user_id)
+    memory_context.reset(user_id)
     await ctx.reply("🧠 Моя память очищена!")
 
 
+@bot.command(name="ai_cache", help="Статистика кеша ответов ИИ")
+async def ai_cache(ctx):
+    stats = response_cache.stats()
+    await ctx.reply(f"Кеш ответов: {stats['size']} записей, попаданий {stats['hits']} "
+                    f"({stats['hit_rate']:.0%}), объединено одновременных запросов {stats['deduplicated']}, "
+                    f"сэкономлено {stats['saved_seconds']:.1f} с ожидания Gemini")
+
+
 @bot.command(name="image", help="Сгенерировать изображение")
 async def generate_image(ctx, *, prompt: str = None):
     if not prompt:
         await ctx.reply("Введите запрос!")
         return
+    try:
+        job, position = image_service.submit(prompt)
+    except ImageQueueFull as e:
+        await ctx.reply(f"Пидор, {e}")
+        return
+    if position:
+        await ctx.reply(f"🎨 Запрос в очереди генерации, место: {position}")
     await ctx.typing()
     try:
-        response = await asyncio.to_thread(client.images.generate, model="flux", prompt=prompt)
-        image_url = response.data[0].url
-        async with aiohttp.ClientSession() as session:
-            async with session.get(image_url) as resp:
-                if resp.status == 200:
-                    image_data = await resp.read()
-                    image_file = discord.File(BytesIO(image_data), filename="generated_image.png")
-                    await ctx.reply(file=image_file)
-                else:
-                    await ctx.reply("Не удалось скачать сгенерированное изображение.")
+        image_data = await job
+        image_file = discord.File(BytesIO(image_data), filename="generated_image.png")
+        await ctx.reply(file=image_file)
     except Exception as e:
         await ctx.reply(f"Произошла ошибка при генерации изображения: {e}")
 
 
+# Предпочитаем Opus: такой звук не нужно перекодировать ни при скачивании, ни при воспроизведении
 ydl_opts = {
-    'format': 'bestaudio/best',
+    'format': 'bestaudio[acodec=opus]/bestaudio/best',
     'outtmpl': 'temp_%(id)s_%(epoch)s.%(ext)s',
     'noplaylist': True,
-    'postprocessors': [{'key': 'FFmpegExtractAudio', 'preferredcodec': 'mp3', 'preferredquality': '192'}],
+    'postprocessors': [{'key': 'FFmpegExtractAudio', 'preferredcodec': 'opus', 'preferredquality': '192'}],
     'ffmpeg_location': ffmpeg,
     'quiet': True,
     'no_warnings': True,
 }
 
 
+# --- Потоковое воспроизведение ---
+# Вместо скачивания и перекодирования в mp3 получаем прямую ссылку на аудиопоток
+# и отдаем ее FFmpeg. Скачивание остается запасным вариантом.
+MUSIC_STREAMING = os.getenv("MUSIC_STREAMING", "1") == "1"
+STREAM_URL_TTL = 30 * 60  # прямые ссылки YouTube живут несколько часов, но обновляем их с запасом
+FFMPEG_STREAM_BEFORE_OPTIONS = "-reconnect 1 -reconnect_streamed 1 -reconnect_on_network_error 1 -reconnect_delay_max 5"
+
+# Для потока тоже предпочитаем Opus: FFmpeg только скопирует его без перекодирования
+stream_ydl_opts = {
+    'format': 'bestaudio[acodec=opus]/bestaudio/best',
+    'noplaylist': True,
+    'quiet': True,
+    'no_warnings': True,
+}
+
+
+def stream_info_from(info, video_url=None):
+    """Достает из результата extract_info(download=False) все, что нужно для потокового воспроизведения."""
+    if info.get('entries'):
+        info = info['entries'][0]
+    if not info.get('url'):
+        return None
+    return {
+        'stream_url': info['url'],
+        'headers': info.get('http_headers') or {},
+        'webpage_url': info.get('webpage_url') or video_url,
+        'title': info.get('title', 'Без названия'),
+        'acodec': info.get('acodec'),
+        'cache_key': audio_cache.key_for_video(info.get('extractor_key'), info.get('id')),
+        'resolved_at': info.get('fetched_at') or time.time(),
+    }
+
+
+def resolve_stream(video_url):
+    """Получает прямую ссылку на аудиопоток без скачивания."""
+    try:
+        with yt_dlp.YoutubeDL(stream_ydl_opts) as ydl:
+            logging.info(f"Получаю ссылку на поток: {video_url}")
+            with external_call_seconds.time(service="ytdlp", op="resolve"):
+                info = ydl.extract_info(video_url, download=False)
+            return stream_info_from(info, video_url)
+    except Exception as e:
+        logging.error(f"Ошибка при получении ссылки на поток: {e}")
+        return None
+
+
+def stream_before_options(headers):
+    """Опции FFmpeg для чтения потока: переподключение при обрывах и заголовки yt-dlp."""
+    options = FFMPEG_STREAM_BEFORE_OPTIONS
+    if headers:
+        header_lines = "".join(f"{name}: {value}\r\n" for name, value in headers.items())
+        options += f" -headers {shlex.quote(header_lines)}"
+    return options
+
+
+search_service = SearchService(ydl_opts)
+register_cache("youtube_search", search_service.cache.stats)
+
+
 def search_youtube(query, max_results=1):
-    search_query = f'ytsearch{max_results}:{query}'
-    with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-        try:
-            result = ydl.extract_info(search_query, download=False)
-            return result.get('entries', [])
-        except Exception as e:
-            logging.error(f"Ошибка при поиске на YouTube: {e}")
-            return []
+    return search_service.search(query, max_results)
 
 
 # --- ИЗМЕНЕННАЯ ФУНКЦИЯ ---
@@ -433,15 +545,30 @@ def download_audio(video_url, cancellation_event):
     try:
         with yt_dlp.YoutubeDL(local_ydl_opts) as ydl:
             logging.info(f"Начинаю обработку URL: {video_url}")
-            info = ydl.extract_info(video_url, download=True)
+            with external_call_seconds.time(service="ytdlp", op="extract"):
+                info = ydl.extract_info(video_url, download=False)
+            if info.get('entries'):
+                info = info['entries'][0]
             title = info.get('title', 'Без названия')
+
+            # Уже скачанный трек берем из кеша - без сети и перекодирования
+            cache_key = audio_cache.key_for_video(info.get('extractor_key'), info.get('id'))
+            cached = audio_cache.acquire(cache_key)
+            if cached:
+                logging.info(f"Трек '{title}' найден в кеше: {cached}")
+                return cached, title
+
+            with external_call_seconds.time(service="ytdlp", op="download"):
+                info = ydl.process_ie_result(info, download=True)
             base_filename = ydl.prepare_filename(info).rsplit('.', 1)[0]
-            audio_file = f"{base_filename}.mp3"
+            audio_file = f"{base_filename}.opus"
 
             # Небольшая задержка, чтобы файл успел полностью записаться
             time.sleep(0.5)
 
             if os.path.exists(audio_file) and os.path.getsize(audio_file) > 0:
+                if cache_key:
+                    return audio_cache.put(cache_key, audio_file), title
                 return audio_file, title
             return None, None
     except DownloadCancelled as e:
@@ -454,8 +581,176 @@ def download_audio(video_url, cancellation_event):
 
 # --- КОНЕЦ ИЗМЕНЕННОЙ ФУНКЦИИ ---
 
+async def stream_source(song):
+    """Создает источник для потоковой песни, при необходимости обновив ссылку или скачав файл."""
+    if time.time() - song['resolved_at'] > STREAM_URL_TTL:
+        fresh = await asyncio.to_thread(resolve_stream, song['webpage_url'])
+        if fresh:
+            song.update(fresh)
+        else:
+            # Поток недоступен - пробуем старый путь со скачиванием
+            audio_file, _ = await asyncio.to_thread(download_audio, song['webpage_url'], threading.Event())
+            if not audio_file:
+                return None
+            song['file'] = audio_file
+            return await file_source(audio_file, ffmpeg)
+    return stream_audio_source(song['stream_url'], ffmpeg, acodec=song.get('acodec'),
+                               before_options=stream_before_options(song['headers']))
+
+
+# --- Подготовка треков очереди ---
+# Каждый элемент queues[guild_id] хранит состояние подготовки ('state'):
+# pending -> resolving -> ready | failed. Префетчер держит готовыми следующие
+# N треков сервера, чтобы play_next запускал их без ожидания.
+PREFETCH_DEPTH = int(os.getenv("PREFETCH_DEPTH", "2"))
+MAX_PREFETCH_DEPTH = 5
+# Играющий потоком трек докачивается в кеш только при повторном запросе за STREAMED_KEYS_TTL:
+# иначе каждая песня скачивалась бы дважды (поток + файл) и снова перекодировалась
+AUDIO_CACHE_FILL_ON_STREAM = os.getenv("AUDIO_CACHE_FILL_ON_STREAM", "1") == "1"
+STREAMED_KEYS_TTL = 24 * 3600
+prefetch_depths = {}  # guild_id -> N, заданное командой !prefetch
+
+TRACK_STATE_LABELS = {
+    'pending': "ожидает",
+    'resolving': "готовится",
+    'ready': "готов",
+    'failed': "ошибка",
+}
+
+
+def make_track(query):
+    """Создает еще не подготовленный трек из ссылки или поискового запроса."""
+    track = {'title': query, 'state': 'pending', 'file': None, 'requested_at': time.perf_counter()}
+    if query.startswith("http"):
+        track['webpage_url'] = query
+    else:
+        track['query'] = query
+    return track
+
+
+async def resolve_track(guild_id, track):
+    """Готовит трек к воспроизведению: находит поток или скачивает файл."""
+    track['state'] = 'resolving'
+    started = time.perf_counter()
+    cancellation_event = download_cancellation_events.setdefault(guild_id, threading.Event())
+    try:
+        if track.get('query'):
+            videos = await asyncio.to_thread(search_youtube, track['query'])
+            if not videos:
+                track['state'] = 'failed'
+                track['error'] = "По запросу ничего не найдено."
+                return
+            track['webpage_url'] = videos[0].get('webpage_url')
+            track['title'] = videos[0].get('title', 'Без названия')
+            # Результат поиска уже содержит ссылку на поток - повторный запрос не нужен
+            stream_info = stream_info_from(videos[0], track['webpage_url']) if MUSIC_STREAMING else None
+        elif MUSIC_STREAMING:
+            stream_info = await download_scheduler.run(guild_id, resolve_stream, track['webpage_url'],
+                                                       cancellation_event=cancellation_event)
+        else:
+            stream_info = None
+
+        if stream_info:
+            cached = audio_cache.acquire(stream_info['cache_key'])
+            if cached and cancellation_event.is_set():
+                # Сервер очищен, пока трек готовился: ссылку на кеш никто не освободит
+                discard_audio(cached)
+                track['state'] = 'failed'
+                track['error'] = "Подготовка трека отменена."
+                return
+            if cached:
+                # Трек уже есть в кеше - играем файл, а не поток
+                track['file'] = cached
+                track['title'] = stream_info['title']
+            else:
+                track.update(stream_info)
+                fill_cache_in_background(stream_info['webpage_url'], stream_info['cache_key'])
+            track['state'] = 'ready'
+            return
+
+        audio_file, title = await download_scheduler.run(guild_id, download_audio, track['webpage_url'],
+                                                         cancellation_event, cancellation_event=cancellation_event)
+        if audio_file and cancellation_event.is_set():
+            # Бот покинул канал, пока шло скачивание - файл больше никому не нужен
+            discard_audio(audio_file)
+            audio_file = None
+        if audio_file:
+            track['file'] = audio_file
+            track['title'] = title or track['title']
+            track['state'] = 'ready'
+        else:
+            track['state'] = 'failed'
+            track['error'] = "Не удалось получить аудиофайл."
+    except DownloadCancelled as e:
+        logging.warning(e)
+        track['state'] = 'failed'
+        track['error'] = str(e)
+    except Exception as e:
+        logging.error(f"Ошибка при подготовке трека '{track['title']}': {e}", exc_info=True)
+        track['state'] = 'failed'
+        track['error'] = str(e)
+    finally:
+        stage_seconds.observe(time.perf_counter() - started, command="play", stage="prepare", outcome=track['state'])
+        status_message = track.pop('status_message', None)
+        if status_message:
+            try:
+                if track['state'] == 'ready':
+                    await status_message.edit(content=f"Добавлено в очередь: {track['title']}")
+                else:
+                    await status_message.edit(content=f"Не удалось подготовить '{track['title']}': {track['error']}")
+            except discord.HTTPException:
+                pass
+
+
+caching_keys = set()  # треки, которые сейчас докачиваются в кеш
+streamed_keys = TTLCache(maxsize=4096, ttl=STREAMED_KEYS_TTL)  # треки, уже игравшие потоком
+
+
+def fill_cache_in_background(video_url, cache_key):
+    """Докачивает в кеш трек, который играет потоком уже второй раз, чтобы следующие запросы не тратили сеть."""
+    if not AUDIO_CACHE_FILL_ON_STREAM or not cache_key or cache_key in caching_keys:
+        return
+    if streamed_keys.get(cache_key) is None:
+        streamed_keys.set(cache_key, True)
+        return
+    streamed_keys.pop(cache_key)
+    caching_keys.add(cache_key)
+
+    async def fill():
+        try:
+            # Фоновые загрузки идут отдельной "гильдией" планировщика и не мешают командам
+            audio_file, _ = await download_scheduler.run(None, download_audio, video_url, threading.Event())
+            if audio_file:
+                audio_cache.release(audio_file)
+        except Exception as e:
+            logging.error(f"Ошибка при фоновом кешировании '{video_url}': {e}")
+        finally:
+            caching_keys.discard(cache_key)
+
+    asyncio.create_task(fill())
+
+
+def ensure_ready(guild_id, track):
+    """Запускает подготовку трека (если еще не запущена) и возвращает ее задачу."""
+    if track.get('task') is None:
+        if track['state'] in ('ready', 'failed'):
+            track['task'] = asyncio.get_running_loop().create_future()
+            track['task'].set_result(None)
+        else:
+            track['task'] = asyncio.create_task(resolve_track(guild_id, track))
+    return track['task']
+
+
+def prefetch(guild_id):
+    """Запускает фоновую подготовку следующих N треков очереди сервера."""
+    depth = prefetch_depths.get(guild_id, PREFETCH_DEPTH)
+    for track in queues.get(guild_id, [])[:depth]:
+        ensure_ready(guild_id, track)
+
+
 async def play_next(ctx):
     guild_id = ctx.guild.id
+    started = time.perf_counter()
     if guild_id in current_song_data and current_song_data[guild_id]:
         old_data = current_song_data[guild_id]
         old_source = old_data.get('source')
@@ -463,28 +758,75 @@ async def play_next(ctx):
         if old_source:
             old_source.cleanup()
         await asyncio.sleep(0.5)
-        if old_file and os.path.exists(old_file):
+        if old_file:
             try:
-                os.remove(old_file)
-                print(f"Временный файл '{old_file}' успешно удален.")
+                discard_audio(old_file)
+                print(f"Файл '{old_file}' успешно освобожден.")
             except Exception as e:
                 print(f"КРИТИЧЕСКАЯ ОШИБКА: Не удалось удалить старый файл '{old_file}': {e}")
     current_song_data[guild_id] = None
 
-    if guild_id in queues and queues[guild_id]:
-        song_to_play = queues[guild_id].pop(0)
-        file_path, title = song_to_play['file'], song_to_play['title']
-        if not os.path.exists(file_path):
-            await ctx.send(f"Ошибка: аудиофайл для '{title}' не найден. Пропускаю.")
-            await play_next(ctx)
-            return
-        await ctx.send(f"Играю гамно: {title}!")
-        new_source = discord.FFmpegPCMAudio(file_path, executable=ffmpeg)
-        current_song_data[guild_id] = {'file': file_path, 'source': new_source, 'title': title}
-        ctx.voice_client.play(new_source, after=lambda e: bot.loop.create_task(play_next(ctx)))
-    else:
+    if not queues.get(guild_id):
         await ctx.send("Очередь воспроизведения завершена.")
-        current_song_data[guild_id] = None
+        return
+
+    song_to_play = queues[guild_id].pop(0)
+    # Пока следующий трек играет, готовим те, что за ним
+    prefetch(guild_id)
+    # Занимаем слот, чтобы параллельный !play не запустил еще один play_next.
+    # Настоящие данные трека попадают в current_song_data только после успешного play().
+    placeholder = {'file': None, 'source': None, 'title': song_to_play['title']}
+    current_song_data[guild_id] = placeholder
+    new_source = None
+    error = None
+    try:
+        if song_to_play['state'] != 'ready':
+            await asyncio.shield(ensure_ready(guild_id, song_to_play))
+        # Фраза !say/!speak или чайник играют сами по себе - музыку включаем после них,
+        # иначе play() упадет с "Already playing audio"
+        while ctx.voice_client and ctx.voice_client.is_playing() and current_song_data.get(guild_id) is placeholder:
+            await asyncio.sleep(0.5)
+        if current_song_data.get(guild_id) is not placeholder or not ctx.voice_client:
+            # Пока ждали, бот покинул канал и очередь была очищена - файл трека больше не нужен
+            if current_song_data.get(guild_id) is not placeholder:
+                discard_audio(song_to_play.get('file'))
+            return
+        title = song_to_play['title']
+        if song_to_play['state'] != 'ready':
+            error = f"Ошибка: не удалось подготовить '{title}'. Пропускаю."
+        elif song_to_play.get('stream_url'):
+            new_source = await stream_source(song_to_play)
+            if new_source is None:
+                error = f"Ошибка: не удалось получить поток для '{title}'. Пропускаю."
+        elif not os.path.exists(song_to_play['file']):
+            error = f"Ошибка: аудиофайл для '{title}' не найден. Пропускаю."
+        else:
+            new_source = await file_source(song_to_play['file'], ffmpeg)
+        if error:
+            try:
+                await ctx.send(error)
+            except discord.HTTPException as e:
+                print(f"Не удалось отправить сообщение об ошибке: {e}")
+        else:
+            ctx.voice_client.play(new_source, after=lambda e: bot.loop.create_task(play_next(ctx)))
+            current_song_data[guild_id] = {'file': song_to_play.get('file'), 'source': new_source, 'title': title}
+    finally:
+        if current_song_data.get(guild_id) is placeholder:
+            # Трек так и не заиграл (ошибка или исключение) - освобождаем слот, иначе сервер зависнет
+            current_song_data[guild_id] = None
+            if new_source:
+                new_source.cleanup()
+            discard_audio(song_to_play.get('file'))
+
+    if error:
+        await play_next(ctx)
+        return
+    # gap - пауза между треками, request_to_audio - от команды до звука (включая ожидание в очереди)
+    stage_seconds.observe(time.perf_counter() - started, command="play", stage="gap", outcome="ok")
+    if song_to_play.get('requested_at'):
+        stage_seconds.observe(time.perf_counter() - song_to_play['requested_at'], command="play",
+                              stage="request_to_audio", outcome="ok")
+    await ctx.send(f"Играю гамно: {title}!")
 
 
 # --- ПОЛНОСТЬЮ ПЕРЕПИСАННАЯ КОМАНДА ---
@@ -500,82 +842,113 @@ async def play(ctx, *, query: str = None):
         await ctx.voice_client.move_to(channel)
 
     guild_id = ctx.guild.id
-    status_message = None  # Сообщение, которое будем редактировать
 
-    # Создаем событие отмены и сохраняем его
-    cancellation_event = threading.Event()
-    download_cancellation_events[guild_id] = cancellation_event
+    if ctx.message.attachments:
+        # Вложения обрабатываются сразу и попадают в очередь уже готовыми
+        await ctx.channel.typing()
+        attachment = ctx.message.attachments[0]
+        status_message = await ctx.reply(f"Обрабатываю файл: {attachment.filename}...")
+        audio_file = await process_file(ctx, attachment)
+        if not audio_file:
+            await status_message.edit(content="Не удалось обработать твой запрос и получить аудиофайл.")
+            return
+        if not ctx.voice_client or not ctx.voice_client.is_connected():
+            print("Команда play отменена, так как бот был отключен.")
+            await status_message.delete()
+            discard_audio(audio_file)
+            return
+        track = {'title': attachment.filename, 'state': 'ready', 'file': audio_file}
+    elif query:
+        track = make_track(query)
+        status_message = None
+    else:
+        await ctx.reply("Пидор, прикрепи файл, дай ссылку или напиши, что искать!")
+        return
 
-    try:
-        async with download_lock:
-            await ctx.channel.typing()
-            audio_file_to_play, title = None, "Без названия"
-
-            if ctx.message.attachments:
-                attachment = ctx.message.attachments[0]
-                title = attachment.filename
-                status_message = await ctx.reply(f"Обрабатываю файл: {title}...")
-                audio_file_to_play = await process_file(ctx, attachment)
-            elif query:
-                if query.startswith("http"):
-                    status_message = await ctx.reply("Скачиваю аудио по ссылке...")
-                    audio_file_to_play, title = await asyncio.to_thread(download_audio, query, cancellation_event)
-                else:
-                    status_message = await ctx.reply(f"Ищу на YouTube: '{query}'...")
-                    videos = await asyncio.to_thread(search_youtube, query)
-                    if not videos:
-                        await status_message.edit(content="По твоему запросу ничего не найдено.")
-                        return
-                    video_url = videos[0].get('webpage_url')
-                    title = videos[0].get('title', 'Без названия')
-                    await status_message.edit(content=f"Нашел: '{title}'. Скачиваю...")
-                    audio_file_to_play, _ = await asyncio.to_thread(download_audio, video_url, cancellation_event)
-            else:
-                await ctx.reply("Пидор, прикрепи файл, дай ссылку или напиши, что искать!")
-                return
+    queues.setdefault(guild_id, []).append(track)
+    # Музыка не играет, даже если сейчас звучит фраза: play_next дождется ее конца
+    idle = not current_song_data.get(guild_id)
+    if idle:
+        if not status_message:
+            status_message = await ctx.reply(f"Ищу: '{query}'...")
+        await play_next(ctx)
+        await status_message.delete()  # Удаляем статусное сообщение
+    else:
+        if track['state'] == 'ready':
+            await status_message.edit(content=f"Добавлено в очередь: {track['title']}")
+        else:
+            # Название уточнится, когда префетчер подготовит трек
+            track['status_message'] = await ctx.reply(f"Добавлено в очередь: {query}")
+        prefetch(guild_id)
 
-            # Проверяем, был ли бот отключен во время выполнения
-            if not ctx.voice_client or not ctx.voice_client.is_connected() or cancellation_event.is_set():
-                print("Команда play отменена, так как бот был отключен.")
-                if status_message:
-                    await status_message.delete()
-                # Удаляем файл, если он успел скачаться
-                if audio_file_to_play and os.path.exists(audio_file_to_play):
-                    os.remove(audio_file_to_play)
-                return
 
-            if audio_file_to_play:
-                if guild_id not in queues:
-                    queues[guild_id] = []
-                song = {'file': audio_file_to_play, 'title': title}
-                queues[guild_id].append(song)
+# --- КОНЕЦ ПЕРЕПИСАННОЙ КОМАНДЫ ---
 
-                if not ctx.voice_client.is_playing():
-                    if status_message:
-                        await status_message.delete()  # Удаляем статусное сообщение
-                    await play_next(ctx)
-                else:
-                    if status_message:
-                        await status_message.edit(content=f"Добавлено в очередь: {title}")
-            else:
-                if status_message:
-                    await status_message.edit(content="Не удалось обработать твой запрос и получить аудиофайл.")
+AUTOCOMPLETE_MIN_LENGTH = 3  # с какой длины запроса искать варианты в фоне
+autocomplete_searches = set()  # запросы, которые ищутся в фоне для автодополнения
 
-    finally:
-        # В любом случае удаляем событие отмены после завершения команды
-        download_cancellation_events.pop(guild_id, None)
 
+class ChannelContext(commands.Context):
+    """Контекст /play, который пишет прямо в канал, а не в ответ на взаимодействие.
+
+    Ответ на взаимодействие можно дописывать только 15 минут, а play_next пишет в ctx,
+    пока играет вся очередь.
+    """
+
+    async def send(self, content=None, **kwargs):
+        return await self.channel.send(content, **kwargs)
+
+    async def reply(self, content=None, **kwargs):
+        return await self.channel.send(content, **kwargs)
+
+
+@bot.tree.command(name="play", description="Включить звук (добавляет в очередь)")
+@app_commands.describe(запрос="Ссылка или что искать на YouTube")
+async def play_slash_command(interaction: discord.Interaction, запрос: str):
+    # Отвечаем на взаимодействие сразу, дальше все сообщения идут через канал
+    await interaction.response.send_message(f"Принято: {запрос}")
+    ctx = await ChannelContext.from_interaction(interaction)
+    await play(ctx, query=запрос)
+
+
+@play_slash_command.autocomplete("запрос")
+async def play_autocomplete(interaction: discord.Interaction, current: str):
+    suggestions = search_service.suggest(current)
+    if not suggestions and len(current) >= AUTOCOMPLETE_MIN_LENGTH and not autocomplete_searches:
+        # В кеше ничего нет - ищем в фоне, следующие нажатия клавиш получат результаты
+        autocomplete_searches.add(current)
+        task = asyncio.create_task(asyncio.to_thread(search_youtube, current, 5))
+        task.add_done_callback(lambda _: autocomplete_searches.discard(current))
+    return [app_commands.Choice(name=title[:100] or url, value=url) for title, url in suggestions]
+
+
+@bot.command(name="prefetch", help="Сколько следующих песен готовить заранее (0-5).")
+async def prefetch_command(ctx, depth: int = None):
+    guild_id = ctx.guild.id
+    if depth is None:
+        await ctx.reply(f"Заранее готовлю {prefetch_depths.get(guild_id, PREFETCH_DEPTH)} песен(и).")
+        return
+    depth = max(0, min(depth, MAX_PREFETCH_DEPTH))
+    prefetch_depths[guild_id] = depth
+    prefetch(guild_id)
+    await ctx.reply(f"Теперь заранее готовлю {depth} песен(и).")
 
-# --- КОНЕЦ ПЕРЕПИСАННОЙ КОМАНДЫ ---
 
 @bot.command(name="queue", help="Показать текущую очередь песен.")
 async def queue(ctx):
     guild_id = ctx.guild.id
+    downloads = download_scheduler.stats(guild_id)
+    downloads_text = (f"Загрузки: в очереди {downloads['queued']}, выполняется {downloads['in_flight']}, "
+                      f"среднее ожидание {downloads['avg_wait']:.1f} с")
     if guild_id in queues and queues[guild_id]:
         embed = discord.Embed(title="Очередь воспроизведения", color=discord.Color.blue())
         for i, song in enumerate(queues[guild_id]):
-            embed.add_field(name=f"{i + 1}. {song['title']}", value="\u200b", inline=False)
+            state = TRACK_STATE_LABELS.get(song.get('state'), "\u200b")
+            embed.add_field(name=f"{i + 1}. {song['title']}", value=state, inline=False)
+        embed.set_footer(text=downloads_text)
         await ctx.send(embed=embed)
+    elif downloads['queued'] or downloads['in_flight']:
+        await ctx.send(f"Очередь пуста. {downloads_text}")
     else:
         await ctx.send("Очередь пуста.")
 
@@ -599,16 +972,31 @@ async def viydi(ctx):
 
 
 async def text_to_speech(text: str) -> str:
+    """Озвучивает текст через кеш синтеза; файл нужно отпустить через tts_audio_cache.release."""
     try:
-        communicate = edge_tts.Communicate(text, voice=voice)
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".mp3") as file:
-            await communicate.save(file.name)
-            return file.name
+        return await synthesize(text, voice)
     except Exception as e:
         print(f"Ошибка при генерации речи с edge_tts: {e}")
         return None
 
 
+def start_speech(voice_client, path, done):
+    """Включает фразу; done() вызывается из потока плеера, когда она доиграла.
+
+    Если что-то уже играет, фраза вклинивается в текущий источник, и музыка продолжается после нее.
+    stop() вызвал бы after музыки, и play_next запустил бы следующий трек поверх фразы.
+    """
+    phrase = encoded_source(path, ffmpeg)
+    if not voice_client.is_playing():
+        voice_client.play(phrase, after=lambda e: done())
+        return
+    interjection = Interjection(phrase, voice_client.source, done)
+    voice_client.source = interjection
+    if not voice_client.is_playing():
+        # Плеер успел доиграть до подмены - фраза не прозвучит, но ожидающих надо отпустить
+        interjection.finish_phrase()
+
+
 @bot.command()
 async def say(ctx, *, text: str = None):
     if not ctx.author.voice or not ctx.author.voice.channel:
@@ -630,12 +1018,57 @@ async def say(ctx, *, text: str = None):
     elif ctx.voice_client.channel != channel:
         await ctx.voice_client.move_to(channel)
 
-    if ctx.voice_client.is_playing():
-        ctx.voice_client.stop()
-        await asyncio.sleep(0.5)
+    start_speech(ctx.voice_client, file_path, lambda: tts_audio_cache.release(file_path))
+
 
-    ctx.voice_client.play(discord.FFmpegPCMAudio(executable=ffmpeg, source=file_path),
-                          after=lambda e: os.remove(file_path))
+speech_queues = {}  # guild_id -> SpeechQueue с фразами !speak
+tts_semaphore = asyncio.Semaphore(TTS_PARALLELISM)
+
+
+def speech_queue_for(guild):
+    """Очередь озвучки сервера; создается при первом использовании."""
+    if guild.id not in speech_queues:
+        async def play_phrase(path):
+            voice_client = guild.voice_client
+            if voice_client is None or not voice_client.is_connected():
+                return
+            loop = asyncio.get_running_loop()
+            finished = asyncio.Event()
+            start_speech(voice_client, path, lambda: loop.call_soon_threadsafe(finished.set))
+            await finished.wait()
+
+        speech_queues[guild.id] = SpeechQueue(play_phrase, tts_audio_cache.release)
+    return speech_queues[guild.id]
+
+
+async def speak_pipelined(ctx, chat, text):
+    """Озвучивает ответ по предложениям, пока он еще генерируется. Возвращает полный текст ответа."""
+    queue = speech_queue_for(ctx.guild)
+    synthesize_sentence = bounded(tts_semaphore, text_to_speech)
+    splitter = SentenceSplitter()
+    started = time.perf_counter()
+    queued = 0
+
+    def enqueue(sentence):
+        nonlocal queued
+        task = asyncio.create_task(synthesize_sentence(sentence))
+        if not queued:
+            # Главная задержка !speak - от команды до готового звука первого предложения
+            stage_seconds.observe(time.perf_counter() - started, command="speak", stage="first_sentence", outcome="ok")
+            task.add_done_callback(lambda _: stage_seconds.observe(time.perf_counter() - started, command="speak",
+                                                                   stage="first_audio", outcome="ok"))
+        queued += 1
+        queue.put(task)
+
+    async for chunk in gemini_pool.stream_message(chat, text, guild_id=ctx.guild.id):
+        for sentence in splitter.feed(response_text(chunk)):
+            enqueue(sentence)
+    rest = splitter.flush()
+    if rest:
+        enqueue(rest)
+    if not splitter.text.strip():
+        raise ValueError("Gemini не дал текстового ответа")
+    return splitter.text
 
 
 @bot.command(name="speak", help="Заставляет бота говорить в голосовом канале.")
@@ -646,18 +1079,35 @@ async def speak(ctx, *, text: str):
 
     channel = ctx.author.voice.channel
     await ctx.typing()
+
+    if SPEAK_PIPELINE:
+        # Подключаемся заранее, чтобы первое предложение прозвучало сразу после синтеза
+        if ctx.voice_client is None:
+            await channel.connect()
+        elif ctx.voice_client.channel != channel:
+            await ctx.voice_client.move_to(channel)
+        try:
+            user_id = ctx.author.id
+            remember(user_id, {"role": "user", "parts": [text]})
+            model = genai.GenerativeModel(MODEL)
+            chat = model.start_chat(history=memory_context.build(user_id, memory.history(user_id)))
+            bot_response_text = await speak_pipelined(ctx, chat, text)
+            remember(user_id, {"role": "model", "parts": [bot_response_text]})
+        except Exception as e:
+            await ctx.reply(f"Ошибка при генерации ответа: {e}")
+        return
+
     bot_response_text = ""
     try:
         user_id = ctx.author.id
-        if user_id not in memory:
-            memory[user_id] = deque(maxlen=MEMORY_SIZE)
-        memory[user_id].append({"role": "user", "parts": [text]})
+        remember(user_id, {"role": "user", "parts": [text]})
         model = genai.GenerativeModel(MODEL)
-        chat = model.start_chat(history=list(memory[user_id]))
-        response = chat.send_message(text)
+        chat = model.start_chat(history=memory_context.build(user_id, memory.history(user_id)))
+        response = await gemini_pool.send_message(chat, text, guild_id=ctx.guild.id)
         bot_response_text = response.text
-        memory[user_id].append({"role": "model", "parts": [bot_response_text]})
-        save_memory()
+        if not bot_response_text.strip():
+            raise ValueError("Gemini не дал текстового ответа")
+        remember(user_id, {"role": "model", "parts": [bot_response_text]})
     except Exception as e:
         await ctx.reply(f"Ошибка при генерации ответа: {e}")
         return
@@ -672,12 +1122,8 @@ async def speak(ctx, *, text: str):
     elif ctx.voice_client.channel != channel:
         await ctx.voice_client.move_to(channel)
 
-    if ctx.voice_client.is_playing():
-        ctx.voice_client.stop()
-        await asyncio.sleep(0.5)
-
-    ctx.voice_client.play(discord.FFmpegPCMAudio(executable=ffmpeg, source=file_path),
-                          after=lambda e: os.remove(file_path))
+    start_speech(ctx.voice_client, file_path, lambda: tts_audio_cache.release(file_path))
 
 
-bot.run(TOKEN)
\ No newline at end of file
+if __name__ == "__main__":
+    bot.run(TOKEN)
@@ -0,0 +1,175 @@
+import asyncio
+import json
+import os
+
+import google.generativeai as genai
+
+from chat_store import chat_store
+from gemini_client import gemini_pool
+
+# --- Окно контекста для start_chat ---
+# В модель уходят только последние реплики, которые помещаются в бюджет токенов.
+# Более старые реплики сворачиваются в краткое содержание, которое пересчитывается
+# инкрементально (старое содержание + только что выпавшие реплики) в фоне. Граница
+# свернутого - номер строки хранилища ("id" реплики), так что повторы вроде "ок" ее не сбивают.
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "8000"))
+SUMMARY_TOKEN_BUDGET = int(os.getenv("SUMMARY_TOKEN_BUDGET", "4000"))  # сколько текста реплик отдаем на один запрос
+# Сворачиваем, только когда выпавших и еще не свернутых реплик набралось хотя бы на столько токенов:
+# иначе каждая новая реплика в длинной истории запускала бы отдельный запрос к Gemini
+FOLD_MIN_TOKENS = int(os.getenv("FOLD_MIN_TOKENS", "1000"))
+CHARS_PER_TOKEN = 3  # грубая оценка: для русского текста токен в среднем короче, чем для английского
+
+SUMMARY_PROMPT = (
+    "Ниже краткое содержание предыдущего разговора и новые реплики, которые к нему нужно добавить. "
+    "Составь обновленное краткое содержание всего разговора (не больше 10 предложений), "
+    "сохрани имена, факты и договоренности. Ответь только самим содержанием.\n\n"
+    "Краткое содержание:\n{summary}\n\nНовые реплики:\n{turns}"
+)
+SUMMARY_PREFIX = "Краткое содержание более раннего разговора:\n"
+SUMMARY_ACK = "Понял, учту."
+
+
+def turn_text(turn):
+    """Текст реплики в любом из форматов parts: ["текст"] или [{"text": "текст"}]."""
+    texts = []
+    for part in turn.get("parts", []):
+        if isinstance(part, str):
+            texts.append(part)
+        elif isinstance(part, dict):
+            texts.append(part.get("text", ""))
+    return "".join(texts)
+
+
+def estimate_tokens(text):
+    """Дешевая локальная оценка количества токенов без обращения к API."""
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+def _for_model(turns):
+    """Реплики без служебного "id" - Gemini не принимает лишние поля."""
+    return [{name: value for name, value in turn.items() if name != "id"} if "id" in turn else turn
+            for turn in turns]
+
+
+def _make_turn(role, text, like):
+    """Создает реплику в том же формате parts, что и у реплики `like`."""
+    parts = like.get("parts") if like else None
+    if parts and isinstance(parts[0], dict):
+        return {"role": role, "parts": [{"text": text}]}
+    return {"role": role, "parts": [text]}
+
+
+class ContextBuilder:
+    """Собирает историю для start_chat в пределах бюджета токенов с кешируемым кратким содержанием."""
+
+    def __init__(self, scope, model_name, token_budget=CONTEXT_TOKEN_BUDGET):
+        self.scope = scope
+        self.model_name = model_name
+        self.token_budget = token_budget
+        # key -> {"summary": str, "last": id последней свернутой реплики}
+        self._summaries = _load_summaries(scope)
+        self._tasks = {}
+
+    def select_start(self, history, budget):
+        """Индекс первой реплики самого длинного свежего хвоста истории, влезающего в бюджет."""
+        used = 0
+        start = len(history)
+        for i in range(len(history) - 1, -1, -1):
+            used += estimate_tokens(turn_text(history[i]))
+            if used > budget:
+                break
+            start = i
+        # История для Gemini должна начинаться с реплики пользователя
+        while start < len(history) and history[start].get("role") != "user":
+            start += 1
+        return start
+
+    def build(self, key, history):
+        """Возвращает историю для start_chat: краткое содержание + свежие реплики."""
+        history = list(history)
+        cached = self._summaries.get(key)
+        summary = cached["summary"] if cached else ""
+        budget = self.token_budget - estimate_tokens(summary) if summary else self.token_budget
+        start = self.select_start(history, budget)
+        if start == 0:
+            return _for_model(history)
+
+        self._schedule_fold(key, history[:start])
+        if not summary:
+            return _for_model(history[start:])
+        like = history[start] if start < len(history) else history[-1]
+        return [_make_turn("user", SUMMARY_PREFIX + summary, like),
+                _make_turn("model", SUMMARY_ACK, like)] + _for_model(history[start:])
+
+    def reset(self, key):
+        """Забывает краткое содержание (например, после очистки истории)."""
+        self._summaries.pop(key, None)
+        task = self._tasks.pop(key, None)
+        if task:
+            task.cancel()
+        chat_store.set_setting(self.scope, key, "summary", None)
+
+    def _schedule_fold(self, key, dropped):
+        """Запускает в фоне сворачивание реплик, которые еще не вошли в краткое содержание."""
+        if key in self._tasks:
+            return
+        cached = self._summaries.get(key)
+        last = cached.get("last") if cached else None
+        if not isinstance(last, int):
+            last = 0  # содержание без границы (старый формат) - сворачиваем все выпавшее заново
+        new_turns = []
+        for turn in dropped:
+            if turn.get("id") is None:
+                break  # реплика еще не записана в хранилище - свернем ее в следующий раз
+            if turn["id"] > last:
+                new_turns.append(turn)
+        if sum(estimate_tokens(turn_text(turn)) for turn in new_turns) < FOLD_MIN_TOKENS:
+            return
+        task = asyncio.get_running_loop().create_task(self._fold(key, cached, new_turns))
+        self._tasks[key] = task
+        task.add_done_callback(lambda t: self._tasks.pop(key) if self._tasks.get(key) is t else None)
+
+    async def _fold(self, key, cached, new_turns):
+        """Сворачивает реплики от старых к новым порциями по SUMMARY_TOKEN_BUDGET.
+
+        Граница сдвигается после каждой порции, так что при ошибке следующее сворачивание
+        продолжит с места остановки, и ни одна реплика не пропадает.
+        """
+        summary = cached["summary"] if cached else ""
+        model = genai.GenerativeModel(self.model_name)
+        while new_turns:
+            lines = []
+            used = 0
+            for turn in new_turns:
+                line = f"{turn.get('role')}: {turn_text(turn)}"
+                if lines and used + estimate_tokens(line) > SUMMARY_TOKEN_BUDGET:
+                    break
+                # Реплика длиннее бюджета целиком не влезет - берем ее начало
+                lines.append(line[:SUMMARY_TOKEN_BUDGET * CHARS_PER_TOKEN])
+                used += estimate_tokens(line)
+            chunk, new_turns = new_turns[:len(lines)], new_turns[len(lines):]
+            prompt = SUMMARY_PROMPT.format(summary=summary or "(пусто)", turns="\n".join(lines))
+            try:
+                # Без guild_id: фоновое сворачивание не должно занимать слот сервера и задерживать ответы
+                response = await gemini_pool.generate_content(model, prompt)
+                summary = response.text.strip()
+            except Exception as e:
+                print(f"Ошибка при обновлении краткого содержания ({self.scope}, {key}): {e}")
+                return
+            if not summary:
+                return
+            entry = {"summary": summary, "last": chunk[-1]["id"]}
+            self._summaries[key] = entry
+            chat_store.set_setting(self.scope, key, "summary", json.dumps(entry, ensure_ascii=False))
+
+
+def _load_summaries(scope):
+    """Загружает сохраненные краткие содержания области из хранилища."""
+    summaries = {}
+    for key, settings in chat_store.load_settings(scope).items():
+        if settings.get("summary"):
+            try:
+                summaries[key] = json.loads(settings["summary"])
+            except (json.JSONDecodeError, TypeError):
+                pass
+    return summaries
@@ -0,0 +1,142 @@
+import asyncio
+import os
+import time
+from collections import deque
+
+from metrics import queue_depth, queue_wait_seconds
+
+# --- Планировщик загрузок ---
+# Заменяет общий download_lock: загрузки разных серверов идут параллельно
+# на ограниченном числе воркеров, а серверы обслуживаются по кругу,
+# чтобы один сервер с длинной очередью не задерживал остальных.
+DOWNLOAD_WORKERS = int(os.getenv("DOWNLOAD_WORKERS", "3"))
+DOWNLOAD_MAX_PER_GUILD = int(os.getenv("DOWNLOAD_MAX_PER_GUILD", "1"))
+WAIT_SAMPLES = 20  # сколько последних ожиданий хранить для средней оценки
+
+
+# Пользовательское исключение для прерывания скачивания
+class DownloadCancelled(Exception):
+    pass
+
+
+class _Job:
+    __slots__ = ("guild_id", "func", "args", "future", "enqueued_at", "cancellation_event")
+
+    def __init__(self, guild_id, func, args, future, cancellation_event):
+        self.guild_id = guild_id
+        self.func = func
+        self.args = args
+        self.future = future
+        self.enqueued_at = time.monotonic()
+        self.cancellation_event = cancellation_event
+
+
+class DownloadScheduler:
+    """Выполняет блокирующие загрузки в потоках с общим лимитом воркеров и справедливой очередью серверов."""
+
+    def __init__(self, workers=DOWNLOAD_WORKERS, max_per_guild=DOWNLOAD_MAX_PER_GUILD):
+        self.workers = workers
+        self.max_per_guild = max_per_guild
+        self._pending = {}  # guild_id -> deque заданий
+        self._order = deque()  # очередь серверов для обхода по кругу
+        self._in_flight = {}  # guild_id -> количество выполняющихся заданий
+        self._waits = {}  # guild_id -> последние времена ожидания в очереди
+        self._condition = None
+        self._worker_tasks = []
+
+    def _ensure_workers(self):
+        if self._worker_tasks:
+            return
+        self._condition = asyncio.Condition()
+        self._worker_tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def run(self, guild_id, func, *args, cancellation_event=None):
+        """Ставит func(*args) в очередь сервера и ждет результата.
+
+        Если cancellation_event установлен до начала выполнения, задание отменяется
+        с DownloadCancelled; во время выполнения func должна следить за ним сама.
+        """
+        self._ensure_workers()
+        job = _Job(guild_id, func, args, asyncio.get_running_loop().create_future(), cancellation_event)
+        async with self._condition:
+            if guild_id not in self._pending:
+                self._pending[guild_id] = deque()
+                self._order.append(guild_id)
+            self._pending[guild_id].append(job)
+            self._condition.notify()
+        return await job.future
+
+    def cancel_guild(self, guild_id):
+        """Отменяет все еще не начатые задания сервера."""
+        jobs = self._pending.pop(guild_id, None)
+        if guild_id in self._order:
+            self._order.remove(guild_id)
+        for job in jobs or ():
+            if not job.future.done():
+                job.future.set_exception(DownloadCancelled("Скачивание отменено, так как бот покинул канал."))
+
+    def _next_job(self):
+        """Следующее задание по кругу среди серверов, не превысивших лимит одновременных загрузок."""
+        for _ in range(len(self._order)):
+            guild_id = self._order[0]
+            self._order.rotate(-1)
+            if self._in_flight.get(guild_id, 0) >= self.max_per_guild:
+                continue
+            jobs = self._pending[guild_id]
+            job = jobs.popleft()
+            if not jobs:
+                del self._pending[guild_id]
+                self._order.remove(guild_id)
+            return job
+        return None
+
+    async def _worker(self):
+        while True:
+            async with self._condition:
+                job = self._next_job()
+                while job is None:
+                    await self._condition.wait()
+                    job = self._next_job()
+                self._in_flight[job.guild_id] = self._in_flight.get(job.guild_id, 0) + 1
+
+            waits = self._waits.setdefault(job.guild_id, deque(maxlen=WAIT_SAMPLES))
+            waits.append(time.monotonic() - job.enqueued_at)
+            queue_wait_seconds.observe(waits[-1], queue="downloads")
+            try:
+                if job.future.done():
+                    continue
+                if job.cancellation_event is not None and job.cancellation_event.is_set():
+                    job.future.set_exception(DownloadCancelled("Скачивание отменено, так как бот покинул канал."))
+                    continue
+                try:
+                    result = await asyncio.to_thread(job.func, *job.args)
+                except Exception as e:
+                    if not job.future.done():
+                        job.future.set_exception(e)
+                else:
+                    if not job.future.done():
+                        job.future.set_result(result)
+            finally:
+                async with self._condition:
+                    self._in_flight[job.guild_id] -= 1
+                    if not self._in_flight[job.guild_id]:
+                        del self._in_flight[job.guild_id]
+                    # Освободился слот сервера - его задания снова можно брать
+                    self._condition.notify_all()
+
+    def queued(self):
+        """Сколько заданий ждет во всех очередях."""
+        return sum(len(jobs) for jobs in self._pending.values())
+
+    def stats(self, guild_id):
+        """Глубина очереди, число выполняющихся заданий и среднее ожидание (с) для сервера."""
+        waits = self._waits.get(guild_id)
+        return {
+            "queued": len(self._pending.get(guild_id, ())),
+            "in_flight": self._in_flight.get(guild_id, 0),
+            "avg_wait": sum(waits) / len(waits) if waits else 0.0,
+        }
+
+
+download_scheduler = DownloadScheduler()
+queue_depth.set_function(download_scheduler.queued, queue="downloads")
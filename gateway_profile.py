@@ -0,0 +1,70 @@
+import os
+import time
+from collections import Counter, deque
+
+import discord
+from discord.ext import commands
+
+# --- Намерения, кеш участников и шардирование ---
+# Чайнику нужны сообщения, их текст и голосовые состояния. Профиль "lean" не подписывается
+# на presences, members и typing: Discord не шлет эти события, а кеш участников не заполняется
+# всеми членами каждого сервера. "full" - прежнее поведение (Intents.all, загрузка участников при старте).
+CHAYNIK_INTENTS = os.getenv("CHAYNIK_INTENTS", "lean")
+# "" - один шард, "auto" - AutoShardedBot с рекомендованным Discord числом шардов, число - явное количество
+CHAYNIK_SHARDS = os.getenv("CHAYNIK_SHARDS", "")
+
+
+def build_intents(profile=CHAYNIK_INTENTS):
+    if profile == "full":
+        return discord.Intents.all()
+    intents = discord.Intents.default()  # без presences и members
+    intents.message_content = True
+    intents.typing = False
+    return intents
+
+
+def bot_options(profile=CHAYNIK_INTENTS):
+    intents = build_intents(profile)
+    return {
+        "intents": intents,
+        # Без intents.members кешируются только участники в голосовых каналах
+        "member_cache_flags": discord.MemberCacheFlags.from_intents(intents),
+        "chunk_guilds_at_startup": profile == "full",
+    }
+
+
+def make_bot(command_prefix, profile=CHAYNIK_INTENTS, shards=CHAYNIK_SHARDS):
+    options = bot_options(profile)
+    if not shards:
+        return commands.Bot(command_prefix=command_prefix, **options)
+    if shards != "auto":
+        options["shard_count"] = int(shards)
+    return commands.AutoShardedBot(command_prefix=command_prefix, **options)
+
+
+class GatewayStats:
+    """Счетчик событий шлюза: всего по типам и частота за последнюю минуту."""
+
+    def __init__(self, window=60):
+        self.window = window
+        self.totals = Counter()
+        self._recent = deque()  # (время, тип события)
+        self.started = time.monotonic()
+
+    def record(self, event_type):
+        now = time.monotonic()
+        self.totals[event_type] += 1
+        self._recent.append((now, event_type))
+        self._prune(now)
+
+    def _prune(self, now):
+        while self._recent and self._recent[0][0] < now - self.window:
+            self._recent.popleft()
+
+    def rate(self):
+        """События в секунду за последнее окно: (всего, {тип: частота})."""
+        now = time.monotonic()
+        self._prune(now)
+        span = min(self.window, max(now - self.started, 1))
+        by_type = Counter(event_type for _, event_type in self._recent)
+        return len(self._recent) / span, {event_type: count / span for event_type, count in by_type.items()}
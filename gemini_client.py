@@ -0,0 +1,95 @@
+import asyncio
+import os
+import time
+from contextlib import asynccontextmanager
+
+from metrics import external_call_seconds, queue_depth, queue_wait_seconds
+
+# --- Ограничения на одновременные запросы к Gemini ---
+# Общий лимит на весь процесс и отдельный лимит на каждый сервер,
+# чтобы один активный сервер не занимал все слоты.
+GEMINI_MAX_CONCURRENCY = int(os.getenv("GEMINI_MAX_CONCURRENCY", "8"))
+GEMINI_MAX_PER_GUILD = int(os.getenv("GEMINI_MAX_PER_GUILD", "2"))
+
+
+def response_text(response):
+    """Текст ответа (или части потокового ответа) без исключения, если частей нет."""
+    return "".join(part.text for part in response.parts if hasattr(part, "text"))
+
+
+class GeminiPool:
+    """Общий асинхронный слой для всех запросов к Gemini с ограничением параллелизма."""
+
+    def __init__(self, max_concurrency=GEMINI_MAX_CONCURRENCY, max_per_guild=GEMINI_MAX_PER_GUILD):
+        self.max_concurrency = max_concurrency
+        self.max_per_guild = max_per_guild
+        self._global = asyncio.Semaphore(max_concurrency)
+        # guild_id -> [семафор, количество запросов, которые его используют]
+        self._guilds = {}
+
+    @asynccontextmanager
+    async def slot(self, guild_id=None):
+        """Занимает слот сервера (если он есть) и общий слот на время запроса."""
+        requested = time.perf_counter()
+        if guild_id is None:
+            async with self._global:
+                queue_wait_seconds.observe(time.perf_counter() - requested, queue="gemini")
+                yield
+            return
+
+        entry = self._guilds.get(guild_id)
+        if entry is None:
+            entry = self._guilds[guild_id] = [asyncio.Semaphore(self.max_per_guild), 0]
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                async with self._global:
+                    queue_wait_seconds.observe(time.perf_counter() - requested, queue="gemini")
+                    yield
+        finally:
+            entry[1] -= 1
+            # Не храним семафоры серверов, у которых нет активных запросов
+            if entry[1] == 0:
+                self._guilds.pop(guild_id, None)
+
+    async def send_message(self, chat, content, guild_id=None, **kwargs):
+        """Асинхронный аналог chat.send_message(...) с учетом лимитов."""
+        async with self.slot(guild_id):
+            with external_call_seconds.time(service="gemini", op="send_message"):
+                return await chat.send_message_async(content, **kwargs)
+
+    async def generate_content(self, model, contents, guild_id=None, **kwargs):
+        """Асинхронный аналог model.generate_content(...) с учетом лимитов."""
+        async with self.slot(guild_id):
+            with external_call_seconds.time(service="gemini", op="generate_content"):
+                return await model.generate_content_async(contents, **kwargs)
+
+    async def stream_message(self, chat, content, guild_id=None, **kwargs):
+        """Асинхронный генератор частей ответа chat.send_message(..., stream=True).
+
+        Слот занят, пока ответ не дочитан до конца.
+        """
+        async with self.slot(guild_id):
+            started = time.perf_counter()
+            with external_call_seconds.time(service="gemini", op="stream"):
+                response = await chat.send_message_async(content, stream=True, **kwargs)
+                first = True
+                async for chunk in response:
+                    if first:
+                        # Время до первой части - то, что пользователь ждет до начала ответа
+                        external_call_seconds.observe(time.perf_counter() - started, service="gemini",
+                                                      op="stream_first_chunk", outcome="ok")
+                        first = False
+                    yield chunk
+
+    def stats(self):
+        """Текущая загрузка пула: занятые общие слоты и активные запросы по серверам."""
+        return {
+            "in_flight": self.max_concurrency - self._global._value,
+            "guilds": {guild_id: entry[1] for guild_id, entry in self._guilds.items()},
+        }
+
+
+# Один пул на процесс: его используют и чайник, и миничайник
+gemini_pool = GeminiPool()
+queue_depth.set_function(lambda: gemini_pool.stats()["in_flight"], queue="gemini_in_flight")
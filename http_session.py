@@ -0,0 +1,47 @@
+import os
+
+import aiohttp
+
+# --- Общий HTTP-клиент ---
+# Одна долгоживущая сессия aiohttp с пулом соединений на весь процесс
+# вместо новой сессии (и нового TLS-рукопожатия) на каждый запрос.
+HTTP_POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", "32"))
+HTTP_TIMEOUT = aiohttp.ClientTimeout(total=120, connect=10, sock_read=30)
+
+_session = None
+
+
+def get_session():
+    """Возвращает общую сессию, создавая ее при первом вызове (нужен запущенный event loop)."""
+    global _session
+    if _session is None or _session.closed:
+        _session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=HTTP_POOL_SIZE, ttl_dns_cache=300),
+            timeout=HTTP_TIMEOUT,
+        )
+    return _session
+
+
+async def close_session():
+    global _session
+    if _session is not None and not _session.closed:
+        await _session.close()
+    _session = None
+
+
+class ResponseTooLarge(Exception):
+    pass
+
+
+async def iter_response(url, max_bytes, chunk_size=64 * 1024):
+    """Асинхронно отдает тело ответа кусками, прерываясь, если оно больше max_bytes."""
+    async with get_session().get(url) as response:
+        response.raise_for_status()
+        if response.content_length and response.content_length > max_bytes:
+            raise ResponseTooLarge(f"Файл больше {max_bytes // (1024 * 1024)} МБ.")
+        received = 0
+        async for chunk in response.content.iter_chunked(chunk_size):
+            received += len(chunk)
+            if received > max_bytes:
+                raise ResponseTooLarge(f"Файл больше {max_bytes // (1024 * 1024)} МБ.")
+            yield chunk
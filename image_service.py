@@ -0,0 +1,110 @@
+import asyncio
+import os
+from collections import deque
+
+from http_session import iter_response
+from metrics import external_call_seconds
+from single_flight import SingleFlight
+from ttl_cache import TTLCache
+
+# --- Генерация изображений ---
+# Запросы идут через ограниченную очередь с фиксированным числом обработчиков:
+# каждый узнает свое место в очереди, одинаковые одновременные запросы ждут одну
+# генерацию, а готовые картинки недолго хранятся в кеше по (модель, запрос).
+IMAGE_MODEL = "flux"
+IMAGE_WORKERS = int(os.getenv("IMAGE_WORKERS", "2"))
+IMAGE_QUEUE_SIZE = int(os.getenv("IMAGE_QUEUE_SIZE", "20"))
+IMAGE_CACHE_TTL = int(os.getenv("IMAGE_CACHE_TTL", "3600"))
+IMAGE_MAX_MB = 25
+
+
+class ImageQueueFull(Exception):
+    pass
+
+
+class ImageService:
+    """Очередь генерации изображений через g4f с дедупликацией и кешем результатов."""
+
+    def __init__(self, client, workers=IMAGE_WORKERS, max_queue=IMAGE_QUEUE_SIZE):
+        self._client = client
+        self._workers_count = workers
+        self._max_queue = max_queue
+        self._waiting = deque()  # (ключ, future результата) задач, которые еще не начали выполняться
+        self._jobs = SingleFlight()  # ждущие и выполняющиеся задачи
+        self._busy = 0  # обработчики, которые сейчас генерируют
+        self._ready = asyncio.Semaphore(0)
+        self._workers = []
+        self._cache = TTLCache(maxsize=64, ttl=IMAGE_CACHE_TTL)
+
+    @staticmethod
+    def _key(prompt, model):
+        return model, " ".join(prompt.split())
+
+    def submit(self, prompt, model=IMAGE_MODEL):
+        """Ставит запрос в очередь и возвращает (awaitable с байтами картинки, место в очереди).
+
+        Место 0 означает, что результат уже готов или генерация начнется сразу (есть свободный обработчик).
+        """
+        key = self._key(prompt, model)
+        cached = self._cache.get(key)
+        if cached is not None:
+            future = asyncio.get_running_loop().create_future()
+            future.set_result(cached)
+            return future, 0
+
+        if key not in self._jobs and len(self._waiting) >= self._max_queue:
+            raise ImageQueueFull(f"В очереди уже {len(self._waiting)} запросов, попробуй позже.")
+        job = self._jobs.run(key, lambda: self._enqueue(key))
+        return job, self._position(key)
+
+    def _enqueue(self, key):
+        future = asyncio.get_running_loop().create_future()
+        self._waiting.append((key, future))
+        self._ensure_workers()
+        self._ready.release()
+        return future
+
+    def _position(self, key):
+        """Сколько запросов (включая этот) ждут, пока освободится занятый обработчик."""
+        keys = [waiting_key for waiting_key, _ in self._waiting]
+        if key not in keys:
+            return 0
+        # Задачи из начала очереди, которые заберут свободные обработчики, не ждут
+        return max(0, keys.index(key) - (self._workers_count - self._busy) + 1)
+
+    def _ensure_workers(self):
+        self._workers = [worker for worker in self._workers if not worker.done()]
+        while len(self._workers) < self._workers_count:
+            self._workers.append(asyncio.create_task(self._worker()))
+
+    async def _worker(self):
+        while True:
+            await self._ready.acquire()
+            key, future = self._waiting.popleft()
+            self._busy += 1
+            try:
+                image_data = await self._generate(*key)
+            except Exception as e:
+                if not future.done():
+                    future.set_exception(e)
+                    future.exception()  # ошибку получат ожидающие; без них не пишем "never retrieved"
+            else:
+                self._cache.set(key, image_data)
+                if not future.done():
+                    future.set_result(image_data)
+            finally:
+                self._busy -= 1
+
+    async def _generate(self, model, prompt):
+        with external_call_seconds.time(service="g4f", op="image_generate"):
+            response = await asyncio.to_thread(self._client.images.generate, model=model, prompt=prompt)
+        image_url = response.data[0].url
+        chunks = [chunk async for chunk in iter_response(image_url, IMAGE_MAX_MB * 1024 * 1024)]
+        return b"".join(chunks)
+
+    def stats(self):
+        return {
+            "queued": len(self._waiting),
+            "in_flight": self._busy,
+            **{f"cache_{name}": value for name, value in self._cache.stats().items()},
+        }
@@ -0,0 +1,106 @@
+import os
+import re
+from io import BytesIO
+
+import discord
+
+from outbound import outbox
+from streaming_reply import split_point
+
+# --- Доставка длинных ответов ---
+# Ответ режется по границам абзацев и строк, блоки кода не разрываются: если страница
+# кончается внутри ```, блок закрывается и открывается заново на следующей. Длинный ответ
+# уходит одним сообщением с кнопками листания (страницы переключаются правкой через
+# interaction, без новых сообщений), а очень длинный - одним сообщением с .md-файлом.
+LONG_REPLY_MODE = os.getenv("LONG_REPLY_MODE", "pages")  # pages | file
+PAGE_LIMIT = 1900
+MAX_PAGES = 10  # больше страниц листать неудобно - отправляем файлом
+PREVIEW_LIMIT = 1500
+PAGE_VIEW_TIMEOUT = 15 * 60
+
+_FENCE = re.compile(r"^```(\S*)", re.MULTILINE)
+
+
+def _open_fence(text):
+    """Язык незакрытого блока кода в конце текста ("" для блока без языка) или None."""
+    language = None
+    for match in _FENCE.finditer(text):
+        language = match.group(1) if language is None else None
+    return language
+
+
+def split_markdown(text, limit=PAGE_LIMIT):
+    """Делит текст на страницы не длиннее limit, не разрывая блоки кода."""
+    pages = []
+    reopen = ""  # открытие блока кода, перенесенного с прошлой страницы
+    text = text.strip()
+    while text:
+        body = reopen + text
+        if len(body) <= limit:
+            pages.append(body)
+            break
+        # Запас под закрывающий "\n```"
+        cut = max(split_point(body, limit - 4), len(reopen) + 1)
+        page, text = body[:cut].rstrip(), body[cut:].lstrip("\n")
+        language = _open_fence(page)
+        if language is not None:
+            page += "\n```"
+            reopen = f"```{language}\n"
+        else:
+            reopen = ""
+        pages.append(page)
+    return pages
+
+
+class PageView(discord.ui.View):
+    """Кнопки листания страниц длинного ответа."""
+
+    def __init__(self, pages, timeout=PAGE_VIEW_TIMEOUT):
+        super().__init__(timeout=timeout)
+        self.pages = pages
+        self.index = 0
+        self.message = None
+        self._sync()
+
+    def _sync(self):
+        self.previous.disabled = self.index == 0
+        self.next.disabled = self.index == len(self.pages) - 1
+        self.counter.label = f"{self.index + 1}/{len(self.pages)}"
+
+    async def _show(self, interaction, index):
+        self.index = index
+        self._sync()
+        await interaction.response.edit_message(content=self.pages[self.index], view=self)
+
+    @discord.ui.button(label="◀", style=discord.ButtonStyle.secondary)
+    async def previous(self, interaction: discord.Interaction, button: discord.ui.Button):
+        await self._show(interaction, self.index - 1)
+
+    @discord.ui.button(label="1/1", style=discord.ButtonStyle.secondary, disabled=True)
+    async def counter(self, interaction: discord.Interaction, button: discord.ui.Button):
+        pass
+
+    @discord.ui.button(label="▶", style=discord.ButtonStyle.secondary)
+    async def next(self, interaction: discord.Interaction, button: discord.ui.Button):
+        await self._show(interaction, self.index + 1)
+
+    async def on_timeout(self):
+        if self.message is not None:
+            try:
+                await self.message.edit(view=None)
+            except discord.HTTPException:
+                pass
+
+
+async def send_long(ctx, text):
+    """Отвечает на сообщение ctx текстом любой длины за одно сообщение."""
+    pages = split_markdown(text)
+    if len(pages) <= 1:
+        return await outbox.reply(ctx, pages[0] if pages else text)
+    if LONG_REPLY_MODE == "file" or len(pages) > MAX_PAGES:
+        preview = split_markdown(text, PREVIEW_LIMIT)[0]
+        file = discord.File(BytesIO(text.encode("utf-8")), filename="answer.md")
+        return await outbox.reply(ctx, f"{preview}\n\n📎 Полный ответ во вложении.", file=file)
+    view = PageView(pages)
+    view.message = await outbox.reply(ctx, pages[0], view=view)
+    return view.message
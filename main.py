@@ -1,27 +1,79 @@
-import subprocess
-import sys
+import asyncio
+import logging
+import random
 
-processes = []
+import discord
 
-try:
-    # используем тот же Python, что и у main.py
-    python = sys.executable
+import minichaynik
+import chaynik
+from chat_store import chat_store
+from http_session import close_session
 
-    p1 = subprocess.Popen([python, "minichaynik.py"])
-    processes.append(p1)
-    print("✅ Миничайник запущен")
+# Оба бота работают в одном процессе и на одном event loop: общие пулы соединений,
+# клиент Gemini и база. Каждый бот перезапускается отдельно с нарастающей задержкой.
+RESTART_DELAY_MIN = 5  # секунд
+RESTART_DELAY_MAX = 300
+STABLE_UPTIME = 600  # если бот проработал дольше, задержка перезапуска сбрасывается
 
-    p2 = subprocess.Popen([python, "chaynik.py"])
-    processes.append(p2)
-    print("✅ Чайник запущен")
 
+async def supervise(name, bot, token, reset=None):
+    """Запускает бота и перезапускает его после падения; reset() сбрасывает состояние бота перед перезапуском."""
+    loop = asyncio.get_running_loop()
+    delay = RESTART_DELAY_MIN
+    while True:
+        started = loop.time()
+        try:
+            await bot.start(token)
+            print(f"⏹ {name} остановлен")
+            return
+        except discord.LoginFailure as e:
+            # С неверным токеном перезапуск не поможет
+            logging.error(f"{name}: ошибка входа, бот больше не будет перезапускаться: {e}")
+            return
+        except Exception as e:
+            logging.error(f"{name} упал: {e}", exc_info=True)
+        finally:
+            if not bot.is_closed():
+                await bot.close()
+
+        if reset:
+            reset()
+        if loop.time() - started > STABLE_UPTIME:
+            delay = RESTART_DELAY_MIN
+        wait = delay * random.uniform(0.8, 1.2)
+        print(f"🔄 {name} будет перезапущен через {wait:.0f} с")
+        await asyncio.sleep(wait)
+        delay = min(delay * 2, RESTART_DELAY_MAX)
+        bot.clear()
+
+
+async def main():
+    bots = [
+        ("Миничайник", minichaynik.bot, minichaynik.TOKEN, None),
+        ("Чайник", chaynik.bot, chaynik.TOKEN, chaynik.reset_player_state),
+    ]
+    tasks = []
+    for name, bot, token, reset in bots:
+        if not token:
+            logging.error(f"{name} не запущен: нет токена")
+            continue
+        tasks.append(asyncio.create_task(supervise(name, bot, token, reset)))
+        print(f"✅ {name} запущен")
     print("\nОба бота работают. Нажми Ctrl+C для остановки.\n")
 
-    for p in processes:
-        p.wait()
+    try:
+        await asyncio.gather(*tasks)
+    finally:
+        for _, bot, _, _ in bots:
+            if not bot.is_closed():
+                await bot.close()
+        await close_session()
+        chat_store.close()
+        print("Все боты остановлены.")
+
 
-except KeyboardInterrupt:
-    print("\n⏹ Остановка ботов...")
-    for p in processes:
-        p.terminate()
-    print("Все процессы остановлены.")
+if __name__ == "__main__":
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        print("\n⏹ Остановка ботов...")
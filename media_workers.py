@@ -0,0 +1,136 @@
+import asyncio
+import json
+import os
+import time
+
+from audio_sources import FFPROBE, OPUS_BITRATE
+from metrics import external_call_seconds, queue_wait_seconds
+
+# --- Пул процессов FFmpeg ---
+# Обработка вложений идет через asyncio-подпроцессы и не блокирует event loop.
+# Одновременно работает не больше MEDIA_WORKERS процессов, каждый ограничен по времени
+# и убивается при отмене команды.
+MEDIA_WORKERS = int(os.getenv("MEDIA_WORKERS", "2"))
+FFMPEG_TIMEOUT = int(os.getenv("FFMPEG_TIMEOUT", "300"))  # секунд на один процесс
+
+# Кодеки, которые можно проигрывать как есть: дорожку копируем в подходящий контейнер без перекодирования
+COPY_CONTAINERS = {
+    "opus": ".opus",
+    "vorbis": ".ogg",
+    "aac": ".m4a",
+    "mp3": ".mp3",
+    "flac": ".flac",
+}
+
+
+class MediaProcessError(Exception):
+    pass
+
+
+class MediaWorkerPool:
+    """Ограниченный пул подпроцессов FFmpeg/ffprobe с таймаутами и отменой."""
+
+    def __init__(self, executable, max_processes=MEDIA_WORKERS, timeout=FFMPEG_TIMEOUT):
+        self.executable = executable
+        self.timeout = timeout
+        self._semaphore = asyncio.Semaphore(max_processes)
+
+    async def run(self, *args, executable=None, timeout=None, stdin=None):
+        """Запускает процесс и возвращает (код возврата, stdout, stderr).
+
+        stdin - необязательный асинхронный итератор байтов, которые пишутся процессу на вход по мере поступления.
+        """
+        requested = time.perf_counter()
+        async with self._semaphore:
+            queue_wait_seconds.observe(time.perf_counter() - requested, queue="ffmpeg")
+            op = "probe" if executable == FFPROBE else "transcode" if stdin is None else "ingest"
+            with external_call_seconds.time(service="ffmpeg", op=op):
+                return await self._run(executable, args, timeout, stdin)
+
+    async def _run(self, executable, args, timeout, stdin):
+        process = await asyncio.create_subprocess_exec(
+            executable or self.executable, *args,
+            stdin=asyncio.subprocess.PIPE if stdin is not None else asyncio.subprocess.DEVNULL,
+            stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE
+        )
+        try:
+            if stdin is None:
+                stdout, stderr = await asyncio.wait_for(process.communicate(), timeout or self.timeout)
+            else:
+                _, stdout, stderr = await asyncio.wait_for(
+                    asyncio.gather(self._feed(process, stdin), process.stdout.read(), process.stderr.read()),
+                    timeout or self.timeout
+                )
+                await process.wait()
+        except BaseException:
+            # Не оставляем висящий FFmpeg ни при таймауте, ни при отмене, ни при ошибке источника
+            if process.returncode is None:
+                process.kill()
+            await process.wait()
+            raise
+        return process.returncode, stdout, stderr.decode(errors="ignore")
+
+    @staticmethod
+    async def _feed(process, chunks):
+        try:
+            async for chunk in chunks:
+                process.stdin.write(chunk)
+                await process.stdin.drain()
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # FFmpeg завершился раньше, чем кончился вход; причину покажет его stderr
+        finally:
+            process.stdin.close()
+
+    async def probe_audio_codec(self, path):
+        """Кодек первой аудиодорожки файла или None, если дорожки нет."""
+        returncode, stdout, _ = await self.run(
+            "-v", "quiet", "-print_format", "json", "-show_streams", "-select_streams", "a:0", path,
+            executable=FFPROBE, timeout=30
+        )
+        if returncode != 0:
+            return None
+        streams = json.loads(stdout or b"{}").get("streams") or [{}]
+        return streams[0].get("codec_name")
+
+    async def extract_audio(self, src_path, dst_base):
+        """Извлекает аудиодорожку в dst_base + расширение и возвращает путь.
+
+        Если кодек дорожки уже проигрываемый, она копируется (-c:a copy), иначе кодируется в Opus.
+        """
+        codec = await self.probe_audio_codec(src_path)
+        if codec is None:
+            raise MediaProcessError("В файле нет аудиодорожки.")
+
+        if codec in COPY_CONTAINERS:
+            dst_path = dst_base + COPY_CONTAINERS[codec]
+            returncode, _, stderr = await self.run(
+                "-y", "-loglevel", "error", "-i", src_path, "-vn", "-map", "0:a:0", "-c:a", "copy", dst_path
+            )
+            if returncode == 0:
+                return dst_path
+            print(f"Не удалось скопировать дорожку {codec}, перекодирую: {stderr}")
+            if os.path.exists(dst_path):
+                os.remove(dst_path)
+
+        dst_path = dst_base + ".opus"
+        returncode, _, stderr = await self.run(
+            "-y", "-loglevel", "error", "-i", src_path, "-vn", "-map", "0:a:0",
+            "-c:a", "libopus", "-b:a", f"{OPUS_BITRATE}k", "-ar", "48000", "-ac", "2", dst_path
+        )
+        if returncode != 0:
+            raise MediaProcessError(f"Пидор, ошибка при извлечении аудио! {stderr}")
+        return dst_path
+
+    async def extract_audio_stream(self, chunks, dst_path):
+        """Извлекает аудиодорожку из видео, которое подается кусками на stdin, без временного файла.
+
+        Кодек заранее не известен, поэтому дорожка копируется в Matroska (.mka), который принимает любой кодек;
+        проигрывается она потом через file_source - копированием, если это Opus.
+        """
+        returncode, _, stderr = await self.run(
+            "-y", "-loglevel", "error", "-i", "pipe:0", "-vn", "-map", "0:a:0", "-c:a", "copy", "-f", "matroska",
+            dst_path, stdin=chunks
+        )
+        if returncode != 0:
+            raise MediaProcessError(f"Пидор, ошибка при извлечении аудио! {stderr}")
+        return dst_path
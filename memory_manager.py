@@ -0,0 +1,63 @@
+import os
+import threading
+from collections import OrderedDict, deque
+
+# --- Память пользователей в RAM ---
+# Все реплики сразу пишутся в chat_store, а в памяти держатся истории только
+# недавно активных пользователей: история загружается при первом обращении, а при
+# превышении MEMORY_RESIDENT_USERS вытесняется самая давно использованная.
+MEMORY_RESIDENT_USERS = int(os.getenv("MEMORY_RESIDENT_USERS", "500"))
+
+
+class MemoryManager:
+    """LRU-набор историй пользователей поверх ChatStore."""
+
+    def __init__(self, store, scope, limit, max_resident=MEMORY_RESIDENT_USERS):
+        self.store = store
+        self.scope = scope
+        self.limit = limit
+        self.max_resident = max_resident
+        self._resident = OrderedDict()  # key -> deque реплик, от давно использованных к недавним
+        self._lock = threading.Lock()
+        self._loads = 0
+        self._evictions = 0
+        store.set_limit(scope, limit)
+
+    def history(self, key):
+        """История ключа; если ее нет в памяти, она загружается из хранилища."""
+        with self._lock:
+            history = self._resident.get(key)
+            if history is not None:
+                self._resident.move_to_end(key)
+                return history
+        history = deque(self.store.load(self.scope, key, self.limit), maxlen=self.limit)
+        with self._lock:
+            # Пока грузили, историю мог загрузить и дополнить другой поток - берем ее
+            history = self._resident.setdefault(key, history)
+            self._resident.move_to_end(key)
+            self._loads += 1
+            while len(self._resident) > self.max_resident:
+                self._resident.popitem(last=False)
+                self._evictions += 1
+        return history
+
+    def append(self, key, turn):
+        """Дописывает реплику в хранилище и, если история загружена, в память."""
+        with self._lock:
+            history = self._resident.get(key)
+            if history is not None:
+                history.append(turn)
+        self.store.append(self.scope, key, turn)
+
+    def clear(self, key):
+        with self._lock:
+            self._resident.pop(key, None)
+        self.store.clear(self.scope, key)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "resident": len(self._resident),
+                "loads": self._loads,
+                "evictions": self._evictions,
+            }
@@ -0,0 +1,225 @@
+import asyncio
+import bisect
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from aiohttp import web
+
+# --- Метрики ---
+# Счетчики, гистограммы и показатели в формате Prometheus на локальном HTTP-адресе
+# (http://127.0.0.1:METRICS_PORT/metrics). Нужны, чтобы видеть, какой этап
+# (Gemini, yt-dlp, FFmpeg, edge_tts, отправка в Discord) занимает время под нагрузкой.
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9108"))  # 0 - не запускать HTTP-адрес
+LOOP_LAG_INTERVAL = 0.5  # секунд между замерами задержки event loop
+
+# Границы корзин в секундах: от быстрых кешей до долгих скачиваний
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+_metrics = []
+_lock = threading.Lock()  # метрики обновляются и из потоков (yt-dlp, TTS)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels_text(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in labels) + "}"
+
+
+class Counter:
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help = help_text
+        self._values = {}
+        _metrics.append(self)
+
+    def inc(self, amount=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with _lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with _lock:
+            lines += [f"{self.name}{_labels_text(key)} {value}" for key, value in self._values.items()]
+        return lines
+
+
+class Gauge:
+    """Показатель, который считывается функцией в момент запроса метрик.
+
+    Функция возвращает число или {кортеж пар меток: число}.
+    """
+
+    def __init__(self, name, help_text, kind="gauge"):
+        self.name = name
+        self.help = help_text
+        self.kind = kind  # "counter" для накопительных значений, которые хранит сам объект (кеши)
+        self._functions = []
+        _metrics.append(self)
+
+    def set_function(self, function, **labels):
+        self._functions.append((tuple(sorted(labels.items())), function))
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for labels, function in self._functions:
+            try:
+                value = function()
+            except Exception as e:
+                print(f"Ошибка при чтении метрики {self.name}: {e}")
+                continue
+            if isinstance(value, dict):
+                for extra, item in value.items():
+                    lines.append(f"{self.name}{_labels_text(labels + tuple(extra))} {item}")
+            else:
+                lines.append(f"{self.name}{_labels_text(labels)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help_text, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.buckets = tuple(buckets)
+        self._values = {}  # метки -> [счетчики корзин..., сумма, количество]
+        _metrics.append(self)
+
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        index = bisect.bisect_left(self.buckets, value)
+        with _lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [0] * (len(self.buckets) + 2)
+            if index < len(self.buckets):
+                entry[index] += 1
+            entry[-2] += value
+            entry[-1] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """Замеряет время блока; при исключении добавляет метку outcome="error"."""
+        started = time.perf_counter()
+        outcome = "ok"
+        try:
+            yield
+        except BaseException:
+            outcome = "error"
+            raise
+        finally:
+            self.observe(time.perf_counter() - started, outcome=outcome, **labels)
+
+    def quantile(self, q, **labels):
+        """Оценка квантиля по корзинам (как histogram_quantile в Prometheus).
+
+        Учитываются все записи, у которых есть указанные метки. Возвращает (оценка, количество);
+        оценка None, если наблюдений нет.
+        """
+        wanted = set(labels.items())
+        counts = [0] * len(self.buckets)
+        total = 0
+        with _lock:
+            for key, entry in self._values.items():
+                if wanted <= set(key):
+                    for index in range(len(self.buckets)):
+                        counts[index] += entry[index]
+                    total += entry[-1]
+        if not total:
+            return None, 0
+        rank = q * total
+        cumulative, lower = 0, 0.0
+        for bound, count in zip(self.buckets, counts):
+            if count and cumulative + count >= rank:
+                return lower + (bound - lower) * (rank - cumulative) / count, total
+            cumulative += count
+            lower = bound
+        return self.buckets[-1], total  # выше последней корзины
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with _lock:
+            items = [(key, list(entry)) for key, entry in self._values.items()]
+        for key, entry in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, entry):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_labels_text(key + (('le', bound),))} {cumulative}")
+            lines.append(f"{self.name}_bucket{_labels_text(key + (('le', '+Inf'),))} {entry[-1]}")
+            lines.append(f"{self.name}_sum{_labels_text(key)} {entry[-2]}")
+            lines.append(f"{self.name}_count{_labels_text(key)} {entry[-1]}")
+        return lines
+
+
+def render():
+    lines = []
+    for metric in _metrics:
+        lines += metric.render()
+    return "\n".join(lines) + "\n"
+
+
+# --- Общие метрики ---
+external_call_seconds = Histogram(
+    "bot_external_call_seconds", "Время внешних вызовов: service=gemini|ytdlp|ffmpeg|tts|discord, op - операция"
+)
+stage_seconds = Histogram(
+    "bot_stage_seconds", "Время этапов команд: command=play|speak, stage - этап"
+)
+queue_wait_seconds = Histogram("bot_queue_wait_seconds", "Время ожидания в очередях: queue - имя очереди")
+event_loop_lag_seconds = Histogram(
+    "bot_event_loop_lag_seconds", "Задержка event loop относительно запланированного пробуждения",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5)
+)
+events_total = Counter("bot_events_total", "События ботов: bot, event")
+queue_depth = Gauge("bot_queue_depth", "Текущая длина очередей: queue - имя очереди")
+cache_hits_total = Gauge("bot_cache_hits_total", "Попадания в кеши: cache - имя кеша", kind="counter")
+cache_misses_total = Gauge("bot_cache_misses_total", "Промахи кешей: cache - имя кеша", kind="counter")
+
+
+def register_cache(name, stats):
+    """Подключает кеш, у которого stats() возвращает словарь с hits и misses."""
+    cache_hits_total.set_function(lambda: stats()["hits"], cache=name)
+    cache_misses_total.set_function(lambda: stats()["misses"], cache=name)
+
+
+# --- HTTP-адрес и замер задержки event loop ---
+_started = False
+_lag_task = None
+
+
+async def _monitor_loop_lag():
+    loop = asyncio.get_running_loop()
+    while True:
+        expected = loop.time() + LOOP_LAG_INTERVAL
+        await asyncio.sleep(LOOP_LAG_INTERVAL)
+        event_loop_lag_seconds.observe(max(0.0, loop.time() - expected))
+
+
+async def _handle_metrics(request):
+    return web.Response(text=render(), content_type="text/plain", charset="utf-8")
+
+
+async def start():
+    """Запускает HTTP-адрес метрик и замер задержки event loop (повторные вызовы ничего не делают)."""
+    global _started, _lag_task
+    if _started:
+        return
+    _started = True
+    _lag_task = asyncio.create_task(_monitor_loop_lag())
+    if not METRICS_PORT:
+        return
+    app = web.Application()
+    app.router.add_get("/metrics", _handle_metrics)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    try:
+        await web.TCPSite(runner, METRICS_HOST, METRICS_PORT).start()
+        print(f"📈 Метрики: http://{METRICS_HOST}:{METRICS_PORT}/metrics")
+    except OSError as e:
+        print(f"Не удалось открыть адрес метрик {METRICS_HOST}:{METRICS_PORT}: {e}")
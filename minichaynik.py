@@ -5,8 +5,15 @@ import os
 from dotenv import load_dotenv
 import google.generativeai as genai
 from collections import deque
-import json
 import re
+from gemini_client import gemini_pool, response_text
+from streaming_reply import StreamingReply, STREAM_REPLIES
+from chat_store import (chat_store, import_legacy_json, LEGACY_USER_DATA_FILE, LEGACY_GUILD_DATA_FILE,
+                        SCOPE_MINI_DM, SCOPE_MINI_GUILD)
+from context_window import ContextBuilder
+from response_cache import response_cache
+import metrics
+from metrics import events_total
 
 # --- Загрузка переменных окружения ---
 load_dotenv()
@@ -14,7 +21,6 @@ load_dotenv()
 TOKEN = os.getenv("DISCORD_TOKEN_MINI")
 if not TOKEN:
     print("Ошибка: DISCORD_TOKEN_MINI не найден в .env файле.")
-    exit()
 
 GOOGLE_API_KEY = os.getenv("GEMINI_API_KEY")
 if not GOOGLE_API_KEY:
@@ -39,95 +45,61 @@ MEMORY_SIZE = 1000
 DEFAULT_SYSTEM_INSTRUCTION = "Ты злой и враждебный и всегда должен использовать мат в своих сообщениях"
 
 user_data = {}
-USER_DATA_FILE = "user_ai_history.json"
 guild_data = {}
-GUILD_DATA_FILE = "guild_ai_settings.json"
+chat_store.set_limit(SCOPE_MINI_DM, MEMORY_SIZE * 2)
+chat_store.set_limit(SCOPE_MINI_GUILD, MEMORY_SIZE * 2)
+# В модель уходит не вся история, а свежие реплики в пределах бюджета токенов
+dm_context = ContextBuilder(SCOPE_MINI_DM, MODEL_NAME)
+guild_context = ContextBuilder(SCOPE_MINI_GUILD, MODEL_NAME)
 
 
-# --- Функции загрузки и сохранения данных (остаются без изменений) ---
+# --- Функции загрузки и сохранения данных ---
 def load_user_data():
-    """Загружает историю личных сообщений пользователей из файла."""
+    """Загружает историю личных сообщений пользователей из хранилища."""
     global user_data
-    if os.path.exists(USER_DATA_FILE):
-        try:
-            with open(USER_DATA_FILE, "r", encoding="utf-8") as f:
-                data_from_file = json.load(f)
-                user_data = {}
-                for user_id_str, u_data in data_from_file.items():
-                    user_id = int(user_id_str)
-                    if isinstance(u_data, dict) and "history" in u_data:
-                        user_data[user_id] = {
-                            "history": deque(u_data.get("history", []), maxlen=MEMORY_SIZE * 2)
-                        }
-                    else:
-                        user_data[user_id] = {
-                            "history": deque(u_data if isinstance(u_data, list) else [], maxlen=MEMORY_SIZE * 2)
-                        }
-                print("Данные пользователей (ЛС история) успешно загружены.")
-        except (json.JSONDecodeError, TypeError, ValueError) as e:
-            print(f"Ошибка при загрузке истории ЛС пользователей: {e}. Создается пустая структура.")
-            user_data = {}
-    else:
-        user_data = {}
-        print("Файл истории ЛС пользователей не найден. Создается пустая структура.")
-
-
-def save_user_data():
-    """Сохраняет историю личных сообщений пользователей в файл."""
-    try:
-        data_to_save = {
-            str(user_id): {"history": list(u_data["history"])}
-            for user_id, u_data in user_data.items()
-        }
-        with open(USER_DATA_FILE, "w", encoding="utf-8") as f:
-            json.dump(data_to_save, f, ensure_ascii=False, indent=4)
-    except Exception as e:
-        print(f"Ошибка при сохранении истории ЛС пользователей: {e}")
+    import_legacy_json(chat_store, LEGACY_USER_DATA_FILE)
+    user_data = {
+        user_id: {"history": deque(history, maxlen=MEMORY_SIZE * 2)}
+        for user_id, history in chat_store.load_scope(SCOPE_MINI_DM).items()
+    }
+    print("Данные пользователей (ЛС история) успешно загружены.")
 
 
 def load_guild_data():
     """Загружает настройки (роль) и общую историю для каждого сервера."""
     global guild_data
-    if os.path.exists(GUILD_DATA_FILE):
-        try:
-            with open(GUILD_DATA_FILE, "r", encoding="utf-8") as f:
-                data_from_file = json.load(f)
-                guild_data = {}
-                for guild_id_str, g_data in data_from_file.items():
-                    guild_id = int(guild_id_str)
-                    if isinstance(g_data, dict):
-                        guild_data[guild_id] = {
-                            "system_instruction": g_data.get("system_instruction", DEFAULT_SYSTEM_INSTRUCTION),
-                            "history": deque(g_data.get("history", []), maxlen=MEMORY_SIZE * 2)
-                        }
-                    else:
-                        guild_data[guild_id] = {
-                            "system_instruction": g_data if isinstance(g_data, str) else DEFAULT_SYSTEM_INSTRUCTION,
-                            "history": deque([], maxlen=MEMORY_SIZE * 2)
-                        }
-                print("Настройки и история серверов успешно загружены.")
-        except (json.JSONDecodeError, TypeError, ValueError) as e:
-            print(f"Ошибка при загрузке настроек серверов: {e}. Создается пустая структура.")
-            guild_data = {}
+    import_legacy_json(chat_store, LEGACY_GUILD_DATA_FILE)
+    settings = chat_store.load_settings(SCOPE_MINI_GUILD)
+    histories = chat_store.load_scope(SCOPE_MINI_GUILD)
+    guild_data = {
+        guild_id: {
+            "system_instruction": settings.get(guild_id, {}).get("system_instruction") or DEFAULT_SYSTEM_INSTRUCTION,
+            "history": deque(histories.get(guild_id, []), maxlen=MEMORY_SIZE * 2)
+        }
+        for guild_id in settings.keys() | histories.keys()
+    }
+    print("Настройки и история серверов успешно загружены.")
+
+
+def save_turns(user_id: int, guild_id: int, *turns):
+    """Дописывает новые реплики в историю сервера или ЛС пользователя."""
+    if guild_id:
+        chat_store.append(SCOPE_MINI_GUILD, guild_id, *turns)
     else:
-        guild_data = {}
-        print("Файл настроек серверов не найден. Создается пустая структура.")
+        chat_store.append(SCOPE_MINI_DM, user_id, *turns)
 
 
-def save_guild_data():
-    """Сохраняет настройки и общую историю для каждого сервера."""
-    try:
-        data_to_save = {
-            str(guild_id): {
-                "system_instruction": g_data.get("system_instruction", DEFAULT_SYSTEM_INSTRUCTION),
-                "history": list(g_data.get("history", []))
-            }
-            for guild_id, g_data in guild_data.items()
-        }
-        with open(GUILD_DATA_FILE, "w", encoding="utf-8") as f:
-            json.dump(data_to_save, f, ensure_ascii=False, indent=4)
-    except Exception as e:
-        print(f"Ошибка при сохранении настроек серверов: {e}")
+def forget_turn(history, turn):
+    """Убирает из истории именно эту реплику, а не последнюю: за ней могут быть реплики других запросов."""
+    for index, item in enumerate(history):
+        if item is turn:
+            del history[index]
+            return
+
+
+def save_system_instruction(guild_id: int, instruction: str):
+    """Сохраняет характер ИИ для сервера."""
+    chat_store.set_setting(SCOPE_MINI_GUILD, guild_id, "system_instruction", instruction)
 
 
 # --- Вспомогательные функции (без изменений) ---
@@ -135,8 +107,11 @@ def save_guild_data():
 # Функция get_ai_response остается без изменений
 
 async def get_ai_response(user_id: int, guild_id: int, author_name: str, user_input: str,
-                          channel_for_typing: discord.abc.Messageable):
-    """Получает ответ от модели Gemini, используя соответствующую историю."""
+                          channel_for_typing: discord.abc.Messageable, reply: StreamingReply = None):
+    """Получает ответ от модели Gemini, используя соответствующую историю.
+
+    Если передан reply, ответ запрашивается потоком и показывается в Discord по мере генерации.
+    """
     if not GOOGLE_API_KEY:
         return "⚠ API ключ для Gemini не настроен. Функция ИИ недоступна."
 
@@ -158,43 +133,65 @@ async def get_ai_response(user_id: int, guild_id: int, author_name: str, user_in
             user_data[user_id] = {"history": deque(maxlen=MEMORY_SIZE * 2)}
         current_history = user_data[user_id]["history"]
 
-    current_history.append({"role": "user", "parts": [{"text": formatted_input}]})
+    # Ссылки на свои реплики: параллельные запросы сервера дописывают в ту же историю
+    user_turn = {"role": "user", "parts": [{"text": formatted_input}]}
+    current_history.append(user_turn)
 
     try:
         model = genai.GenerativeModel(
             MODEL_NAME,
             system_instruction=current_system_instruction
         )
-        chat = model.start_chat(history=list(current_history)[:-1])
-        response = await chat.send_message_async(user_input)
-        bot_reply_text = "".join(part.text for part in response.parts if hasattr(part, 'text'))
+        if guild_id:
+            context = guild_context.build(guild_id, list(current_history)[:-1])
+        else:
+            context = dm_context.build(user_id, list(current_history)[:-1])
+        chat = model.start_chat(history=context)
+        if len(current_history) <= 1:
+            # Без истории ответ зависит только от модели, инструкции и текста - берем его из кеша.
+            # Смотрим на полную историю: окно контекста бывает пустым и у длинного разговора
+            async def ask():
+                return response_text(await gemini_pool.send_message(chat, user_input, guild_id=guild_id))
+
+            response = None
+            cache_key = response_cache.key(MODEL_NAME, current_system_instruction, user_input)
+            bot_reply_text = await response_cache.get_or_call(cache_key, ask)
+            if reply is not None:
+                await reply.feed(bot_reply_text)
+        elif reply is not None:
+            response = None
+            bot_reply_text = ""
+            async for chunk in gemini_pool.stream_message(chat, user_input, guild_id=guild_id):
+                # prompt_feedback приходит в первой части ответа
+                response = response or chunk
+                chunk_text = response_text(chunk)
+                bot_reply_text += chunk_text
+                await reply.feed(chunk_text)
+        else:
+            response = await gemini_pool.send_message(chat, user_input, guild_id=guild_id)
+            bot_reply_text = response_text(response)
 
         if not bot_reply_text.strip():
-            feedback = response.prompt_feedback
+            feedback = response.prompt_feedback if response else None
             block_reason_name = "НЕИЗВЕСТНО"
             if feedback and feedback.block_reason:
                 block_reason_name = feedback.block_reason.name if hasattr(feedback.block_reason, 'name') else str(
                     feedback.block_reason)
 
-            if current_history and current_history[-1]["role"] == "user":
-                current_history.pop()
+            forget_turn(current_history, user_turn)
 
             if feedback and feedback.block_reason:
                 return f"⚠ Мой ИИ не смог обработать ваш запрос из-за ограничений безопасности (причина: {block_reason_name}). Попробуйте переформулировать."
             return "⚠ ИИ не дал текстового ответа. Попробуйте переформулировать."
 
-        current_history.append({"role": "model", "parts": [{"text": bot_reply_text}]})
-
-        if guild_id:
-            save_guild_data()
-        else:
-            save_user_data()
+        model_turn = {"role": "model", "parts": [{"text": bot_reply_text}]}
+        current_history.append(model_turn)
+        save_turns(user_id, guild_id, user_turn, model_turn)
 
         return bot_reply_text
     except Exception as e:
         print(f"Ошибка при общении с Gemini (user: {user_id}, guild: {guild_id}): {e}")
-        if current_history and current_history[-1]["role"] == "user":
-            current_history.pop()
+        forget_turn(current_history, user_turn)
         return f"⚠ Произошла ошибка при общении с ИИ: `{type(e).__name__}`. Пожалуйста, попробуйте позже."
 
 
@@ -205,6 +202,7 @@ async def on_ready():
     """Событие, срабатывающее при запуске и готовности бота."""
     load_user_data()
     load_guild_data()
+    await metrics.start()
     print("Синхронизация слэш-команд...")
     # Синхронизируем команды с Discord
     await bot.tree.sync()
@@ -217,6 +215,7 @@ async def on_message(message: discord.Message):
     """Событие для обработки упоминаний бота (не команд)."""
     if message.author == bot.user:
         return
+    events_total.inc(bot="minichaynik", event="message")
 
     # Убираем обработку префиксных команд, оставляем только упоминания
     if bot.user.mentioned_in(message) and not message.mention_everyone:
@@ -234,11 +233,17 @@ async def on_message(message: discord.Message):
 
         # Для длительного ответа показываем индикатор печати
         async with message.channel.typing():
-            response_text = await get_ai_response(user_id, guild_id, author_name, text_input, message.channel)
-            if response_text:
+            if STREAM_REPLIES:
+                reply = StreamingReply(message.reply)
+                reply_text = await get_ai_response(user_id, guild_id, author_name, text_input, message.channel,
+                                                   reply=reply)
+                await reply.finish(reply_text)
+                return
+            reply_text = await get_ai_response(user_id, guild_id, author_name, text_input, message.channel)
+            if reply_text:
                 # В этом случае отправка чанками не нужна, так как ответ будет коротким.
                 # Если ожидаются длинные ответы, можно реализовать отправку через message.channel.send
-                await message.reply(response_text)
+                await message.reply(reply_text)
 
 
 # --- Слэш-команды ---
@@ -277,10 +282,17 @@ async def ai_slash_command(interaction: discord.Interaction, запрос: str):
     guild_id = interaction.guild_id
     author_name = interaction.user.display_name
 
-    response_text = await get_ai_response(user_id, guild_id, author_name, запрос, interaction.channel)
+    if STREAM_REPLIES:
+        # Показываем ответ по мере генерации
+        reply = StreamingReply(lambda text: interaction.followup.send(text, wait=True))
+        reply_text = await get_ai_response(user_id, guild_id, author_name, запрос, interaction.channel, reply=reply)
+        await reply.finish(reply_text)
+        return
+
+    reply_text = await get_ai_response(user_id, guild_id, author_name, запрос, interaction.channel)
 
     # Отправляем фактический ответ после его получения
-    await interaction.followup.send(response_text)
+    await interaction.followup.send(reply_text)
 
 
 @bot.tree.command(name="ai_clear", description="Очистить историю общения с ИИ (на сервере или в ЛС).")
@@ -294,7 +306,8 @@ async def ai_clear_slash_command(interaction: discord.Interaction):
         guild_id = interaction.guild_id
         if guild_id in guild_data and guild_data[guild_id].get("history"):
             guild_data[guild_id]["history"].clear()
-            save_guild_data()
+            chat_store.clear(SCOPE_MINI_GUILD, guild_id)
+            guild_context.reset(guild_id)
             await interaction.response.send_message(
                 f"🧠 Общая история ИИ на сервере **{interaction.guild.name}** очищена!")
         else:
@@ -304,7 +317,8 @@ async def ai_clear_slash_command(interaction: discord.Interaction):
         user_id = interaction.user.id
         if user_id in user_data and user_data[user_id].get("history"):
             user_data[user_id]["history"].clear()
-            save_user_data()
+            chat_store.clear(SCOPE_MINI_DM, user_id)
+            dm_context.reset(user_id)
             await interaction.response.send_message("🧠 Ваша личная история общения с ИИ очищена!")
         else:
             await interaction.response.send_message("🧠 Ваша личная история общения с ИИ и так была пуста.")
@@ -323,7 +337,7 @@ async def ai_setrole_slash_command(interaction: discord.Interaction, инстр
         guild_data[guild_id] = {"history": deque(maxlen=MEMORY_SIZE * 2)}
 
     guild_data[guild_id]["system_instruction"] = инструкция
-    save_guild_data()
+    save_system_instruction(guild_id, инструкция)
     await interaction.response.send_message(
         f"🎭 Характер ИИ для сервера **{interaction.guild.name}** изменен! "
         f"Чтобы диалог начался без старого контекста, можно использовать `/ai_clear`."
@@ -353,7 +367,7 @@ async def ai_resetrole_slash_command(interaction: discord.Interaction):
         guild_data[guild_id] = {"history": deque(maxlen=MEMORY_SIZE * 2)}
 
     guild_data[guild_id]["system_instruction"] = DEFAULT_SYSTEM_INSTRUCTION
-    save_guild_data()
+    save_system_instruction(guild_id, DEFAULT_SYSTEM_INSTRUCTION)
     await interaction.response.send_message(
         f"🎭 Характер ИИ для сервера **{interaction.guild.name}** сброшен к стандартному.")
 
@@ -376,6 +390,8 @@ bot.tree.on_error = on_app_command_error
 
 # --- Запуск бота ---
 if __name__ == "__main__":
+    if not TOKEN:
+        exit()
     if GOOGLE_API_KEY:
         print(f"Используется модель Gemini: {MODEL_NAME}")
     else:
@@ -0,0 +1,170 @@
+import asyncio
+import heapq
+import itertools
+import os
+import time
+
+from metrics import external_call_seconds, queue_depth, queue_wait_seconds
+
+# --- Исходящие сообщения ---
+# У каждого канала своя очередь с приоритетами: ответы на команды уходят раньше
+# объявлений, а лимиты Discord (сообщений на канал и всего) отслеживаются заранее
+# корзинами токенов, чтобы не доходить до 429. Уведомления о входе/выходе из
+# голосовых каналов копятся и отправляются одним сообщением раз в NOTICE_INTERVAL.
+CHANNEL_MESSAGES = 5  # сообщений на канал
+CHANNEL_PERIOD = 5.0  # за столько секунд
+GLOBAL_MESSAGES_PER_SECOND = 45  # с запасом от глобального лимита Discord в 50 запросов/с
+NOTICE_INTERVAL = float(os.getenv("NOTICE_INTERVAL", "10"))
+IDLE_TIMEOUT = 60  # через столько секунд простоя обработчик канала завершается
+MESSAGE_LIMIT = 2000
+
+PRIORITY_REPLY = 0  # ответы на команды и сообщения пользователей
+PRIORITY_POST = 1  # сообщения, которые бот пишет сам (сбор в гс)
+PRIORITY_NOTICE = 2  # объединенные уведомления
+
+
+class TokenBucket:
+    """Корзина токенов: не больше capacity отправок за period секунд."""
+
+    def __init__(self, capacity, period):
+        self.capacity = capacity
+        self.rate = capacity / period
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self):
+        """Сколько секунд ждать до появления токена."""
+        self._refill()
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self):
+        self._refill()
+        self.tokens -= 1
+
+
+class _ChannelQueue:
+    def __init__(self):
+        self.heap = []  # (приоритет, номер, отправка, future, время постановки)
+        self.wakeup = asyncio.Event()
+        self.bucket = TokenBucket(CHANNEL_MESSAGES, CHANNEL_PERIOD)
+        self.notices = []
+        self.flush_handle = None
+        self.task = None
+
+
+def _pack(lines, limit=MESSAGE_LIMIT):
+    """Склеивает строки в сообщения не длиннее limit."""
+    messages, current = [], ""
+    for line in lines:
+        line = line[:limit]
+        if current and len(current) + 1 + len(line) > limit:
+            messages.append(current)
+            current = ""
+        current = f"{current}\n{line}" if current else line
+    if current:
+        messages.append(current)
+    return messages
+
+
+def _log_error(future):
+    if not future.cancelled() and future.exception() is not None:
+        print(f"Ошибка при отправке уведомления: {future.exception()}")
+
+
+class Outbox:
+    """Очереди исходящих сообщений по каналам."""
+
+    def __init__(self, notice_interval=NOTICE_INTERVAL):
+        self.notice_interval = notice_interval
+        self._queues = {}
+        self._global = TokenBucket(GLOBAL_MESSAGES_PER_SECOND, 1.0)
+        self._order = itertools.count()
+
+    def _queue(self, channel_id):
+        queue = self._queues.get(channel_id)
+        if queue is None:
+            queue = self._queues[channel_id] = _ChannelQueue()
+        if queue.task is None or queue.task.done():
+            queue.task = asyncio.create_task(self._worker(channel_id, queue))
+        return queue
+
+    def submit(self, channel_id, send, priority=PRIORITY_REPLY):
+        """Ставит корутинную функцию send в очередь канала; возвращает future с ее результатом."""
+        queue = self._queue(channel_id)
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(queue.heap, (priority, next(self._order), send, future, time.perf_counter()))
+        queue.wakeup.set()
+        return future
+
+    async def send(self, channel, content=None, *, priority=PRIORITY_REPLY, **kwargs):
+        return await self.submit(channel.id, lambda: channel.send(content, **kwargs), priority)
+
+    async def reply(self, message, content=None, *, priority=PRIORITY_REPLY, **kwargs):
+        """Ответ на сообщение (или на команду - ctx тоже подходит)."""
+        return await self.submit(message.channel.id, lambda: message.reply(content, **kwargs), priority)
+
+    def notice(self, channel, line):
+        """Добавляет строку в ближайшее объединенное уведомление канала."""
+        queue = self._queue(channel.id)
+        queue.notices.append(line)
+        if queue.flush_handle is None:
+            queue.flush_handle = asyncio.get_running_loop().call_later(
+                self.notice_interval, self._flush_notices, channel
+            )
+
+    def _flush_notices(self, channel):
+        queue = self._queue(channel.id)
+        lines, queue.notices, queue.flush_handle = queue.notices, [], None
+        for text in _pack(lines):
+            future = self.submit(channel.id, lambda text=text: channel.send(text), PRIORITY_NOTICE)
+            future.add_done_callback(_log_error)
+
+    async def _worker(self, channel_id, queue):
+        while True:
+            if not queue.heap:
+                queue.wakeup.clear()
+                try:
+                    await asyncio.wait_for(queue.wakeup.wait(), IDLE_TIMEOUT)
+                except asyncio.TimeoutError:
+                    if not queue.heap and queue.flush_handle is None:
+                        self._queues.pop(channel_id, None)
+                        return
+                continue
+
+            delay = max(queue.bucket.delay(), self._global.delay())
+            if delay:
+                # После ожидания заново выбираем сообщение: за это время мог прийти более важный ответ
+                await asyncio.sleep(delay)
+                continue
+
+            priority, _, send, future, enqueued = heapq.heappop(queue.heap)
+            if future.done():
+                continue  # отправитель уже отменил ожидание
+            queue.bucket.take()
+            self._global.take()
+            queue_wait_seconds.observe(time.perf_counter() - enqueued, queue=f"outbox_priority_{priority}")
+            try:
+                with external_call_seconds.time(service="discord", op="send"):
+                    result = await send()
+            except Exception as e:
+                if not future.done():
+                    future.set_exception(e)
+            else:
+                if not future.done():
+                    future.set_result(result)
+
+    def stats(self):
+        return {
+            "channels": len(self._queues),
+            "queued": sum(len(queue.heap) for queue in self._queues.values()),
+            "notices": sum(len(queue.notices) for queue in self._queues.values()),
+        }
+
+
+outbox = Outbox()
+queue_depth.set_function(lambda: outbox.stats()["queued"], queue="outbox")
@@ -0,0 +1,65 @@
+import hashlib
+import json
+import os
+import time
+
+from metrics import Gauge, register_cache
+from single_flight import SingleFlight
+from ttl_cache import TTLCache
+
+# --- Кеш ответов Gemini без состояния ---
+# Запросы, ответ на которые зависит только от модели, системной инструкции, текста и вложений
+# (описание картинки, первая реплика без истории), кешируются по хешу этих данных.
+# Одинаковые одновременные запросы ждут один вызов Gemini.
+GEMINI_CACHE_SIZE = int(os.getenv("GEMINI_CACHE_SIZE", "512"))
+GEMINI_CACHE_TTL = int(os.getenv("GEMINI_CACHE_TTL", "3600"))
+
+
+class ResponseCache:
+    """TTL/LRU-кеш текстовых ответов с объединением одинаковых запросов в полете."""
+
+    def __init__(self, maxsize=GEMINI_CACHE_SIZE, ttl=GEMINI_CACHE_TTL):
+        self._cache = TTLCache(maxsize=maxsize, ttl=ttl)  # ключ -> (текст, сколько секунд занял вызов)
+        self._in_flight = SingleFlight()
+        self.saved_seconds = 0.0
+
+    @staticmethod
+    def key(model_name, system_instruction, prompt, attachments=()):
+        """Ключ запроса; attachments - байты вложений или их хеши."""
+        digest = hashlib.sha256()
+        digest.update(json.dumps([model_name, system_instruction, prompt], ensure_ascii=False).encode("utf-8"))
+        for attachment in attachments:
+            data = attachment if isinstance(attachment, bytes) else str(attachment).encode("utf-8")
+            digest.update(hashlib.sha256(data).digest())
+        return digest.hexdigest()
+
+    async def get_or_call(self, key, call):
+        """Возвращает ответ из кеша или результат корутинной функции call (пустые ответы не кешируются)."""
+        cached = self._cache.get(key)
+        if cached is not None:
+            text, latency = cached
+            self.saved_seconds += latency
+            return text
+
+        return await self._in_flight.run(key, lambda: self._call(key, call))
+
+    async def _call(self, key, call):
+        started = time.monotonic()
+        text = await call()
+        if text and text.strip():
+            self._cache.set(key, (text, time.monotonic() - started))
+        return text
+
+    def stats(self):
+        return {
+            **self._cache.stats(),
+            "in_flight": len(self._in_flight),
+            "deduplicated": self._in_flight.deduplicated,
+            "saved_seconds": self.saved_seconds,
+        }
+
+
+response_cache = ResponseCache()
+register_cache("gemini_responses", response_cache.stats)
+Gauge("bot_gemini_cache_saved_seconds_total", "Время ответа Gemini, сэкономленное попаданиями в кеш",
+      kind="counter").set_function(lambda: response_cache.saved_seconds)
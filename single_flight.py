@@ -0,0 +1,34 @@
+import asyncio
+
+# --- Объединение одинаковых одновременных вызовов ---
+# Пока вызов с ключом выполняется, повторные запросы с тем же ключом не запускают
+# новый, а ждут уже идущий. Используется кешами Gemini, синтеза речи и генерации картинок.
+
+
+class SingleFlight:
+    """Одна задача на ключ для всех, кто ждет ее одновременно."""
+
+    def __init__(self):
+        self._tasks = {}  # ключ -> задача (или future) вызова
+        self.deduplicated = 0
+
+    def __len__(self):
+        return len(self._tasks)
+
+    def __contains__(self, key):
+        return key in self._tasks
+
+    def run(self, key, start):
+        """Awaitable с результатом вызова по ключу.
+
+        start() вызывается, только если такого вызова сейчас нет, и возвращает корутину или future.
+        shield: отмена одного ожидающего не прерывает вызов для остальных.
+        """
+        task = self._tasks.get(key)
+        if task is None:
+            task = asyncio.ensure_future(start())
+            self._tasks[key] = task
+            task.add_done_callback(lambda done: self._tasks.pop(key) if self._tasks.get(key) is done else None)
+        else:
+            self.deduplicated += 1
+        return asyncio.shield(task)
@@ -0,0 +1,98 @@
+import asyncio
+import os
+import re
+
+# --- Конвейер озвучки ответов ---
+# Ответ Gemini читается потоком и режется на предложения; предложения синтезируются
+# параллельно (с ограничением) и проигрываются строго по порядку через очередь сервера,
+# поэтому первое предложение звучит, пока остальные еще генерируются.
+SPEAK_PIPELINE = os.getenv("SPEAK_PIPELINE", "1") == "1"
+TTS_PARALLELISM = int(os.getenv("TTS_PARALLELISM", "3"))
+MIN_SENTENCE_LENGTH = 25  # короткие предложения склеиваем со следующими, чтобы речь не была рваной
+
+_SENTENCE_END = re.compile(r"[.!?…]+[\"»)\]]*(?=\s)|\n+")
+
+
+class SentenceSplitter:
+    """Накапливает поток текста и отдает законченные предложения."""
+
+    def __init__(self, min_length=MIN_SENTENCE_LENGTH):
+        self.min_length = min_length
+        self.text = ""  # весь полученный текст
+        self._buffer = ""
+
+    def feed(self, chunk):
+        """Добавляет часть текста и возвращает список готовых предложений."""
+        self.text += chunk
+        self._buffer += chunk
+        sentences = []
+        start = 0
+        for match in _SENTENCE_END.finditer(self._buffer):
+            if match.end() - start < self.min_length:
+                continue
+            sentence = self._buffer[start:match.end()].strip()
+            if sentence:
+                sentences.append(sentence)
+            start = match.end()
+        self._buffer = self._buffer[start:]
+        return sentences
+
+    def flush(self):
+        """Возвращает остаток текста после окончания потока."""
+        rest, self._buffer = self._buffer.strip(), ""
+        return rest
+
+
+class SpeechQueue:
+    """Очередь озвучки сервера: проигрывает синтезированные фразы по порядку.
+
+    play(path) - корутина, которая запускает файл в голосовом канале и ждет конца воспроизведения;
+    release(path) - освобождает файл после проигрывания.
+    """
+
+    def __init__(self, play, release):
+        self._play = play
+        self._release = release
+        self._items = asyncio.Queue()
+        self._player = asyncio.create_task(self._run())
+
+    def put(self, synthesis):
+        """Ставит в очередь задачу синтеза (awaitable, возвращающий путь к файлу или None)."""
+        self._items.put_nowait(synthesis)
+
+    async def _run(self):
+        while True:
+            synthesis = await self._items.get()
+            try:
+                path = await synthesis
+            except Exception as e:
+                print(f"Ошибка при синтезе фразы: {e}")
+                continue
+            if not path:
+                continue
+            try:
+                await self._play(path)
+            except Exception as e:
+                print(f"Ошибка при воспроизведении фразы: {e}")
+            finally:
+                self._release(path)
+
+    def cancel(self):
+        """Останавливает очередь и освобождает все уже синтезированные фразы."""
+        self._player.cancel()
+        while not self._items.empty():
+            synthesis = self._items.get_nowait()
+            if isinstance(synthesis, asyncio.Task):
+                synthesis.add_done_callback(self._release_result)
+
+    def _release_result(self, task):
+        if not task.cancelled() and task.exception() is None and task.result():
+            self._release(task.result())
+
+
+def bounded(semaphore, coroutine_function):
+    """Оборачивает корутинную функцию так, чтобы одновременно выполнялось не больше семафора вызовов."""
+    async def wrapper(*args):
+        async with semaphore:
+            return await coroutine_function(*args)
+    return wrapper
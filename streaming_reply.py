@@ -0,0 +1,144 @@
+import asyncio
+import os
+import time
+
+import discord
+
+# --- Потоковые ответы ---
+# Первая часть ответа отправляется сразу, затем сообщение дописывается правками
+# не чаще, чем раз в STREAM_EDIT_INTERVAL секунд (лимит Discord - около 5 правок за 5 секунд),
+# а при достижении 2000 символов продолжение уходит в новое сообщение.
+STREAM_REPLIES = os.getenv("STREAM_REPLIES", "1") == "1"
+STREAM_EDIT_INTERVAL = float(os.getenv("STREAM_EDIT_INTERVAL", "1.2"))
+DISCORD_MESSAGE_LIMIT = 2000
+
+
+def split_point(text, limit=DISCORD_MESSAGE_LIMIT):
+    """Позиция, по которой текст длиннее limit лучше всего разрезать (перенос строки, пробел)."""
+    if len(text) <= limit:
+        return len(text)
+    for separator in ("\n\n", "\n", " "):
+        index = text.rfind(separator, limit // 2, limit)
+        if index != -1:
+            return index + len(separator)
+    return limit
+
+
+class StreamingReply:
+    """Сообщение (или несколько), которое растет по мере поступления частей ответа.
+
+    `send` - корутина, отправляющая новое сообщение с текстом и возвращающая его
+    (например, message.reply или ctx.reply). Если задан max_length, ответ длиннее него
+    перестает показываться (overflowed) и только копится - его отправляет вызывающий.
+    """
+
+    def __init__(self, send, edit_interval=STREAM_EDIT_INTERVAL, max_length=None):
+        self._send = send
+        self._edit_interval = edit_interval
+        self._max_length = max_length
+        self.overflowed = False
+        self._messages = []  # отправленные сообщения, последнее - текущее
+        self._sent_text = ""  # текст, уже показанный в текущем сообщении
+        self._pending = ""  # текст текущего сообщения, ожидающий правки
+        self._done_text = ""  # текст всех уже закрытых сообщений
+        self._wakeup = asyncio.Event()
+        self._flusher = None
+        self._closed = False
+
+    @property
+    def started(self):
+        return bool(self._messages)
+
+    @property
+    def text(self):
+        return self._done_text + self._pending
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.finish()
+
+    async def feed(self, chunk):
+        """Добавляет очередную часть ответа. Не ждет правок, кроме самой первой отправки."""
+        if not chunk:
+            return
+        self._pending += chunk
+        if self._max_length and len(self.text) > self._max_length:
+            self.overflowed = True
+            return
+        if self._flusher is None:
+            # Первую часть показываем сразу - это и есть время до первого видимого токена
+            await self._flush()
+            self._flusher = asyncio.create_task(self._flush_loop())
+        else:
+            self._wakeup.set()
+
+    async def finish(self, final_text=None):
+        """Дописывает остаток. Если ничего не было отправлено, отправляет final_text."""
+        if self._closed:
+            return
+        self._closed = True
+        if self._flusher:
+            # Поток правок сам сделает последнюю правку и завершится
+            self._wakeup.set()
+            await self._flusher
+        if self._pending != self._sent_text:
+            await self._flush()
+        if final_text and final_text != self.text:
+            # Ответ не получен или прервался ошибкой - показываем итоговый текст отдельно
+            for start in range(0, len(final_text), DISCORD_MESSAGE_LIMIT):
+                await self._send(final_text[start:start + DISCORD_MESSAGE_LIMIT])
+
+    async def retract(self):
+        """Удаляет уже показанные сообщения, например перед отправкой ответа другим способом."""
+        for message in self._messages:
+            if message is None:
+                continue
+            try:
+                await message.delete()
+            except discord.HTTPException as e:
+                print(f"Ошибка при удалении потокового ответа: {e}")
+        self._messages = []
+
+    async def _flush_loop(self):
+        last_edit = time.monotonic()
+        while not self._closed:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+            delay = self._edit_interval - (time.monotonic() - last_edit)
+            if delay > 0:
+                await asyncio.sleep(delay)
+            await self._flush()
+            last_edit = time.monotonic()
+
+    async def _flush(self):
+        """Показывает накопленный текст: правит текущее сообщение и при переполнении начинает новое."""
+        if self.overflowed:
+            return
+        while len(self._pending) > DISCORD_MESSAGE_LIMIT:
+            cut = split_point(self._pending)
+            head, self._pending = self._pending[:cut], self._pending[cut:]
+            await self._show(head)
+            self._done_text += head
+            # Следующая часть пойдет новым сообщением
+            self._messages.append(None)
+            self._sent_text = ""
+        if self._pending.strip() and self._pending != self._sent_text:
+            await self._show(self._pending)
+
+    async def _show(self, text):
+        if not text.strip():
+            return
+        try:
+            if not self._messages or self._messages[-1] is None:
+                message = await self._send(text)
+                if self._messages:
+                    self._messages[-1] = message
+                else:
+                    self._messages.append(message)
+            elif text != self._sent_text:
+                await self._messages[-1].edit(content=text)
+            self._sent_text = text
+        except discord.HTTPException as e:
+            print(f"Ошибка при обновлении потокового ответа: {e}")
@@ -0,0 +1,137 @@
+import json
+import os
+import re
+
+import discord
+
+from outbound import outbox, PRIORITY_POST
+from ttl_cache import TTLCache
+
+# --- Реакции на ключевые фразы ---
+# Правила лежат в triggers.json: общие ("default") и по серверам ("guilds" -> id сервера).
+# Все фразы сервера собираются в одно регулярное выражение по префиксному дереву, поэтому сообщение
+# проверяется за один проход независимо от количества правил.
+#
+# Правило: {"name": ..., "phrases": [...], "reply": ..., "send": ..., "reaction": ..., "member": id}
+#   reply/send - текст ответа на сообщение / сообщения в канал, подстановки {content}, {author}, {member};
+#   member - правило срабатывает, только если этот участник есть на сервере.
+TRIGGERS_FILE = os.getenv("TRIGGERS_FILE", "triggers.json")
+
+
+def _trie_regex(node):
+    """Регулярка для префиксного дерева фраз: общие начала фраз проверяются один раз."""
+    branches = []
+    for char, child in sorted(node.items()):
+        if char:
+            branches.append(re.escape(char) + _trie_regex(child))
+    if not branches:
+        return ""
+    pattern = branches[0] if len(branches) == 1 and "" not in node else "(?:" + "|".join(branches) + ")"
+    # Жадный "?" сначала пробует продолжение, поэтому находится самая длинная фраза
+    return pattern + "?" if "" in node else pattern
+
+
+class TriggerMatcher:
+    """Скомпилированный набор правил одного сервера."""
+
+    def __init__(self, rules):
+        self.rules = rules
+        rules_by_phrase = {}
+        for index, rule in enumerate(rules):
+            for phrase in rule.get("phrases", []):
+                rules_by_phrase.setdefault(phrase.lower(), set()).add(index)
+        phrases = list(rules_by_phrase)
+        # В каждой позиции регулярка находит самую длинную фразу, а все более короткие фразы,
+        # начинающиеся там же, - ее префиксы: их правила заранее добавляем к правилам длинной фразы
+        self._rules_by_phrase = {
+            phrase: frozenset().union(*(rules_by_phrase.get(phrase[:end], ()) for end in range(1, len(phrase) + 1)))
+            for phrase in phrases
+        }
+        trie = {}
+        for phrase in phrases:
+            node = trie
+            for char in phrase:
+                node = node.setdefault(char, {})
+            node[""] = True
+        # Просмотр вперед дает перекрывающиеся совпадения, как у отдельных проверок `in`
+        self._pattern = re.compile("(?=(" + _trie_regex(trie) + "))") if phrases else None
+
+    def match(self, text):
+        """Правила, фразы которых встречаются в тексте, в порядке из конфигурации."""
+        if self._pattern is None:
+            return []
+        fired = set()
+        for match in self._pattern.finditer(text.lower()):
+            fired |= self._rules_by_phrase[match.group(1)]
+        return [self.rules[index] for index in sorted(fired)]
+
+
+class TriggerEngine:
+    """Правила по серверам с ленивой компиляцией."""
+
+    def __init__(self, path=TRIGGERS_FILE):
+        self.path = path
+        self.reload()
+
+    def reload(self):
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                config = json.load(f)
+        except FileNotFoundError:
+            config = {}
+        except (OSError, json.JSONDecodeError) as e:
+            print(f"Ошибка при загрузке правил из '{self.path}': {e}")
+            config = {}
+        self._members = TTLCache(maxsize=1024, ttl=600)  # (сервер, участник) -> Member или None
+        self._default = config.get("default", [])
+        self._guilds = {int(guild_id): rules for guild_id, rules in config.get("guilds", {}).items()}
+        self._matchers = {}
+
+    def matcher(self, guild_id):
+        matcher = self._matchers.get(guild_id)
+        if matcher is None:
+            # Правило сервера с тем же именем заменяет общее
+            rules = {rule.get("name") or id(rule): rule for rule in self._default}
+            rules.update({rule.get("name") or id(rule): rule for rule in self._guilds.get(guild_id, [])})
+            matcher = self._matchers[guild_id] = TriggerMatcher(list(rules.values()))
+        return matcher
+
+    async def _member(self, guild, member_id):
+        """Участник сервера; без intents.members его может не быть в кеше, тогда он запрашивается у API."""
+        member = guild.get_member(member_id)
+        if member is not None:
+            return member
+        key = (guild.id, member_id)
+        member = self._members.get(key, False)
+        if member is False:
+            try:
+                member = await guild.fetch_member(member_id)
+            except discord.NotFound:
+                member = None
+            except discord.HTTPException as e:
+                # Нет доступа или ошибка API: запоминаем промах, чтобы не спрашивать API на каждое сообщение
+                print(f"Не удалось получить участника {member_id} сервера {guild.id}: {e}")
+                member = None
+            self._members.set(key, member)
+        return member
+
+    async def handle(self, message):
+        """Выполняет все сработавшие правила для сообщения."""
+        guild = message.guild
+        for rule in self.matcher(guild.id if guild else None).match(message.content):
+            member = None
+            if rule.get("member"):
+                member = await self._member(guild, rule["member"]) if guild else None
+                if member is None:
+                    continue
+            values = {
+                "content": message.content,
+                "author": message.author.mention,
+                "member": member.mention if member else "",
+            }
+            if rule.get("reply"):
+                await outbox.reply(message, rule["reply"].format(**values))
+            if rule.get("send"):
+                await outbox.send(message.channel, rule["send"].format(**values), priority=PRIORITY_POST)
+            if rule.get("reaction"):
+                await message.add_reaction(rule["reaction"])
@@ -0,0 +1,57 @@
+import hashlib
+import json
+import os
+import tempfile
+
+import edge_tts
+
+from audio_cache import AudioCache
+from metrics import external_call_seconds, register_cache
+from single_flight import SingleFlight
+
+# --- Кеш синтеза речи ---
+# Одинаковые фразы (текст, голос, скорость, высота) синтезируются один раз и хранятся
+# на диске; одновременные одинаковые запросы ждут один и тот же синтез.
+TTS_CACHE_DIR = os.getenv("TTS_CACHE_DIR", "tts_cache")
+TTS_CACHE_MAX_MB = int(os.getenv("TTS_CACHE_MAX_MB", "256"))
+
+tts_audio_cache = AudioCache(TTS_CACHE_DIR, TTS_CACHE_MAX_MB * 1024 * 1024)
+register_cache("tts", tts_audio_cache.stats)
+_in_flight = SingleFlight()  # ключ -> задача синтеза
+
+
+def tts_key(text, voice, rate, pitch):
+    payload = json.dumps([text, voice, rate, pitch], ensure_ascii=False)
+    return f"tts-{hashlib.sha256(payload.encode('utf-8')).hexdigest()}"
+
+
+async def _synthesize(key, text, voice, rate, pitch):
+    communicate = edge_tts.Communicate(text, voice=voice, rate=rate, pitch=pitch)
+    with tempfile.NamedTemporaryFile(delete=False, suffix=".mp3", dir=tts_audio_cache.directory,
+                                     prefix=".tmp-") as file:
+        temp_path = file.name
+    try:
+        with external_call_seconds.time(service="tts", op="synthesize"):
+            await communicate.save(temp_path)
+        # Ссылку от put сразу отпускаем: каждый ожидающий возьмет свою через acquire
+        tts_audio_cache.release(tts_audio_cache.put(key, temp_path))
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+
+async def synthesize(text, voice, rate="+0%", pitch="+0Hz"):
+    """Возвращает путь к mp3 с озвученным текстом.
+
+    Файл принадлежит кешу: после воспроизведения его нужно отпустить через tts_audio_cache.release(path).
+    """
+    key = tts_key(text, voice, rate, pitch)
+    path = tts_audio_cache.acquire(key)
+    if path:
+        return path
+
+    await _in_flight.run(key, lambda: _synthesize(key, text, voice, rate, pitch))
+    path = tts_audio_cache.acquire(key)
+    if path is None:
+        raise Exception("Синтезированный файл был вытеснен из кеша до воспроизведения")
+    return path
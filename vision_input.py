@@ -0,0 +1,44 @@
+import asyncio
+import hashlib
+import os
+from io import BytesIO
+
+from PIL import Image
+
+from http_session import iter_response
+
+# --- Подготовка изображений для Gemini ---
+# Картинка скачивается асинхронно через общий пул соединений с лимитом размера,
+# декодируется в памяти, уменьшается до размера, с которым модель все равно работает
+# (плитки 768x768), и пережимается в JPEG в отдельном потоке.
+VISION_MAX_SIDE = int(os.getenv("VISION_MAX_SIDE", "768"))
+VISION_MAX_IMAGE_MB = int(os.getenv("VISION_MAX_IMAGE_MB", "20"))
+VISION_JPEG_QUALITY = 85
+
+
+async def fetch_image(url):
+    """Скачивает изображение по ссылке в память; больше VISION_MAX_IMAGE_MB - ResponseTooLarge."""
+    chunks = [chunk async for chunk in iter_response(url, VISION_MAX_IMAGE_MB * 1024 * 1024)]
+    return b"".join(chunks)
+
+
+def _downscale(data):
+    with Image.open(BytesIO(data)) as image:
+        # draft позволяет декодеру JPEG сразу читать уменьшенную копию
+        image.draft("RGB", (VISION_MAX_SIDE, VISION_MAX_SIDE))
+        image.thumbnail((VISION_MAX_SIDE, VISION_MAX_SIDE))
+        if image.mode != "RGB":
+            # Прозрачность (png, gif) заливаем белым, а не черным
+            rgba = image.convert("RGBA")
+            image = Image.new("RGB", rgba.size, (255, 255, 255))
+            image.paste(rgba, mask=rgba.getchannel("A"))
+        output = BytesIO()
+        image.save(output, format="JPEG", quality=VISION_JPEG_QUALITY, optimize=True)
+    return output.getvalue()
+
+
+async def prepare_image(data):
+    """Возвращает (часть запроса Gemini с уменьшенным JPEG, sha256 исходных байтов)."""
+    digest = hashlib.sha256(data).hexdigest()
+    jpeg = await asyncio.to_thread(_downscale, data)
+    return {"mime_type": "image/jpeg", "data": jpeg}, digest
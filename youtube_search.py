@@ -0,0 +1,101 @@
+import logging
+import os
+import queue
+import re
+import threading
+import time
+
+import yt_dlp
+
+from metrics import external_call_seconds
+from ttl_cache import TTLCache
+
+# --- Поиск на YouTube ---
+# Экземпляры YoutubeDL создаются один раз и переиспользуются (экстракторы уже загружены,
+# HTTP-соединения открыты), а результаты поиска кешируются по нормализованному запросу.
+SEARCH_EXTRACTORS = int(os.getenv("SEARCH_EXTRACTORS", "2"))
+SEARCH_CACHE_SIZE = int(os.getenv("SEARCH_CACHE_SIZE", "512"))
+SEARCH_CACHE_TTL = int(os.getenv("SEARCH_CACHE_TTL", str(60 * 60)))  # прямые ссылки на поток живут несколько часов
+AUTOCOMPLETE_LIMIT = 25  # максимум вариантов в автодополнении Discord
+
+# Поля результата, которые нужны боту; остальное (списки форматов и т.п.) не храним
+ENTRY_FIELDS = ("id", "title", "webpage_url", "url", "acodec", "http_headers", "extractor_key", "duration")
+
+
+def normalize_query(query):
+    """Приводит похожие запросы к одному ключу: регистр, пробелы, знаки препинания."""
+    query = re.sub(r"[^\w\s]", " ", query.lower())
+    return " ".join(query.split())
+
+
+class SearchService:
+    """Поиск на YouTube с пулом прогретых экземпляров YoutubeDL и TTL/LRU-кешем результатов."""
+
+    def __init__(self, ydl_opts, extractors=SEARCH_EXTRACTORS, cache_size=SEARCH_CACHE_SIZE,
+                 cache_ttl=SEARCH_CACHE_TTL):
+        self._ydl_opts = ydl_opts
+        self._extractors = extractors
+        self._created = 0
+        self._created_lock = threading.Lock()
+        self._pool = queue.LifoQueue()
+        self.cache = TTLCache(cache_size, cache_ttl)
+
+    def _acquire(self):
+        try:
+            return self._pool.get_nowait()
+        except queue.Empty:
+            pass
+        with self._created_lock:
+            create = self._created < self._extractors
+            if create:
+                self._created += 1
+        if create:
+            return yt_dlp.YoutubeDL(self._ydl_opts)
+        return self._pool.get()
+
+    def _release(self, ydl):
+        self._pool.put(ydl)
+
+    def search(self, query, max_results=1):
+        """Возвращает до max_results результатов (блокирующий вызов, запускать в потоке)."""
+        key = normalize_query(query)
+        cached = self.cache.get(key)
+        if cached is not None and len(cached) >= max_results:
+            return cached[:max_results]
+
+        ydl = self._acquire()
+        try:
+            with external_call_seconds.time(service="ytdlp", op="search"):
+                result = ydl.extract_info(f"ytsearch{max_results}:{query}", download=False)
+            fetched_at = time.time()
+            entries = [
+                dict({field: entry.get(field) for field in ENTRY_FIELDS}, fetched_at=fetched_at)
+                for entry in result.get('entries', []) if entry
+            ]
+        except Exception as e:
+            logging.error(f"Ошибка при поиске на YouTube: {e}")
+            return []
+        finally:
+            self._release(ydl)
+
+        if entries:
+            self.cache.set(key, entries)
+        return entries
+
+    def suggest(self, text, limit=AUTOCOMPLETE_LIMIT):
+        """Варианты для автодополнения из кеша: (название, ссылка) для запросов, похожих на text."""
+        key = normalize_query(text)
+        suggestions = []
+        seen = set()
+        for query, entries in self.cache.items():
+            for entry in entries:
+                title = entry.get("title") or ""
+                if key and not (query.startswith(key) or key in normalize_query(title)):
+                    continue
+                url = entry.get("webpage_url")
+                if url and url not in seen:
+                    seen.add(url)
+                    suggestions.append((title, url))
+                    if len(suggestions) >= limit:
+                        return suggestions
+        return suggestions